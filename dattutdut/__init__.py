@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - DATTUTDUT engine
+The numerical part of QWaterModel. It can be used without QGIS:
+
+    from dattutdut import ModelParameters, run_model
+    result = run_model(lst, ModelParameters(utc='2017-08-07T06:00:00'),
+                       lon=13.4, lat=52.5)
+    le = result['le']
+
+The GDAL based raster input and output lives in dattutdut.raster_io and is
+only imported when it is used.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+from .model import (ModelParameters, ModelResult, allocate_buffers,
+                    compute_fluxes, default_precision, get_bands, get_dtype,
+                    get_valid_mask, mask_zeros, output_bands, precisions,
+                    required_bands, resolve_parameters, run_model)
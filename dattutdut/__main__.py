@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+'''Runs the command line interface with python -m dattutdut'''
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - batch mode
+This module runs the DATTUTDUT model over a series of thermal frames, e.g.
+the sequential drone frames in Data_Examples/Drone_Data. All frames share
+the same model parameters and every frame has its own utc time. The
+results are written per frame or into one stacked raster.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import csv
+import datetime
+import glob
+import os
+
+from . import model, solar
+
+# Suffix of the output files of a frame
+output_suffix = '_qwatermodel'
+
+
+def find_frames(pattern):
+    '''Returns the sorted list of frames for a directory (all .tif files in
+    it) or a glob pattern
+    :pattern : directory or glob pattern
+    '''
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.tif')
+    frames = sorted(glob.glob(pattern))
+    if not frames:
+        raise IOError('No frames found for {}'.format(pattern))
+    return frames
+
+def read_frame_times(times_file):
+    '''Reads a .csv file with one line "file name,utc" per frame and returns
+    a dictionary from the base name of the file to the utc
+    :times_file : path and file name of the .csv file
+    '''
+    times = {}
+    with open(times_file, newline='') as in_file:
+        for row in csv.reader(in_file):
+            if not row or row[0].startswith('#'):
+                continue
+            times[os.path.basename(row[0].strip())] = row[1].strip()
+    return times
+
+def get_frame_times(frames, utcs=None, times_file=None, start=None,
+                    interval=None):
+    '''Returns one utc datetime per frame. The times are parsed once here,
+    so a wrong time stops the batch before the first frame is computed.
+    :frames : list of frames
+    :utcs : list with one utc per frame
+    :times_file : .csv file as read by read_frame_times
+    :start : utc of the first frame, used with interval
+    :interval : seconds between two frames
+    '''
+    if utcs is not None:
+        if len(utcs) != len(frames):
+            raise ValueError('{} utc times given for {} frames'.format(
+                    len(utcs), len(frames)))
+        return [model.parse_utc(utc) for utc in utcs]
+    if times_file is not None:
+        times = read_frame_times(times_file)
+        missing = [frame for frame in frames
+                   if os.path.basename(frame) not in times]
+        if missing:
+            raise ValueError('No utc time for {}'.format(', '.join(missing)))
+        return [model.parse_utc(times[os.path.basename(frame)])
+                for frame in frames]
+    if start is not None and interval is not None:
+        start = model.parse_utc(start)
+        return [start + datetime.timedelta(seconds=float(interval) * i)
+                for i in range(len(frames))]
+    raise ValueError('Give utc times, a times file or start and interval')
+
+def get_output_name(frame, out_dir, extension='.tif'):
+    '''Returns the output file of a frame in out_dir'''
+    base_name = os.path.splitext(os.path.basename(frame))[0]
+    return os.path.join(out_dir, base_name + output_suffix + extension)
+
+def get_stack_grid(frames, grids):
+    '''Returns the geotransform and (rows, cols) of the stack raster: the
+    grid that covers all frames at the highest resolution, see
+    mosaic.get_common_grid. The frames must be north up and share their
+    projection.
+    :frames : list of frames
+    :grids : (geo, (rows, cols), prj) of every frame
+    '''
+    from . import mosaic
+
+    for frame, (geo, shape, prj) in zip(frames, grids):
+        mosaic.check_north_up(geo, frame)
+        if prj != grids[0][2]:
+            raise ValueError('{} has another projection than {}, the frames '
+                             'can not be stacked'.format(frame, frames[0]))
+    geo, rows, cols = mosaic.get_common_grid(
+            [geo for geo, shape, prj in grids],
+            [shape for geo, shape, prj in grids])
+    return geo, (rows, cols)
+
+def run_batch(frames, utcs, params=None, out_dir=None, stack_file=None,
+              write_stats=True, callback=None,
+              precision=model.default_precision, options=None, bands=None,
+              stats_format='text', profile=False, hooks=()):
+    '''Runs the DATTUTDUT model on every frame and returns the list of
+    resolved model parameters. One frame is held in memory at a time.
+    :frames : list of land surface temperature rasters
+    :utcs : list with one utc per frame, see get_frame_times
+    :params : ModelParameters shared by all frames, the utc is replaced
+    :out_dir : folder for one output raster (and stats file) per frame
+    :stack_file : GeoTIFF that gets the output bands of every frame, one
+        frame after the other, on the grid that covers all frames, see
+        get_stack_grid. It is deleted if the batch fails.
+    :write_stats : write the stats file of every frame into out_dir
+    :callback : function called with (index, frame, resolved) after each
+        frame
+    :precision : 'float32' or 'float64', the dtype of the computation and of
+        the output bands
+    :options : raster_io.OutputOptions of all output rasters
+    :bands : output bands to compute and write, all of them if None
+    :stats_format : format of the stats files, see stats.write_stats_file.
+        The text format of the plugin and CSV are written to .csv files,
+        JSON to .json files.
+    :profile : measure the stages of every frame, see instrumentation, and
+        write them into a .profile.json sidecar next to the stats file of
+        every frame
+    :hooks : functions called with every instrumentation.StageRecord, the
+        stages are measured if any are given
+    '''
+    from . import instrumentation, raster_io, stats, temporal
+
+    if out_dir is None and stack_file is None:
+        raise ValueError('Give an output folder, a stack file or both')
+    model.get_dtype(precision)
+    bands = model.get_bands(bands)
+    if stats_format not in stats.stats_formats:
+        raise ValueError('Unknown stats format {}, use one of {}'.format(
+                stats_format, ', '.join(stats.stats_formats)))
+    stats_extension = '.json' if stats_format == 'json' else '.csv'
+    if len(utcs) != len(frames):
+        raise ValueError('{} utc times given for {} frames'.format(
+                len(utcs), len(frames)))
+    if params is None:
+        params = model.ModelParameters()
+    if out_dir is not None and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # the grids of all frames are read before anything is written
+    grids = []
+    for frame in frames:
+        frame_raster = raster_io.get_dataset(frame)
+        grids.append((frame_raster.GetGeoTransform(),
+                      (frame_raster.RasterYSize, frame_raster.RasterXSize),
+                      frame_raster.GetProjection()))
+    # the sun angles of all frames are computed in one vectorized call
+    locations = [raster_io.get_lon_lat(geo) for geo, shape, prj in grids]
+    solar.prime_cache(
+            [model.parse_utc(utc) for utc in utcs],
+            [lon if params.longitude is None else params.longitude
+             for lon, lat in locations],
+            [lat if params.latitude is None else params.latitude
+             for lon, lat in locations])
+    if options is None:
+        options = raster_io.OutputOptions()
+    # the driver is looked up once for all frames
+    driver = raster_io.gdal.GetDriverByName('GTiff')
+    nbands = len(bands)
+    stack_raster = band = None
+    resolved_list = []
+    try:
+        if stack_file is not None:
+            stack_geo, stack_shape = get_stack_grid(frames, grids)
+            stack_raster = raster_io.create_output_raster(
+                    stack_file, stack_shape[0], stack_shape[1], stack_geo,
+                    grids[0][2], nbands * len(frames), driver, precision,
+                    options)
+        for index, (frame, utc) in enumerate(zip(frames, utcs)):
+            profiler = None
+            if profile or hooks or instrumentation.hooks:
+                profiler = instrumentation.Profiler(frame, hooks)
+            lst, prj, geo = instrumentation.measure_read(profiler, frame,
+                                                         precision)
+            lon, lat = raster_io.get_lon_lat(geo)
+            frame_params = params.copy(utc=utc)
+            # one validity mask for the percentiles and the fluxes
+            valid = model.get_valid_mask(lst)
+            tmin, tmax = instrumentation.measure(
+                    profiler, 'percentiles', model.get_tmin_tmax, lst,
+                    frame_params.tmin, frame_params.tmax,
+                    frame_params.tmin_thres, frame_params.tmax_thres,
+                    valid=valid)
+            result = instrumentation.measure(
+                    profiler, 'fluxes', model.run_model, lst,
+                    frame_params.copy(tmin=tmin, tmax=tmax), lon, lat,
+                    bands=bands, valid=valid)
+            if out_dir is not None:
+                instrumentation.measure_write(
+                        profiler, get_output_name(frame, out_dir),
+                        result.fluxes, geo, prj, driver, options, bands)
+                if write_stats:
+                    instrumentation.measure_stats(
+                            profiler, stats.write_stats_file,
+                            get_output_name(frame, out_dir, stats_extension),
+                            frame, result, stats_format=stats_format)
+                if profile:
+                    profiler.write_json(instrumentation.get_sidecar_file(
+                            get_output_name(frame, out_dir)))
+            if stack_raster is not None:
+                frame_name = os.path.splitext(os.path.basename(frame))[0]
+                for band_index, flux_name in enumerate(bands):
+                    band = stack_raster.GetRasterBand(
+                            index * nbands + band_index + 1)
+                    band.SetDescription('{} {}'.format(frame_name, flux_name))
+                    # every frame is placed at its position on the stack
+                    band.WriteArray(raster_io.fill_nodata(temporal.regrid(
+                            result.fluxes[flux_name], geo, stack_geo,
+                            stack_shape), options.nodata))
+            resolved_list.append(result.parameters)
+            if callback is not None:
+                callback(index, frame, result.parameters)
+            # free the arrays of this frame before the next one is read
+            del lst, result
+
+        if stack_raster is not None:
+            stack_raster.FlushCache()
+            stack_raster = band = None
+            raster_io.finish_output_raster(stack_file, options)
+    except BaseException:
+        # an unfinished stack must not be taken for a result
+        if stack_file is not None:
+            stack_raster = band = None
+            for path in (stack_file, stack_file + raster_io.cog_work_suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+        raise
+    return resolved_list
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - benchmarks
+This module measures the speed of the model stages (read, percentiles,
+fluxes, write and stats) on the rasters of Data_Examples and on synthetic
+land surface temperature rasters of any size, e.g.
+
+    python -m dattutdut benchmark --synthetic 4096 16384 --json bench.json
+
+Every stage reports its wall time, the peak of the memory it allocated
+(tracemalloc), the peak resident set size of the process and the
+throughput in pixels per second. Rasters that are too large for memory
+are run with the streaming mode instead, as one stage.
+measure_startup (benchmark --startup) measures what the plugin adds to the
+start of QGIS instead.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+from . import instrumentation, model
+
+# Folder of the example rasters of the plugin
+data_examples = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'Data_Examples')
+# Folders of Data_Examples that are benchmarked
+example_sets = ('Drone_Data', 'Handheld_Camera_Data')
+# Time of the example frames, see Data_Examples/README.txt
+example_utc = '2017-08-07T06:00:00'
+# Rasters with more pixels are benchmarked with the streaming mode
+default_max_memory_pixels = 2**26
+# Stages of an in-memory run
+stages = ('read', 'percentiles', 'fluxes', 'write', 'stats')
+# Folder of the plugin
+plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules of the plugin that QGIS imports at startup, see classFactory and
+# initProcessing
+startup_modules = ('qwatermodel', 'qwatermodel_provider')
+# Modules that are only imported on the first run of the plugin, the ones
+# of the plugin without the package name
+deferred_modules = ('numpy', 'osgeo.gdal', 'dattutdut', 'qwatermodel_dialog',
+                    'qwatermodel_task')
+# Modules QGIS has imported before it loads the plugins, their import time
+# is not counted
+qgis_modules = ('qgis.core', 'qgis.gui', 'qgis.PyQt.QtWidgets')
+# Runs in a new interpreter and prints the import time of the plugin
+startup_script = '''
+import json, sys, time
+sys.path.insert(0, {parent!r})
+try:
+    for name in {qgis_modules!r}:
+        __import__(name)
+except ImportError as error:
+    print(json.dumps({{'error': str(error)}}))
+    sys.exit(0)
+before = set(sys.modules)
+start = time.perf_counter()
+__import__({package!r})
+for name in {startup_modules!r}:
+    __import__({package!r} + '.' + name)
+seconds = time.perf_counter() - start
+imported = set(sys.modules) - before
+print(json.dumps({{'seconds': seconds, 'modules': sorted(imported)}}))
+'''
+
+
+def parse_size(text):
+    '''Returns (rows, cols) of a size like "4096" or "2048x8192"'''
+    try:
+        values = [int(value) for value in text.lower().split('x')]
+    except ValueError:
+        values = []
+    if len(values) == 1:
+        values *= 2
+    if len(values) != 2 or min(values) <= 0:
+        raise ValueError('Give sizes as ROWS or ROWSxCOLS, not {}'.format(text))
+    return tuple(values)
+
+def write_synthetic_raster(out_file, rows, cols, seed=0, strip_rows=1024):
+    '''Writes a float32 land surface temperature raster with values between
+    290 and 320 K and a few zeros (no data), strip by strip, so rasters
+    larger than the memory can be written
+    :out_file : path and file name of the GeoTIFF
+    :rows : number of rows
+    :cols : number of columns
+    :seed : seed of the random values
+    :strip_rows : rows per written strip
+    '''
+    from . import raster_io
+
+    geo = (13.0, 1e-5, 0, 52.0, 0, -1e-5)
+    options = raster_io.OutputOptions(compress='NONE', bigtiff='IF_NEEDED')
+    out_raster = raster_io.create_output_raster(out_file, rows, cols, geo, '',
+                                                1, options=options)
+    band = out_raster.GetRasterBand(1)
+    rng = np.random.default_rng(seed)
+    for yoff in range(0, rows, strip_rows):
+        strip = rng.uniform(290.0, 320.0, (min(strip_rows, rows - yoff),
+                                           cols)).astype(np.float32)
+        strip[:, :cols // 100] = 0.0
+        band.WriteArray(strip, 0, yoff)
+    out_raster.FlushCache()
+    del band, out_raster
+    raster_io.finish_output_raster(out_file, options)
+    return out_file
+
+def benchmark_in_memory(in_file, out_dir, params, name=None, bands=None):
+    '''Runs the stages of the plugin one after the other on a raster and
+    returns their StageRecords
+    :in_file : land surface temperature raster
+    :out_dir : folder for the output raster and the stats file
+    :params : ModelParameters
+    :name : name of the raster in the records, the file name if None
+    :bands : output bands to compute and write
+    '''
+    from . import raster_io, stats
+
+    profiler = instrumentation.Profiler(name or os.path.basename(in_file))
+    lst, prj, geo = instrumentation.measure_read(profiler, in_file,
+                                                 use_cache=False)
+    lon, lat = raster_io.get_lon_lat(geo)
+    tmin, tmax = profiler.measure('percentiles', model.get_tmin_tmax, lst,
+                                  params.tmin, params.tmax, params.tmin_thres,
+                                  params.tmax_thres)
+    result = profiler.measure('fluxes', model.run_model, lst,
+                              params.copy(tmin=tmin, tmax=tmax), lon, lat,
+                              bands=bands)
+    instrumentation.measure_write(profiler,
+                                  os.path.join(out_dir, 'benchmark_out.tif'),
+                                  result.fluxes, geo, prj, bands=bands)
+    instrumentation.measure_stats(profiler, stats.write_output_stats,
+                                  os.path.join(out_dir, 'benchmark_stats.csv'),
+                                  in_file, result)
+    return profiler.records
+
+def benchmark_streaming(in_file, out_dir, params, name=None, workers=1,
+                        bands=None):
+    '''Runs the streaming mode on a raster and returns its StageRecord'''
+    from . import raster_io, streaming
+
+    out_file = os.path.join(out_dir, 'benchmark_out.tif')
+    raster = raster_io.open_raster(in_file)
+    profiler = instrumentation.Profiler(name or os.path.basename(in_file))
+    profiler.pixels = raster.RasterXSize * raster.RasterYSize
+    del raster
+    profiler.measure('streaming', streaming.run_streaming, in_file, out_file,
+                     params, workers=workers, bands=bands,
+                     bytes_read=instrumentation.file_bytes([in_file]),
+                     bytes_written=lambda value: instrumentation.file_bytes(
+                             raster_io.get_output_files(out_file,
+                                                        bands=bands)))
+    return profiler.records
+
+def find_examples(data_dir=None):
+    '''Returns the rasters of the example sets in data_dir, the
+    Data_Examples of the plugin if None'''
+    if data_dir is None:
+        data_dir = data_examples
+    rasters = []
+    for example_set in example_sets:
+        rasters.extend(sorted(glob.glob(os.path.join(data_dir, example_set,
+                                                     '*.tif'))))
+    return rasters
+
+def run_benchmarks(rasters=(), synthetic_sizes=(), work_dir=None,
+                   params=None, workers=1, repeat=1,
+                   max_memory_pixels=default_max_memory_pixels, bands=None,
+                   callback=None):
+    '''Benchmarks rasters and synthetic rasters of the given sizes and
+    returns the list of StageRecords
+    :rasters : land surface temperature rasters, e.g. find_examples()
+    :synthetic_sizes : list of (rows, cols) of synthetic rasters, they are
+        written into work_dir and deleted afterwards
+    :work_dir : folder for the synthetic rasters and the outputs
+    :params : ModelParameters, the dialog defaults with example_utc if None
+    :workers : workers of the streaming mode
+    :repeat : runs per raster, every run is recorded
+    :max_memory_pixels : larger rasters are run with the streaming mode
+    :bands : output bands to compute and write
+    :callback : function called with the records of every run
+    '''
+    from . import raster_io
+
+    if params is None:
+        params = model.ModelParameters(utc=example_utc)
+    own_dir = work_dir is None
+    if own_dir:
+        work_dir = tempfile.mkdtemp(prefix='qwatermodel_benchmark_')
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    jobs = [(raster, os.path.basename(raster), False) for raster in rasters]
+    jobs += [(None, 'synthetic_{}x{}'.format(rows, cols), True)
+             for rows, cols in synthetic_sizes]
+    records = []
+    try:
+        for index, (in_file, name, synthetic) in enumerate(jobs):
+            if synthetic:
+                rows, cols = synthetic_sizes[index - len(rasters)]
+                in_file = write_synthetic_raster(
+                        os.path.join(work_dir, name + '.tif'), rows, cols)
+            raster = raster_io.open_raster(in_file)
+            pixels = raster.RasterXSize * raster.RasterYSize
+            del raster
+            for run in range(repeat):
+                if pixels > max_memory_pixels:
+                    run_records = benchmark_streaming(
+                            in_file, work_dir, params, name, workers, bands)
+                else:
+                    run_records = benchmark_in_memory(in_file, work_dir,
+                                                      params, name, bands)
+                records.extend(run_records)
+                if callback is not None:
+                    callback(run_records)
+            if synthetic:
+                raster_io.close_datasets()
+                os.remove(in_file)
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return records
+
+def summarize(records):
+    '''Returns one dictionary per raster and stage with the median wall
+    time and throughput and the largest memory peaks of all runs'''
+    groups = {}
+    for record in records:
+        groups.setdefault((record.raster, record.stage), []).append(record)
+    summary = []
+    for (raster, stage), group in groups.items():
+        seconds = float(np.median([record.seconds for record in group]))
+        peak_rss = [record.peak_rss for record in group
+                    if record.peak_rss is not None]
+        summary.append({
+                'raster': raster, 'stage': stage, 'runs': len(group),
+                'pixels': group[0].pixels, 'seconds': seconds,
+                'pixels_per_second': (group[0].pixels / seconds if seconds > 0
+                                      else float('inf')),
+                'bytes_read': max(record.bytes_read for record in group),
+                'bytes_written': max(record.bytes_written for record in group),
+                'peak_alloc': max(record.peak_alloc for record in group),
+                'peak_rss': max(peak_rss) if peak_rss else None})
+    return summary
+
+def format_summary(summary):
+    '''Returns the summary as text table'''
+    lines = ['{:<28} {:<12} {:>12} {:>10} {:>14} {:>12} {:>12}'.format(
+            'raster', 'stage', 'pixels', 'seconds', 'Mpixels/s',
+            'alloc [MiB]', 'RSS [MiB]')]
+    for row in summary:
+        lines.append('{:<28} {:<12} {:>12} {:>10.4f} {:>14.2f} {:>12.1f} '
+                     '{:>12}'.format(
+                             row['raster'][:28], row['stage'], row['pixels'],
+                             row['seconds'], row['pixels_per_second'] / 1e6,
+                             row['peak_alloc'] / 2**20,
+                             '-' if row['peak_rss'] is None else
+                             '{:.1f}'.format(row['peak_rss'] / 2**20)))
+    return '\n'.join(lines)
+
+def measure_startup(plugin=None, python=None, repeat=5):
+    '''Measures how long QGIS takes to import the plugin when it starts:
+    the plugin package and startup_modules are imported in a new
+    interpreter, after the QGIS modules, repeat times. Returns a dictionary
+    with the median and all times [s], the number of modules the plugin
+    imports and the deferred_modules among them, which should be empty.
+    :plugin : folder of the plugin, the one of this package if None
+    :python : Python interpreter with the QGIS bindings, this one if None
+    :repeat : number of new interpreters
+    '''
+    if plugin is None:
+        plugin = plugin_dir
+    plugin = os.path.abspath(plugin)
+    package = os.path.basename(plugin)
+    script = startup_script.format(
+            parent=os.path.dirname(plugin), package=package,
+            qgis_modules=qgis_modules, startup_modules=startup_modules)
+    runs = []
+    for run in range(repeat):
+        process = subprocess.run([python or sys.executable, '-c', script],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        if process.returncode != 0:
+            raise IOError('The plugin could not be imported:\n{}'.format(
+                    process.stderr.strip()))
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        if 'error' in result:
+            raise IOError('The startup benchmark needs the QGIS Python '
+                          'bindings: {}'.format(result['error']))
+        runs.append(result)
+    deferred = [name for name in deferred_modules
+                if name in runs[0]['modules'] or
+                '{}.{}'.format(package, name) in runs[0]['modules']]
+    return {'plugin': plugin,
+            'seconds': float(np.median([run['seconds'] for run in runs])),
+            'runs': [run['seconds'] for run in runs],
+            'modules': len(runs[0]['modules']),
+            'deferred_imported': deferred}
+
+def format_startup(startup):
+    '''Returns the result of measure_startup as text'''
+    text = 'plugin import at QGIS startup: {:.1f} ms (median of {} runs), ' \
+           '{} modules'.format(startup['seconds'] * 1000, len(startup['runs']),
+                               startup['modules'])
+    if startup['deferred_imported']:
+        text += '\nimported too early: {}'.format(
+                ', '.join(startup['deferred_imported']))
+    return text
+
+def write_benchmark_json(out_file, records):
+    '''Writes all records and their summary to a JSON file, e.g. to compare
+    two versions of the plugin'''
+    document = {'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'records': [record.as_dict() for record in records],
+                'summary': summarize(records)}
+    with open(out_file, 'w') as output_file:
+        json.dump(document, output_file, indent=2)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - caches
+A least recently used cache with a memory budget. raster_io keeps the
+decoded land surface temperatures in it, so running the model again on
+the same raster, e.g. with another emissivity, does not read the file
+again.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import collections
+import os
+import threading
+
+# Default memory budget of the raster cache [bytes]
+default_budget = 512 * 2**20
+
+
+def get_file_key(path):
+    '''Returns (absolute path, modification time, size) of a file, so a key
+    changes when the file is written again, or None if the path is not a
+    local file (e.g. a GDAL virtual file system path)
+    :path : path and file name
+    '''
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return os.path.abspath(path), status.st_mtime_ns, status.st_size
+
+
+class ArrayCache:
+    '''Least recently used cache of values that hold NumPy arrays. The sum
+    of the sizes of all values is kept below a memory budget by dropping
+    the least recently used values. The cache can be shared by threads.
+    '''
+
+    def __init__(self, max_bytes=default_budget):
+        '''Constructor.
+        :param max_bytes: memory budget in bytes, 0 disables the cache
+        '''
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key):
+        '''Returns the value of key and marks it as recently used, or None'''
+        with self._lock:
+            if key not in self._values:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key][0]
+
+    def put(self, key, value, nbytes):
+        '''Stores a value. Values larger than the budget are not stored.
+        :key : hashable key
+        :value : value to store
+        :nbytes : memory used by the value [bytes]
+        '''
+        with self._lock:
+            if key in self._values:
+                self.nbytes -= self._values.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._values[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        '''Drops least recently used values until the budget is kept'''
+        while self.nbytes > self.max_bytes and self._values:
+            self.nbytes -= self._values.popitem(last=False)[1][1]
+
+    def set_budget(self, max_bytes):
+        '''Changes the memory budget and drops values that do not fit'''
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def discard(self, match):
+        '''Drops all values whose key matches, e.g. the old versions of a
+        file that was written again
+        :match : function that takes a key and returns True to drop it
+        '''
+        with self._lock:
+            for key in [key for key in self._values if match(key)]:
+                self.nbytes -= self._values.pop(key)[1]
+
+    def clear(self):
+        '''Drops all values'''
+        with self._lock:
+            self._values.clear()
+            self.nbytes = 0
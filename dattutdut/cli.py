@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - command line interface
+Runs the DATTUTDUT model without QGIS, e.g.
+
+    python -m dattutdut batch Data_Examples/Drone_Data \
+        --start 2017-08-07T02:00:00 --interval 1800 --out-dir results
+
+scripts/qwatermodel runs the jobs of a manifest, see jobs.
+
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import argparse
+import sys
+import numpy as np
+
+from . import model, mosaic, stats, temporal
+
+# Help texts of the model parameters, the same fields as in the dialog
+parameter_help = {
+    'tmin_thres': 'percentile of the image used as tmin',
+    'tmax_thres': 'percentile of the image used as tmax',
+    'tmin': 'minimum temperature [K]',
+    'tmax': 'maximum temperature [K]',
+    'surf_emis': 'surface emissivity [-]',
+    'atm_trans': 'atmospheric transmissivity [-]',
+    'atm_emis': 'atmospheric emissivity [-]',
+    'air_temp': 'air temperature [K]',
+    'time_period': 'time period for the water amount [s]',
+    'sw_irr': 'short-wave irradiance [W/m²]',
+    'g_percentage': 'ground heat flux in percent of rn [%%]',
+    'rn': 'net radiation [W/m²]',
+    'longitude': 'longitude [dec], taken from the raster if not given',
+    'latitude': 'latitude [dec], taken from the raster if not given',
+}
+
+
+def add_parameter_arguments(parser):
+    '''Adds one option per model parameter to an argument parser. An empty
+    value ("") lets the model derive the parameter, like an empty field in
+    the dialog.
+    '''
+    group = parser.add_argument_group(
+            'model parameters', 'defaults as in the dialog, pass "" to '
+            'derive a parameter from the image')
+    for name in model.ModelParameters.names:
+        if name == 'utc':
+            continue
+        group.add_argument('--' + name.replace('_', '-'), dest=name,
+                           metavar='VALUE', help=parameter_help[name])
+
+def add_output_arguments(parser, flux_bands=True):
+    '''Adds the creation options of the output GeoTIFFs to an argument
+    parser, see raster_io.OutputOptions. Without flux_bands the options to
+    select and split the flux bands are left out.'''
+    from .raster_io import bigtiff_modes, compressions
+
+    group = parser.add_argument_group('output rasters')
+    group.add_argument('--compress', choices=compressions, default='DEFLATE',
+                       help='compression (default: %(default)s)')
+    group.add_argument('--level', type=int,
+                       help='compression level of DEFLATE or ZSTD')
+    group.add_argument('--max-z-error', type=float,
+                       help='largest error of the lossy LERC compressions')
+    group.add_argument('--no-predictor', action='store_true',
+                       help='do not use the floating point predictor')
+    group.add_argument('--block-size', type=int, default=256,
+                       help='size of the tiles (default: %(default)s)')
+    group.add_argument('--striped', action='store_true',
+                       help='write strips instead of tiles')
+    group.add_argument('--bigtiff', choices=bigtiff_modes, default='IF_SAFER',
+                       help='BIGTIFF creation option (default: %(default)s)')
+    group.add_argument('--overviews', metavar='auto|FACTORS',
+                       help='"auto" or comma separated factors, e.g. 2,4,8')
+    group.add_argument('--resampling', default='AVERAGE',
+                       help='resampling of the overviews (default: '
+                       '%(default)s)')
+    group.add_argument('--cog', action='store_true',
+                       help='write Cloud-Optimized GeoTIFFs (GDAL 3.1 or '
+                       'later)')
+    group.add_argument('--nodata', type=float, default=float('nan'),
+                       help='nodata value of the output bands (default: '
+                       'NaN)')
+    if not flux_bands:
+        return
+    group.add_argument('--bands', type=model.get_bands,
+                       default=model.output_bands, metavar='BANDS',
+                       help='comma separated output bands (default: {})'.format(
+                               ','.join(model.output_bands)))
+    group.add_argument('--band-files', action='store_true',
+                       help='write every band into its own file')
+    group.add_argument('--vrt', action='store_true',
+                       help='write every band into its own file and a .vrt '
+                       'file that stacks them')
+
+def output_options_from_args(args):
+    '''Returns the raster_io.OutputOptions for the options of
+    add_output_arguments'''
+    from .raster_io import OutputOptions
+
+    overviews = args.overviews
+    if overviews is not None and overviews != 'auto':
+        try:
+            overviews = [int(factor) for factor in overviews.split(',')]
+        except ValueError:
+            raise ValueError('--overviews needs "auto" or factors like 2,4,8')
+    return OutputOptions(tiled=not args.striped, block_size=args.block_size,
+                         compress=args.compress,
+                         predictor=not args.no_predictor, level=args.level,
+                         max_z_error=args.max_z_error, bigtiff=args.bigtiff,
+                         overviews=overviews, resampling=args.resampling,
+                         cog=args.cog,
+                         band_files=getattr(args, 'band_files', False),
+                         vrt=getattr(args, 'vrt', False), nodata=args.nodata)
+
+def parameters_from_args(args):
+    '''Returns the ModelParameters for the options of add_parameter_arguments,
+    parameters that were not given keep their default'''
+    fields = {}
+    for name in model.ModelParameters.names:
+        # utc is a list of times per frame, the commands set it per frame
+        if name == 'utc':
+            continue
+        value = getattr(args, name, None)
+        if value is not None:
+            fields[name] = value
+    return model.ModelParameters.from_strings(**fields)
+
+def run_batch_command(args):
+    '''Runs the batch subcommand'''
+    from . import batch, instrumentation
+
+    frames = batch.find_frames(args.input)
+    utcs = batch.get_frame_times(frames, args.utc, args.times, args.start,
+                                 args.interval)
+    params = parameters_from_args(args)
+    options = output_options_from_args(args)
+
+    def report(index, frame, resolved):
+        print('{}/{} {} tmin={:.2f} tmax={:.2f}'.format(
+                index + 1, len(frames), frame, resolved.tmin, resolved.tmax))
+
+    def print_record(record):
+        print(instrumentation.format_record(record))
+
+    batch.run_batch(frames, utcs, params, args.out_dir, args.stack,
+                    not args.no_stats, report, args.precision, options,
+                    args.bands, args.stats_format, args.profile,
+                    [print_record] if args.profile else ())
+    return 0
+
+def run_temporal_command(args):
+    '''Runs the temporal subcommand'''
+    from . import batch
+
+    frames = batch.find_frames(args.input)
+    utcs = batch.get_frame_times(frames, args.utc, args.times, args.start,
+                                 args.interval)
+    # the frames are integrated in time order
+    frames, utcs = zip(*sorted(zip(frames, utcs), key=lambda item: item[1]))
+
+    def report(index, frame, resolved):
+        print('{}/{} {} tmin={:.2f} tmax={:.2f}'.format(
+                index + 1, len(frames), frame, resolved.tmin, resolved.tmax))
+
+    result = temporal.run_temporal(
+            list(frames), list(utcs), parameters_from_args(args), args.out,
+            args.method, args.period_start, args.period_end,
+            args.available_energy, args.precision,
+            output_options_from_args(args), report)
+    et = result['et']
+    if (~np.isnan(et)).any():
+        print('et {} to {}: mean {:.3f} mm, min {:.3f} mm, max {:.3f} '
+              'mm'.format(model.format_utc(result.start),
+                          model.format_utc(result.end), np.nanmean(et),
+                          np.nanmin(et), np.nanmax(et)))
+    return 0
+
+def run_mosaic_command(args):
+    '''Runs the mosaic subcommand'''
+    from . import batch
+
+    frames = batch.find_frames(args.input)
+    utcs = args.utc
+    if utcs is not None and len(utcs) == 1:
+        # one utc for all frames
+        utcs = utcs * len(frames)
+    utcs = batch.get_frame_times(frames, utcs, args.times, args.start,
+                                 args.interval)
+    resolved = mosaic.run_mosaic(
+            frames, args.out, utcs, parameters_from_args(args), args.overlap,
+            args.grid_resolution, args.vrt_file, args.tile_size, args.workers,
+            args.executor, precision=args.precision,
+            options=output_options_from_args(args), bands=args.bands)
+    print('{} frames, tmin={:.2f} tmax={:.2f}'.format(
+            len(frames), resolved[0].tmin, resolved[0].tmax))
+    return 0
+
+def run_jobs_command(args):
+    '''Runs the run subcommand, returns 1 if a job failed'''
+    from . import jobs
+
+    job_list = jobs.load_jobs(args.manifest)
+
+    def report(status):
+        if args.quiet and status.state != 'failed':
+            return
+        text = '{} {}'.format(status.state, status.job.in_file)
+        if status.error is not None:
+            text += ': ' + status.error
+        print(text, file=sys.stderr if status.state == 'failed'
+              else sys.stdout)
+
+    statuses = jobs.run_jobs(job_list, args.workers or None, args.executor,
+                             args.force, report)
+    counts = {state: sum(status.state == state for status in statuses)
+              for state in jobs.job_states}
+    print('{done} done, {skipped} skipped, {failed} failed'.format(**counts))
+    return 1 if counts['failed'] else 0
+
+def add_time_arguments(parser):
+    '''Adds the options that give the utc of every frame, see
+    batch.get_frame_times'''
+    times = parser.add_mutually_exclusive_group(required=True)
+    times.add_argument('--utc', nargs='+', metavar='UTC',
+                       help='one utc (YYYY-MM-DDTHH:MM:SS) per frame')
+    times.add_argument('--times', metavar='CSV',
+                       help='.csv file with "file name,utc" per frame')
+    times.add_argument('--start', metavar='UTC',
+                       help='utc of the first frame, use with --interval')
+    parser.add_argument('--interval', type=float, metavar='SECONDS',
+                        help='seconds between two frames')
+
+def add_precision_argument(parser):
+    '''Adds the floating point precision option to an argument parser'''
+    parser.add_argument('--precision', choices=sorted(model.precisions),
+                        default=model.default_precision,
+                        help='floating point precision of the computation '
+                        'and the output (default: %(default)s)')
+
+def run_benchmark_command(args):
+    '''Runs the benchmark subcommand'''
+    from . import benchmark
+
+    if args.startup:
+        print(benchmark.format_startup(benchmark.measure_startup(
+                python=args.python, repeat=args.repeat)))
+        return 0
+    rasters = list(args.rasters)
+    if not args.no_examples:
+        rasters = benchmark.find_examples(args.data) + rasters
+    sizes = [benchmark.parse_size(size) for size in args.synthetic]
+    if not rasters and not sizes:
+        raise ValueError('Nothing to benchmark, give rasters or --synthetic '
+                         'sizes')
+
+    def report(records):
+        for record in records:
+            print('{} {} {:.4f} s {:.2f} Mpixels/s'.format(
+                    record.raster, record.stage, record.seconds,
+                    record.pixels_per_second / 1e6))
+
+    records = benchmark.run_benchmarks(
+            rasters, sizes, args.work_dir, parameters_from_args(args),
+            args.workers, args.repeat, args.max_memory_pixels, args.bands,
+            None if args.quiet else report)
+    print(benchmark.format_summary(benchmark.summarize(records)))
+    if args.json is not None:
+        benchmark.write_benchmark_json(args.json, records)
+    return 0
+
+def build_parser():
+    '''Returns the argument parser of the command line interface'''
+    parser = argparse.ArgumentParser(
+            prog='dattutdut',
+            description='Calculate evapotranspiration from thermal images '
+            'with the DATTUTDUT energy-balance model.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    batch_parser = subparsers.add_parser(
+            'batch', help='run the model over a series of frames')
+    batch_parser.add_argument(
+            'input', help='folder with .tif frames or a glob pattern')
+    add_time_arguments(batch_parser)
+    batch_parser.add_argument('--out-dir',
+                              help='folder for one output raster per frame')
+    batch_parser.add_argument('--stack',
+                              help='GeoTIFF with the bands of all frames')
+    batch_parser.add_argument('--no-stats', action='store_true',
+                              help='do not write a stats file per frame')
+    batch_parser.add_argument('--stats-format', choices=stats.stats_formats,
+                              default='text',
+                              help='format of the stats files: the text of '
+                              'the plugin, CSV with one row per band or JSON '
+                              '(default: %(default)s)')
+    add_precision_argument(batch_parser)
+    batch_parser.add_argument('--profile', action='store_true',
+                              help='print the time, bytes and memory of '
+                              'every stage and write them into a '
+                              '.profile.json file per frame')
+    add_parameter_arguments(batch_parser)
+    add_output_arguments(batch_parser)
+    batch_parser.set_defaults(func=run_batch_command)
+
+    temporal_parser = subparsers.add_parser(
+            'temporal', help='integrate a series of frames to the '
+            'evapotranspiration of the period')
+    temporal_parser.add_argument(
+            'input', help='folder with .tif frames or a glob pattern')
+    add_time_arguments(temporal_parser)
+    temporal_parser.add_argument('--out', required=True,
+                                 help='GeoTIFF with the bands et [mm], ef, '
+                                 'hours and frames')
+    temporal_parser.add_argument('--method', choices=temporal.methods,
+                                 default='trapezoid',
+                                 help='integrate le over time or multiply '
+                                 'the mean ef with the available energy '
+                                 '(default: %(default)s)')
+    temporal_parser.add_argument('--period-start', metavar='UTC',
+                                 help='utc at which le is 0, e.g. sunrise')
+    temporal_parser.add_argument('--period-end', metavar='UTC',
+                                 help='utc at which le is 0 again, e.g. '
+                                 'sunset')
+    temporal_parser.add_argument('--available-energy', type=float,
+                                 metavar='MJ/M2',
+                                 help='available energy rn - g of the period '
+                                 'for --method ef [MJ/m²], integrated from '
+                                 'the frames if not given')
+    add_precision_argument(temporal_parser)
+    add_parameter_arguments(temporal_parser)
+    add_output_arguments(temporal_parser, flux_bands=False)
+    temporal_parser.set_defaults(func=run_temporal_command)
+
+    mosaic_parser = subparsers.add_parser(
+            'mosaic', help='run the model on overlapping frames into one '
+            'output raster')
+    mosaic_parser.add_argument(
+            'input', help='folder with .tif frames or a glob pattern')
+    add_time_arguments(mosaic_parser)
+    mosaic_parser.add_argument('--out', required=True,
+                               help='output raster on the common grid')
+    mosaic_parser.add_argument('--overlap', choices=mosaic.overlap_rules,
+                               default='first',
+                               help='how overlapping frames are combined '
+                               '(default: %(default)s)')
+    mosaic_parser.add_argument('--grid-resolution',
+                               choices=mosaic.grid_resolutions,
+                               default='highest',
+                               help='pixel size of the common grid '
+                               '(default: %(default)s)')
+    mosaic_parser.add_argument('--vrt-file',
+                               help='also write a VRT of the input frames')
+    mosaic_parser.add_argument('--tile-size', type=int,
+                               default=mosaic.default_tile_size,
+                               help='size of the windows (default: '
+                               '%(default)s)')
+    mosaic_parser.add_argument('--workers', type=int, default=1,
+                               help='workers of the percentile pre-pass '
+                               '(default: %(default)s)')
+    mosaic_parser.add_argument('--executor', choices=('thread', 'process'),
+                               default='thread',
+                               help='pool of the workers (default: '
+                               '%(default)s)')
+    add_precision_argument(mosaic_parser)
+    add_parameter_arguments(mosaic_parser)
+    add_output_arguments(mosaic_parser)
+    mosaic_parser.set_defaults(func=run_mosaic_command)
+
+    run_parser = subparsers.add_parser(
+            'run', help='run the jobs of a YAML or JSON manifest')
+    run_parser.add_argument('manifest',
+                            help='.yaml, .yml or .json file with the jobs')
+    run_parser.add_argument('--workers', type=int, default=1,
+                            help='jobs run at the same time, 0 for one per '
+                            'CPU core (default: %(default)s)')
+    run_parser.add_argument('--executor', choices=('thread', 'process'),
+                            default='thread',
+                            help='pool of the workers (default: '
+                            '%(default)s)')
+    run_parser.add_argument('--force', action='store_true',
+                            help='also run the jobs whose outputs are up to '
+                            'date')
+    run_parser.add_argument('--quiet', action='store_true',
+                            help='only print failed jobs and the summary')
+    run_parser.set_defaults(func=run_jobs_command)
+
+    benchmark_parser = subparsers.add_parser(
+            'benchmark', help='measure the speed of the model stages')
+    benchmark_parser.add_argument(
+            'rasters', nargs='*',
+            help='more land surface temperature rasters to benchmark')
+    benchmark_parser.add_argument(
+            '--data', default=None,
+            help='Data_Examples folder (default: the one of the plugin)')
+    benchmark_parser.add_argument('--no-examples', action='store_true',
+                                  help='do not benchmark Data_Examples')
+    benchmark_parser.add_argument(
+            '--synthetic', nargs='+', default=[], metavar='SIZE',
+            help='sizes of synthetic rasters, ROWS or ROWSxCOLS')
+    benchmark_parser.add_argument('--repeat', type=int, default=3,
+                                  help='runs per raster (default: '
+                                  '%(default)s)')
+    benchmark_parser.add_argument('--workers', type=int, default=1,
+                                  help='workers of the streaming mode '
+                                  '(default: %(default)s)')
+    benchmark_parser.add_argument(
+            '--max-memory-pixels', type=int, default=2**26,
+            help='larger rasters are run with the streaming mode '
+            '(default: %(default)s)')
+    benchmark_parser.add_argument('--bands', type=model.get_bands,
+                                  default=model.output_bands,
+                                  metavar='BANDS',
+                                  help='comma separated output bands')
+    benchmark_parser.add_argument('--work-dir',
+                                  help='folder for the synthetic rasters and '
+                                  'the outputs (default: a temporary folder)')
+    benchmark_parser.add_argument('--json', metavar='FILE',
+                                  help='write all runs to a JSON file')
+    benchmark_parser.add_argument('--quiet', action='store_true',
+                                  help='only print the summary')
+    benchmark_parser.add_argument('--startup', action='store_true',
+                                  help='measure the import time of the '
+                                  'plugin when QGIS starts instead')
+    benchmark_parser.add_argument('--python',
+                                  help='Python of QGIS for --startup '
+                                  '(default: this one)')
+    benchmark_parser.add_argument('--utc', default='2017-08-07T06:00:00',
+                                  help='utc (YYYY-MM-DDTHH:MM:SS) of all '
+                                  'rasters (default: %(default)s)')
+    add_parameter_arguments(benchmark_parser)
+    benchmark_parser.set_defaults(func=run_benchmark_command)
+    return parser
+
+def main(argv=None):
+    '''Entry point of the command line interface, returns the exit code'''
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'start', None) is not None and args.interval is None:
+        parser.error('--start needs --interval')
+    if args.command == 'batch' and args.out_dir is None and args.stack is None:
+        parser.error('give --out-dir, --stack or both')
+    try:
+        return args.func(args)
+    except (IOError, ValueError) as error:
+        print('dattutdut: error: {}'.format(error), file=sys.stderr)
+        return 1
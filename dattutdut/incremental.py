@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - incremental model runs
+This module keeps the intermediate arrays of the last model run and only
+recomputes the stages whose inputs changed. If e.g. only the time period
+of the dialog is changed, only the water band is computed again, and if
+only g_percentage is changed, only g, h, le and water.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import numpy as np
+
+from . import model
+
+# Stages of the model in the order they are computed: name, resolved model
+# parameters the stage reads and stages it reads. Every stage also reads
+# the land surface temperatures.
+stages = (
+    ('scaled', ('tmin', 'tmax'), ()),
+    ('albedo', (), ('scaled',)),
+    ('ef', ('tmin', 'tmax'), ()),
+    ('rn', ('rn', 'sw_irr', 'surf_emis', 'atm_emis', 'air_temp'), ('albedo',)),
+    ('g', ('g_percentage',), ('rn', 'scaled')),
+    ('le', (), ('rn', 'g', 'ef')),
+    ('h', (), ('rn', 'g', 'le')),
+    ('water', ('time_period', 'air_temp'), ('le',)),
+)
+stage_parameters = {name: names for name, names, depends in stages}
+stage_dependencies = {name: depends for name, names, depends in stages}
+
+
+def same_value(value, other):
+    '''Returns True if two parameter values are equal, per-pixel parameters
+    (arrays) are compared element by element'''
+    if isinstance(value, np.ndarray) or isinstance(other, np.ndarray):
+        return value is other or (np.shape(value) == np.shape(other) and
+                                  np.array_equal(value, other, equal_nan=True))
+    return value == other
+
+def get_stages(bands=None):
+    '''Returns the stages the requested output bands are computed from, in
+    the order of stages
+    :bands : names of output bands, all of them if None
+    '''
+    needed = set()
+    stack = list(model.get_bands(bands))
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(stage_dependencies[name])
+    return tuple(name for name, names, depends in stages if name in needed)
+
+
+class IncrementalModel:
+    '''Runs the DATTUTDUT model like model.run_model, but keeps the arrays
+    of every stage and the parameters they were computed with. The next run
+    on the same land surface temperatures only recomputes the stages whose
+    parameters changed and the stages that read them. The values are the
+    same as the ones of model.compute_fluxes.
+
+    The land surface temperatures are compared by a key, e.g. the one of
+    raster_io.get_lst_key for a file, or else by identity, so they must not
+    be changed in place between two runs. The model keeps its own reference
+    to them, so a raster that does not fit into raster_io.lst_cache and is
+    read into a new array is not computed again either.
+    Recomputed stages get new arrays, so the results of earlier runs keep
+    their values.
+    '''
+
+    def __init__(self, percentile_method='exact'):
+        '''Constructor.
+        :param percentile_method: 'exact' or 'histogram', see
+            model.get_tmin_tmax
+        '''
+        self.percentile_method = percentile_method
+        self.reset()
+
+    def reset(self):
+        '''Drops all arrays, the next run computes every stage'''
+        self.source = None
+        self.key = None
+        self.lst = None
+        self.valid = None
+        self.arrays = {}
+        # parameter values and versions of the dependencies every array was
+        # computed with, the version of a stage counts its computations
+        self.inputs = {}
+        self.versions = {}
+        self.recomputed = ()
+        self._tmin_tmax = {}
+
+    def set_lst(self, lst, precision=None, key=None):
+        '''Sets the land surface temperatures and drops all arrays if they
+        are not the ones of the last run
+        :lst : land surface temperatures [K], zeros already set to NaN
+        :precision : 'float32' or 'float64' to convert lst, None to compute
+            in the dtype of lst
+        :key : key of the land surface temperatures, e.g. from
+            raster_io.get_lst_key. The arrays are kept if it is the key of
+            the last run. If None, lst is compared by identity.
+        '''
+        dtype = None if precision is None else model.get_dtype(precision)
+        if key is not None:
+            same_lst = key == self.key
+        else:
+            same_lst = lst is self.source
+        if (same_lst and self.lst is not None and
+                (dtype is None or self.lst.dtype == dtype)):
+            # later runs with the same array are found by identity as well
+            self.source = lst
+            return
+        self.reset()
+        self.source = lst
+        self.key = key
+        self.lst = lst if dtype is None else lst.astype(dtype, copy=False)
+        # one validity mask for the percentiles and the statistics
+        self.valid = model.get_valid_mask(self.lst)
+
+    def resolve(self, params, lon=None, lat=None, sol_elev_ang=None):
+        '''Returns the resolved model parameters, see
+        model.resolve_parameters. The percentiles of tmin and tmax are only
+        computed again if their thresholds changed.
+        '''
+        key = (params.tmin, params.tmax, params.tmin_thres, params.tmax_thres)
+        if key not in self._tmin_tmax:
+            self._tmin_tmax[key] = model.get_tmin_tmax(
+                    self.lst, params.tmin, params.tmax, params.tmin_thres,
+                    params.tmax_thres, self.percentile_method, self.valid)
+        tmin, tmax = self._tmin_tmax[key]
+        return model.resolve_parameters(
+                self.lst, params.copy(tmin=tmin, tmax=tmax), lon, lat,
+                self.percentile_method, sol_elev_ang)
+
+    def get_inputs(self, name, resolved):
+        '''Returns the parameter values and the versions of the dependencies
+        a stage would be computed with now'''
+        return (tuple(getattr(resolved, parameter)
+                      for parameter in stage_parameters[name]),
+                tuple(self.versions.get(depend)
+                      for depend in stage_dependencies[name]))
+
+    def is_valid(self, name, resolved):
+        '''Returns True if the array of a stage can be kept'''
+        if name not in self.arrays:
+            return False
+        values, versions = self.get_inputs(name, resolved)
+        old_values, old_versions = self.inputs[name]
+        return versions == old_versions and all(
+                same_value(value, old_value)
+                for value, old_value in zip(values, old_values))
+
+    def compute_stage(self, name, resolved, mask):
+        '''Computes the array of one stage from the arrays of its
+        dependencies'''
+        lst = self.lst
+        arrays = self.arrays
+        out = np.empty(lst.shape, dtype=lst.dtype)
+        # albedo, ef and g are clamped on the valid pixels, as in
+        # model.compute_fluxes
+        if name == 'scaled':
+            model.scale_lst(lst, resolved.tmin, resolved.tmax, out)
+        elif name == 'albedo':
+            model.fill_albedo(arrays['scaled'], True, mask, out)
+        elif name == 'ef':
+            model.fill_evap_frac(lst, resolved.tmin, resolved.tmax,
+                                 True, mask, out)
+        elif name == 'rn':
+            model.fill_rn(lst, arrays['albedo'], resolved, out)
+        elif name == 'g':
+            model.fill_g(arrays['rn'], arrays['scaled'], resolved.g_percentage,
+                         True, mask, out)
+        elif name == 'le':
+            model.fill_le(arrays['rn'], arrays['g'], arrays['ef'], out)
+        elif name == 'h':
+            model.fill_h(arrays['rn'], arrays['g'], arrays['le'], out)
+        elif name == 'water':
+            model.fill_water(arrays['le'], resolved.time_period,
+                             resolved.air_temp, out)
+        return out
+
+    def run(self, lst, params=None, lon=None, lat=None, precision=None,
+            bands=None, sol_elev_ang=None, callback=None, key=None):
+        '''Runs the model and returns a ModelResult like model.run_model.
+        The names of the stages that were computed are kept in recomputed.
+        :lst : land surface temperatures [K], zeros already set to NaN
+        :params : ModelParameters, the dialog defaults are used if None
+        :lon : longitude of the raster [dec]
+        :lat : latitude of the raster [dec]
+        :precision : 'float32' or 'float64' to convert lst before the run
+        :bands : output bands to compute, all of them if None
+        :sol_elev_ang : solar elevation angles of every pixel, see
+            model.resolve_parameters
+        :callback : function called with (index, number of stages, name)
+            after every stage, kept or computed
+        :key : key of the land surface temperatures, see set_lst
+        '''
+        if params is None:
+            params = model.ModelParameters()
+        bands = model.get_bands(bands)
+        self.set_lst(lst, precision, key)
+        resolved = self.resolve(params, lon, lat, sol_elev_ang)
+        mask = None
+        recomputed = []
+        needed = get_stages(bands)
+        for index, name in enumerate(needed):
+            if not self.is_valid(name, resolved):
+                if mask is None:
+                    mask = np.empty(self.lst.shape, dtype=bool)
+                # the inputs are stored after the array, so a stage that
+                # failed is computed again by the next run
+                self.arrays.pop(name, None)
+                self.arrays[name] = self.compute_stage(name, resolved, mask)
+                self.inputs[name] = self.get_inputs(name, resolved)
+                self.versions[name] = self.versions.get(name, 0) + 1
+                recomputed.append(name)
+            if callback is not None:
+                callback(index, len(needed), name)
+        self.recomputed = tuple(recomputed)
+        fluxes = {name: self.arrays[name] for name in bands}
+        if 'rn' in model.required_bands(bands):
+            fluxes['albedo'] = self.arrays['albedo']
+        return model.ModelResult(resolved, self.lst, fluxes, self.valid)
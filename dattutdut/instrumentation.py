@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - instrumentation
+This module measures the stages of a model run (read, percentiles,
+fluxes, write and stats): the wall time, the bytes read and written, the
+peak of the memory allocated by the stage (tracemalloc) and the peak
+resident set size of the process. A Profiler passes every StageRecord to
+its hooks, e.g. the QGIS message log or an own monitoring, and writes all
+of them into a JSON sidecar next to the stats file.
+Without a Profiler (profiler=None) the stages run as before.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# Functions called with every StageRecord of every Profiler, see add_hook
+hooks = []
+# Extension of the JSON sidecar, out.profile.json for out.csv
+sidecar_extension = '.profile.json'
+
+
+def add_hook(hook):
+    '''Adds a function that is called with every StageRecord of every
+    Profiler, e.g. to send the numbers to a monitoring system'''
+    if hook not in hooks:
+        hooks.append(hook)
+
+def remove_hook(hook):
+    '''Removes a function added with add_hook'''
+    if hook in hooks:
+        hooks.remove(hook)
+
+def get_peak_rss():
+    '''Returns the peak resident set size of the process [bytes], or None
+    if the platform cannot tell'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def file_bytes(paths):
+    '''Returns the summed size of the files that exist [bytes]'''
+    return sum(os.path.getsize(path) for path in paths
+               if os.path.isfile(path))
+
+def get_sidecar_file(out_file):
+    '''Returns the JSON sidecar of a stats file or an output raster, e.g.
+    out.profile.json for out.csv'''
+    return os.path.splitext(out_file)[0] + sidecar_extension
+
+
+class StageRecord:
+    '''Wall time, bytes read and written and memory of one stage of a run'''
+
+    def __init__(self, raster, stage, pixels, seconds, peak_alloc, peak_rss,
+                 bytes_read=0, bytes_written=0):
+        self.raster = raster
+        self.stage = stage
+        self.pixels = pixels
+        self.seconds = seconds
+        self.peak_alloc = peak_alloc
+        self.peak_rss = peak_rss
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+
+    @property
+    def pixels_per_second(self):
+        if self.seconds <= 0:
+            return float('inf')
+        return self.pixels / self.seconds
+
+    def as_dict(self):
+        values = dict(vars(self))
+        values['pixels_per_second'] = self.pixels_per_second
+        return values
+
+
+def format_record(record):
+    '''Returns one line of text for a StageRecord, e.g. for the message
+    log'''
+    text = '{} {}: {:.3f} s, {:.2f} Mpixels/s, peak alloc {:.1f} MiB'.format(
+            os.path.basename(str(record.raster)), record.stage,
+            record.seconds, record.pixels_per_second / 1e6,
+            record.peak_alloc / 2**20)
+    if record.peak_rss is not None:
+        text += ', peak RSS {:.1f} MiB'.format(record.peak_rss / 2**20)
+    if record.bytes_read:
+        text += ', read {:.1f} MiB'.format(record.bytes_read / 2**20)
+    if record.bytes_written:
+        text += ', written {:.1f} MiB'.format(record.bytes_written / 2**20)
+    return text
+
+
+class Profiler:
+    '''Measures the stages of one model run and keeps their StageRecords.
+    Every record is passed to the hooks of the profiler and to the hooks
+    of the module (add_hook) as soon as its stage is finished.
+    '''
+
+    def __init__(self, raster=None, hooks=(), trace_memory=True):
+        '''Constructor.
+        :param raster: name of the input raster in the records
+        :param hooks: functions called with every StageRecord
+        :param trace_memory: measure the peak allocation of every stage
+            with tracemalloc, which slows down code that allocates many
+            small Python objects. Only the peak RSS is recorded otherwise.
+        '''
+        self.raster = raster
+        self.hooks = list(hooks)
+        self.trace_memory = trace_memory
+        self.records = []
+        # pixels of the raster, set by the first stage that knows them
+        self.pixels = 0
+
+    def add_hook(self, hook):
+        '''Adds a function that is called with every StageRecord'''
+        self.hooks.append(hook)
+
+    def measure(self, stage, function, *args, pixels=None, bytes_read=0,
+                bytes_written=0, **kwargs):
+        '''Runs one stage and returns the value of the function
+        :stage : name of the stage in the record
+        :function : function of the stage, called with args and kwargs
+        :pixels : pixels processed by the stage, the ones of the last stage
+            that gave them if None
+        :bytes_read : bytes read by the stage
+        :bytes_written : bytes written by the stage
+        pixels, bytes_read and bytes_written can be functions that get the
+        value of the stage function, they are called after the stage.
+        '''
+        own_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            # tracing that was started by the caller is left running
+            start_alloc = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            value = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            if not self.trace_memory:
+                peak_alloc = 0
+            elif own_tracing:
+                peak_alloc = tracemalloc.get_traced_memory()[1]
+            else:
+                peak_alloc = max(tracemalloc.get_traced_memory()[1] -
+                                 start_alloc, 0)
+        finally:
+            if own_tracing:
+                tracemalloc.stop()
+        if callable(pixels):
+            pixels = pixels(value)
+        if pixels is not None:
+            self.pixels = int(pixels)
+        record = StageRecord(
+                self.raster, stage, self.pixels, seconds, peak_alloc,
+                get_peak_rss(),
+                bytes_read(value) if callable(bytes_read) else bytes_read,
+                bytes_written(value) if callable(bytes_written)
+                else bytes_written)
+        self.records.append(record)
+        for hook in self.hooks + hooks:
+            hook(record)
+        return value
+
+    def as_dict(self):
+        '''Returns the records and their totals as a dictionary'''
+        peak_rss = [record.peak_rss for record in self.records
+                    if record.peak_rss is not None]
+        return {'raster': self.raster,
+                'pixels': self.pixels,
+                'seconds': sum(record.seconds for record in self.records),
+                'bytes_read': sum(record.bytes_read
+                                  for record in self.records),
+                'bytes_written': sum(record.bytes_written
+                                     for record in self.records),
+                'peak_alloc': max([record.peak_alloc
+                                   for record in self.records] or [0]),
+                'peak_rss': max(peak_rss) if peak_rss else None,
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'stages': [record.as_dict() for record in self.records]}
+
+    def write_json(self, out_file):
+        '''Writes the records into a JSON file, e.g.
+        get_sidecar_file(stats_file)'''
+        with open(out_file, 'w') as output_file:
+            json.dump(self.as_dict(), output_file, indent=2)
+        return out_file
+
+
+def measure(profiler, stage, function, *args, pixels=None, bytes_read=0,
+            bytes_written=0, **kwargs):
+    '''Runs one stage with profiler.measure, or just calls the function if
+    profiler is None'''
+    if profiler is None:
+        return function(*args, **kwargs)
+    return profiler.measure(stage, function, *args, pixels=pixels,
+                            bytes_read=bytes_read, bytes_written=bytes_written,
+                            **kwargs)
+
+def measure_read(profiler, in_file, *args, **kwargs):
+    '''Reads a raster with raster_io.read_lst_img as the stage read. A
+    raster that comes from the cache counts as 0 bytes read.'''
+    from . import raster_io
+
+    hits = raster_io.lst_cache.hits
+    return measure(profiler, 'read', raster_io.read_lst_img, in_file, *args,
+                   pixels=lambda value: value[0].size,
+                   bytes_read=lambda value: (0 if raster_io.lst_cache.hits >
+                                             hits else file_bytes([in_file])),
+                   **kwargs)
+
+def measure_write(profiler, out_file, fluxes, geo, prj, driver=None,
+                  options=None, bands=None, callback=None):
+    '''Writes the output raster with raster_io.write_output_images as the
+    stage write and returns the file to open as layer'''
+    from . import raster_io
+
+    if bands is None:
+        bands = [flux_name for flux_name in raster_io.output_bands
+                 if flux_name in fluxes]
+    return measure(profiler, 'write', raster_io.write_output_images, out_file,
+                   fluxes, geo, prj, driver, options, bands, callback,
+                   bytes_written=lambda value: file_bytes(
+                           raster_io.get_output_files(out_file, options,
+                                                      bands)))
+
+def measure_stats(profiler, write_function, out_file, *args, **kwargs):
+    '''Writes a stats file with one of the stats.write_* functions as the
+    stage stats'''
+    return measure(profiler, 'stats', write_function, out_file, *args,
+                   bytes_written=lambda value: file_bytes([out_file]),
+                   **kwargs)
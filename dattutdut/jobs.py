@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - job manifests
+This module runs the jobs of a manifest file, e.g. from a scheduler with
+the qwatermodel command (scripts/qwatermodel) or
+python -m dattutdut run jobs.yaml. A manifest is a YAML (needs PyYAML) or
+JSON file:
+
+    defaults:
+      output_dir: results
+      parameters: {surf_emis: 0.98, g_percentage: 10}
+      options: {compress: ZSTD, overviews: auto}
+      bands: [le, water]
+    jobs:
+      - input: Data_Examples/Drone_Data/200.tif
+        utc: 2017-08-07T02:00:00
+      - input: Data_Examples/Drone_Data/201.tif
+        utc: 2017-08-07T02:30:00
+        output: results/special.tif
+        parameters: {atm_trans: null}
+
+Every job runs the model on one raster. The keys of a job:
+input : land surface temperature raster
+utc : time of the raster, YYYY-MM-DDTHH:MM:SS
+output : output raster, <output_dir>/<name>_qwatermodel.tif if not given
+stats : stats file, next to the output if not given, false for none
+parameters : model parameters as in the dialog, null derives a parameter
+    from the image like an empty field
+options : creation options of the output, see raster_io.OutputOptions
+bands : output bands, all of them if not given
+precision : 'float32' or 'float64'
+stats_format : format of the stats file, see stats.write_stats_file
+output_dir : folder of the outputs that are not given
+The defaults are used for every job, parameters and options are merged.
+Relative paths are relative to the folder of the manifest.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import concurrent.futures
+import json
+import os
+
+from . import batch, model, stats, streaming
+
+# Keys of a job and of the defaults of a manifest
+job_keys = ('input', 'utc', 'output', 'stats', 'parameters', 'options',
+            'bands', 'precision', 'stats_format', 'output_dir')
+# Keys that are merged with the defaults instead of replacing them
+merged_keys = ('parameters', 'options')
+# States of a job after run_jobs
+job_states = ('done', 'skipped', 'failed')
+
+
+def read_manifest(manifest_file):
+    '''Returns the content of a YAML or JSON manifest as dictionary with the
+    keys defaults and jobs. YAML needs PyYAML, JSON is read with the
+    standard library.
+    :manifest_file : path and file name, .yaml, .yml or .json
+    '''
+    with open(manifest_file) as in_file:
+        text = in_file.read()
+    if os.path.splitext(manifest_file)[1].lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise IOError('Reading {} needs PyYAML, install it or use a JSON '
+                          'manifest'.format(manifest_file))
+        try:
+            content = yaml.safe_load(text)
+        except yaml.YAMLError as error:
+            raise ValueError('{} is not valid YAML: {}'.format(manifest_file,
+                                                               error))
+    else:
+        try:
+            content = json.loads(text)
+        except ValueError as error:
+            raise ValueError('{} is not valid JSON: {}'.format(manifest_file,
+                                                               error))
+    if isinstance(content, list):
+        content = {'jobs': content}
+    if not isinstance(content, dict) or not content.get('jobs'):
+        raise ValueError('{} has no jobs'.format(manifest_file))
+    unknown = set(content) - {'defaults', 'jobs'}
+    if unknown:
+        raise ValueError('Unknown keys in {}: {}'.format(
+                manifest_file, ', '.join(sorted(unknown))))
+    return content
+
+
+class Job:
+    '''One model run of a manifest: the input raster, its utc, the model
+    parameters and the output files'''
+
+    def __init__(self, in_file, out_file, params, stats_file=None,
+                 options=None, bands=None, precision=model.default_precision,
+                 stats_format='text', manifest_file=None):
+        '''Constructor.
+        :param in_file: land surface temperature raster
+        :param out_file: output raster
+        :param params: ModelParameters with the utc of the raster
+        :param stats_file: stats file, None for none
+        :param options: raster_io.OutputOptions of the output raster
+        :param bands: output bands, all of them if None
+        :param precision: 'float32' or 'float64'
+        :param stats_format: format of the stats file, see
+            stats.write_stats_file
+        :param manifest_file: the manifest, outputs older than it are not
+            up to date
+        '''
+        self.in_file = in_file
+        self.out_file = out_file
+        self.params = params
+        self.stats_file = stats_file
+        self.options = options
+        self.bands = model.get_bands(bands)
+        self.precision = precision
+        self.stats_format = stats_format
+        self.manifest_file = manifest_file
+
+    def get_output_files(self):
+        '''Returns all files the job writes'''
+        from . import raster_io
+
+        files = raster_io.get_output_files(self.out_file, self.options,
+                                           self.bands)
+        if self.stats_file is not None:
+            files.append(self.stats_file)
+        return files
+
+    def is_up_to_date(self):
+        '''Returns True if all outputs exist and are newer than the input
+        and the manifest'''
+        sources = [self.in_file]
+        if self.manifest_file is not None:
+            sources.append(self.manifest_file)
+        try:
+            newest_source = max(os.path.getmtime(path) for path in sources)
+            oldest_output = min(os.path.getmtime(path)
+                                for path in self.get_output_files())
+        except OSError:
+            # a missing output (or input) is never up to date
+            return False
+        return oldest_output >= newest_source
+
+    def __repr__(self):
+        return 'Job({!r}, {!r})'.format(self.in_file, self.out_file)
+
+
+class JobStatus:
+    '''The outcome of a Job: its state (one of job_states), the resolved
+    model parameters if it was run and the error if it failed'''
+
+    def __init__(self, job, state, resolved=None, error=None):
+        self.job = job
+        self.state = state
+        self.resolved = resolved
+        self.error = error
+
+
+def get_path(path, base_dir):
+    '''Returns a path of a manifest relative to base_dir'''
+    return os.path.normpath(os.path.join(base_dir, os.path.expanduser(
+            str(path))))
+
+def merge_job(defaults, entry):
+    '''Returns the keys of one job merged with the defaults'''
+    values = dict(defaults)
+    for key, value in entry.items():
+        if key in merged_keys and isinstance(value, dict):
+            merged = dict(values.get(key) or {})
+            merged.update(value)
+            value = merged
+        values[key] = value
+    return values
+
+def create_job(values, base_dir, manifest_file=None):
+    '''Returns the Job of the merged keys of a manifest entry
+    :values : keys of the job merged with the defaults, see merge_job
+    :base_dir : folder relative paths are relative to
+    :manifest_file : see Job
+    '''
+    from .raster_io import OutputOptions
+
+    unknown = set(values) - set(job_keys)
+    if unknown:
+        raise ValueError('Unknown job keys: {}'.format(
+                ', '.join(sorted(unknown))))
+    if not values.get('input'):
+        raise ValueError('A job has no input')
+    in_file = get_path(values['input'], base_dir)
+    parameters = dict(values.get('parameters') or {})
+    unknown = set(parameters) - set(model.ModelParameters.names)
+    if unknown:
+        raise ValueError('Unknown model parameters of {}: {}'.format(
+                in_file, ', '.join(sorted(unknown))))
+    if values.get('utc') is not None:
+        parameters['utc'] = values['utc']
+    if parameters.get('utc') is None:
+        raise ValueError('No utc given for {}'.format(in_file))
+    # a wrong utc stops the manifest before the first job runs
+    parameters['utc'] = model.parse_utc(parameters['utc'])
+    try:
+        params = model.ModelParameters(**{
+                name: (value if value is None or name == 'utc'
+                       else float(value))
+                for name, value in parameters.items()})
+    except (TypeError, ValueError):
+        raise ValueError('Invalid model parameters for {}: {}'.format(
+                in_file, parameters))
+    options = OutputOptions(**(values.get('options') or {}))
+    precision = values.get('precision') or model.default_precision
+    model.get_dtype(precision)
+    stats_format = values.get('stats_format') or 'text'
+    if stats_format not in stats.stats_formats:
+        raise ValueError('Unknown stats format {}, use one of {}'.format(
+                stats_format, ', '.join(stats.stats_formats)))
+    out_dir = get_path(values.get('output_dir') or os.path.dirname(in_file),
+                       base_dir)
+    if values.get('output'):
+        out_file = get_path(values['output'], base_dir)
+    else:
+        out_file = batch.get_output_name(in_file, out_dir)
+    stats_file = values.get('stats', True)
+    if stats_file is True:
+        stats_file = (os.path.splitext(out_file)[0] +
+                      ('.json' if stats_format == 'json' else '.csv'))
+    elif stats_file:
+        stats_file = get_path(stats_file, base_dir)
+    else:
+        stats_file = None
+    return Job(in_file, out_file, params, stats_file, options,
+               values.get('bands'), precision, stats_format, manifest_file)
+
+def load_jobs(manifest_file):
+    '''Returns the list of Jobs of a manifest file, see the module
+    description for its format'''
+    content = read_manifest(manifest_file)
+    defaults = content.get('defaults') or {}
+    if not isinstance(defaults, dict):
+        raise ValueError('The defaults of {} are not a mapping'.format(
+                manifest_file))
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    jobs = []
+    for number, entry in enumerate(content['jobs'], 1):
+        if isinstance(entry, str):
+            entry = {'input': entry}
+        if not isinstance(entry, dict):
+            raise ValueError('Job {} of {} is not a mapping'.format(
+                    number, manifest_file))
+        try:
+            jobs.append(create_job(merge_job(defaults, entry), base_dir,
+                                   os.path.abspath(manifest_file)))
+        except (TypeError, ValueError) as error:
+            raise ValueError('Job {} of {}: {}'.format(number, manifest_file,
+                                                       error))
+    outputs = [job.out_file for job in jobs]
+    duplicates = sorted(set(path for path in outputs
+                            if outputs.count(path) > 1))
+    if duplicates:
+        raise ValueError('Several jobs write {}'.format(', '.join(duplicates)))
+    return jobs
+
+def run_job(job):
+    '''Runs one Job and returns the resolved model parameters. The input is
+    not kept in the cache, every job reads another raster.'''
+    from . import raster_io
+
+    lst, prj, geo = raster_io.read_lst_img(job.in_file, job.precision,
+                                           use_cache=False)
+    lon, lat = raster_io.get_lon_lat(geo)
+    result = model.run_model(lst, job.params, lon, lat, bands=job.bands)
+    for path in job.get_output_files():
+        out_dir = os.path.dirname(path)
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir, exist_ok=True)
+    raster_io.write_output_images(job.out_file, result.fluxes, geo, prj,
+                                  options=job.options, bands=job.bands)
+    if job.stats_file is not None:
+        stats.write_stats_file(job.stats_file, job.in_file, result,
+                               stats_format=job.stats_format)
+    return result.parameters
+
+def _run_job_status(job):
+    '''Runs one Job and returns its JobStatus, an error fails only this
+    job'''
+    try:
+        return JobStatus(job, 'done', run_job(job))
+    except Exception as error:
+        return JobStatus(job, 'failed', error='{}: {}'.format(
+                type(error).__name__, error))
+
+def run_jobs(jobs, workers=1, executor='thread', force=False, callback=None):
+    '''Runs the jobs that are not up to date and returns one JobStatus per
+    job, in the order of jobs. A failed job does not stop the others.
+    :jobs : list of Jobs, see load_jobs
+    :workers : number of jobs run at the same time, None for one per CPU
+        core
+    :executor : 'thread' or 'process', see streaming.iter_pool
+    :force : also run the jobs whose outputs are up to date
+    :callback : function called with every JobStatus as soon as it is known
+    '''
+    streaming.check_executor(executor)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    statuses = [None] * len(jobs)
+    pending = []
+    for index, job in enumerate(jobs):
+        if not force and job.is_up_to_date():
+            statuses[index] = JobStatus(job, 'skipped')
+            if callback is not None:
+                callback(statuses[index])
+        else:
+            pending.append(index)
+    if workers <= 1 or len(pending) <= 1:
+        for index in pending:
+            statuses[index] = _run_job_status(jobs[index])
+            if callback is not None:
+                callback(statuses[index])
+        return statuses
+
+    with streaming.executors[executor](max_workers=workers) as pool:
+        futures = {pool.submit(_run_job_status, jobs[index]): index
+                   for index in pending}
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            try:
+                statuses[index] = future.result()
+            except Exception as error:
+                # e.g. a worker process that died
+                statuses[index] = JobStatus(jobs[index], 'failed',
+                                            error=str(error))
+            if callback is not None:
+                callback(statuses[index])
+    return statuses
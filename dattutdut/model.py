@@ -0,0 +1,714 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - DATTUTDUT engine
+This module contains the DATTUTDUT energy-balance model as plain NumPy
+functions. It does not import Qt, QGIS or GDAL, so it can be used in batch
+workers and scripts without starting QGIS.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+
+The DATTUTDUT energy-balance model is based on:
+Timmermans, W.J., Kustas, W.P., Andreu, A., 2015. Utility of an automated
+thermal-based approach for monitoring evapotranspiration.
+Acta Geophys. 63, 1571–1608. https://doi.org/10.1515/acgeo-2015-0016.
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import datetime
+import math
+import numpy as np
+
+from . import percentiles, solar
+
+# Define global variables
+sb_const = 5.6704*10**(-8) # Stefan Bolzmann constant
+sw_exo = 1361.5 # exo-atmospheric short wave radiation
+
+# Bands of the output raster in the order they are written
+output_bands = ('rn', 'le', 'h', 'g', 'ef', 'water')
+# Output bands every output band is calculated from
+band_dependencies = {
+    'rn': (),
+    'le': ('rn', 'g', 'ef'),
+    'h': ('le',),
+    'g': ('rn',),
+    'ef': (),
+    'water': ('le',),
+}
+
+# Format of the utc time stamps used in the dialog
+utc_format = '%Y-%m-%dT%H:%M:%S'
+
+# Precisions the model can be computed in. float32 is the type of most
+# thermal rasters and needs half the memory, float64 is the reference.
+precisions = {'float32': np.float32, 'float64': np.float64}
+default_precision = 'float32'
+
+
+class ModelParameters:
+    '''Holds the input parameters of the DATTUTDUT model. Every parameter
+    that is None is derived from the image or from the other parameters, in
+    the same way as an empty field in the QWaterModel dialog. The defaults
+    are the defaults of the dialog.
+    '''
+
+    # names of the model parameters
+    names = ('utc', 'tmin_thres', 'tmax_thres', 'tmin', 'tmax', 'surf_emis',
+             'atm_trans', 'atm_emis', 'air_temp', 'time_period', 'sw_irr',
+             'g_percentage', 'rn', 'longitude', 'latitude')
+
+    def __init__(self, utc=None, tmin_thres=0.5, tmax_thres=100, tmin=None,
+                 tmax=None, surf_emis=1.0, atm_trans=0.7, atm_emis=0.8,
+                 air_temp=None, time_period=3600, sw_irr=None,
+                 g_percentage=None, rn=None, longitude=None, latitude=None):
+        '''Constructor.
+        :param utc: time of the image as datetime or as string in the format
+            YYYY-MM-DDTHH:MM:SS
+        :param tmin_thres: percentile of the image used as tmin
+        :param tmax_thres: percentile of the image used as tmax
+        :param tmin: minimum temperature [K]
+        :param tmax: maximum temperature [K]
+        :param surf_emis: surface emissivity [-]
+        :param atm_trans: atmospheric transmissivity [-]
+        :param atm_emis: atmospheric emissivity [-]
+        :param air_temp: air temperature [K]
+        :param time_period: time period for the water amount [s]
+        :param sw_irr: short-wave irradiance [W/m²]
+        :param g_percentage: ground heat flux as percentage of rn [%]
+        :param rn: net radiation [W/m²]
+        :param longitude: longitude [dec], taken from the raster if None
+        :param latitude: latitude [dec], taken from the raster if None
+        '''
+        self.utc = utc
+        self.tmin_thres = tmin_thres
+        self.tmax_thres = tmax_thres
+        self.tmin = tmin
+        self.tmax = tmax
+        self.surf_emis = surf_emis
+        self.atm_trans = atm_trans
+        self.atm_emis = atm_emis
+        self.air_temp = air_temp
+        self.time_period = time_period
+        self.sw_irr = sw_irr
+        self.g_percentage = g_percentage
+        self.rn = rn
+        self.longitude = longitude
+        self.latitude = latitude
+        # solar elevation angle, only set on resolved parameters
+        self.sol_elev_ang = None
+
+    @classmethod
+    def from_strings(cls, **fields):
+        '''Creates the parameters from text fields like the ones of the
+        dialog. Empty strings become None, all other values except utc are
+        converted to float.
+        '''
+        values = {}
+        for name, text in fields.items():
+            if text is None or str(text).strip() == '':
+                values[name] = None
+            elif name == 'utc':
+                values[name] = str(text).strip()
+            else:
+                values[name] = float(text)
+        return cls(**values)
+
+    def copy(self, **changes):
+        '''Returns a copy of the parameters with the given values replaced'''
+        new_params = ModelParameters(**self.as_dict())
+        new_params.sol_elev_ang = self.sol_elev_ang
+        for name, value in changes.items():
+            setattr(new_params, name, value)
+        return new_params
+
+    def as_dict(self):
+        '''Returns the input parameters as dictionary'''
+        return {name: getattr(self, name) for name in self.names}
+
+    def __repr__(self):
+        return 'ModelParameters({})'.format(', '.join(
+                '{}={!r}'.format(name, getattr(self, name)) for name in self.names))
+
+
+class ModelResult:
+    '''Holds the output of one model run: the resolved model parameters, the
+    land surface temperatures and the flux arrays (see output_bands) plus
+    the albedo. Pixels without data are NaN in all of them.
+    '''
+
+    def __init__(self, parameters, lst, fluxes, valid=None):
+        self.parameters = parameters
+        self.lst = lst
+        self.fluxes = fluxes
+        self._valid = valid
+
+    @property
+    def valid(self):
+        '''Validity mask of the land surface temperatures, see
+        get_valid_mask. It is computed once and shared by the percentiles
+        and the statistics.'''
+        if self._valid is None and self.lst is not None:
+            self._valid = get_valid_mask(self.lst)
+        return self._valid
+
+    def __getitem__(self, name):
+        return self.fluxes[name]
+
+
+def parse_utc(utc):
+    '''Returns utc as datetime, utc can be a datetime or a string in the
+    format YYYY-MM-DDTHH:MM:SS
+    '''
+    if isinstance(utc, datetime.datetime):
+        return utc
+    return datetime.datetime.strptime(str(utc), utc_format)
+
+def format_utc(utc):
+    '''Returns utc as string in the format YYYY-MM-DDTHH:MM:SS, None stays
+    None
+    '''
+    if isinstance(utc, datetime.datetime):
+        return utc.strftime(utc_format)
+    return utc
+
+def get_dtype(precision):
+    '''Returns the NumPy dtype of a precision, see precisions
+    :precision : 'float32' or 'float64'
+    '''
+    if precision not in precisions:
+        raise ValueError('Unknown precision {}, use one of {}'.format(
+                precision, ', '.join(sorted(precisions))))
+    return np.dtype(precisions[precision])
+
+def mask_zeros(lst, precision=None, nodata=None):
+    '''Sets all pixels without data to NaN: zeros, NaN and the nodata value
+    of the band. The array is changed in place if it already has the dtype
+    of the precision, otherwise it is converted once. Without a precision
+    float arrays keep their dtype and other arrays are converted to
+    float64. Read-only arrays, e.g. memory maps, are never changed: the
+    values are copied once and masked in the copy.
+    :lst : land surface temperatures [K]
+    :precision : 'float32', 'float64' or None
+    :nodata : nodata value of the band, e.g. band.GetNoDataValue(), or None
+    '''
+    if precision is not None:
+        dtype = get_dtype(precision)
+    elif np.issubdtype(lst.dtype, np.floating):
+        dtype = lst.dtype.newbyteorder('=')
+    else:
+        dtype = np.dtype(np.float64)
+    invalid = lst == 0.0
+    if nodata is not None and not math.isnan(nodata) and nodata != 0.0:
+        invalid |= lst == nodata
+    if not lst.flags.writeable:
+        out = np.empty(lst.shape, dtype)
+        np.copyto(out, lst, casting='unsafe')
+        np.copyto(out, np.nan, where=invalid)
+        return out
+    lst = lst.astype(dtype, copy=False)
+    lst[invalid] = np.nan
+    return lst
+
+def get_valid_mask(lst):
+    '''Returns the validity mask of land surface temperatures that went
+    through mask_zeros, True for pixels with data. The model computes it
+    once per image and passes it on, so the NaN are not searched again by
+    every step.
+    '''
+    return ~np.isnan(lst)
+
+def get_tmin_tmax(lst, tmin=None, tmax=None, tmin_thres=0.5, tmax_thres=100,
+                  method='exact', valid=None):
+    '''This function defines tmin and tmax (minimum and maximum temperatures)
+    from the input or as percentiles of the image itself. Both percentiles
+    are found together, see percentiles.get_percentiles for the methods.
+    valid is the validity mask of lst, it is computed if None.
+    '''
+    thresholds = [thres for value, thres in ((tmin, tmin_thres),
+                                             (tmax, tmax_thres)) if value is None]
+    if thresholds:
+        values = iter(percentiles.get_percentiles(lst, thresholds, method,
+                                                  valid=valid))
+        if tmin is None:
+            tmin = next(values)
+        if tmax is None:
+            tmax = next(values)
+    return float(tmin), float(tmax)
+
+def get_air_temp(air_temp, tmin):
+    '''Determines air temperature: either air temperature is given with
+    input or the minimum temperature tmin is taken as air temperature as
+    in Timmermans et al. (2015)
+    '''
+    if air_temp is None:
+        return float(tmin)
+    return float(air_temp)
+
+def get_time_period(time_period):
+    '''This function determines the time slot for temporal upscaling of
+    evapotranspirated water amount in seconds.
+    '''
+    if time_period is None:
+        return 3600.0
+    return float(time_period)
+
+def get_sol_elev_ang(utc, lon, lat):
+    '''Returns the solar elevation angle [deg] of one time and location,
+    see solar.sol_elev_ang. The results are memoized, so frames with the
+    same time and location share one calculation.
+    :utc : time as datetime or string in the format YYYY-MM-DDTHH:MM:SS
+    :lon : longitude [dec]
+    :lat : latitude [dec]
+    '''
+    return solar.cached_sol_elev_ang(parse_utc(utc), lon, lat)
+
+def get_value(value):
+    '''Returns a scalar parameter as float, per-pixel parameters (arrays)
+    are returned as they are'''
+    if np.ndim(value) == 0:
+        return float(value)
+    return value
+
+def get_atm_trans(atm_trans, sol_elev_ang):
+    '''This function determines atmospheric transmissivity
+    an adapted from Burridge and Gadd (1977) or on manual input. It is an
+    array if sol_elev_ang is one.
+    '''
+    if atm_trans is not None:
+        return get_value(atm_trans)
+    if sol_elev_ang is None:
+        raise ValueError('atm_trans can only be derived if utc is given')
+    return 0.6 + 0.2 * np.sin(np.deg2rad(sol_elev_ang))
+
+def get_sw_irr(sw_irr, atm_trans, sol_elev_ang):
+    '''This function determines short-wave irradiance, either from manual
+    input, as described in Timmermans et al. (2015), or based on Burridge
+    and Gadd (1974)
+    '''
+    # if a measured sw_irr value is available
+    if sw_irr is not None:
+        return get_value(sw_irr)
+    # if both time and sw_irr are not available
+    if sol_elev_ang is None:
+        return get_value(atm_trans) * sw_exo
+    # if utc is available but sw_irr is not
+    # this multiplies the solar constant first with atmospheric transmissivity and also with
+    # the sinus of solar elevation angle
+    return sw_exo * get_value(atm_trans) * np.sin(np.deg2rad(sol_elev_ang))
+
+def get_atm_emis(atm_emis, atm_trans):
+    '''This function determines atmospheric emissivity either from
+    manual input or based on Bastiaanssen et al. (1998)
+    '''
+    if atm_emis is not None:
+        return get_value(atm_emis)
+    if np.ndim(atm_trans) > 0:
+        return 1.08 * (- np.log(atm_trans))**0.265
+    return 1.08 * (- math.log(float(atm_trans)))**0.265
+
+def get_albedo(lst, tmin, tmax, clamp=None):
+    '''This function determines surface albedo from land surface
+    temperatures and minimum and maximum temperatures based on Timmermans et al.
+    (2015), Brutsaert (1982) and Garrat (1992). The albedo of the valid
+    pixels is clamped unless clamp is False, NaN pixels stay NaN.
+    '''
+    albedo = abs(0.05 + ((lst-float(tmin))/(float(tmax)-float(tmin))) * 0.2)
+    if clamp is not False:
+        albedo[albedo > 1.0] = 0.25
+        albedo[albedo < 0.0] = 0.05
+    return albedo
+
+def get_evap_frac(lst, tmin, tmax, clamp=None):
+    '''This function determines the evaporative fraction as in Timmermans
+    et al. (2015) it further applies a maximum and a minimum value, clamp
+    works as in get_albedo
+    '''
+    ef = (float(tmax)-lst)/(float(tmax)-float(tmin))
+    if clamp is not False:
+        ef[ef >= 1.0] = 1.0
+        ef[ef <= 0.0] = 0.0
+    return ef
+
+def get_rn(lst, albedo, sw_irr, surf_emis, atm_emis, air_temp, rn=None):
+    '''This function calculates net radiation (rn) as in Timmermans et al.
+    (2015)
+    '''
+    # if no value for rn is specified
+    if rn is None:
+        return ((1-albedo) * get_value(sw_irr) +
+                float(surf_emis) * get_value(atm_emis) *
+                sb_const * (float(air_temp)**4) -
+                float(surf_emis) * sb_const * (lst**4))
+    # if rn is specified
+    return float(rn)*lst/lst
+
+def get_g(lst, rn, tmin, tmax, g_percentage=None, clamp=None):
+    '''This function determines the ground heat flux (g). g is computed as
+    a linear function of Rn similar as described in Liebethal and Foken (2007).
+    Default values from the GUI are based on Ogée et al. (2001). If no value
+    is given, g is computed according to Timmermans et al. (2015). The
+    bounds are applied to the fraction g/rn (see clamp_g_fraction), clamp
+    works as in get_albedo
+    '''
+    if g_percentage is None:
+        g_fraction = 0.05 + ((lst-float(tmin))/(float(tmax)-float(tmin))) * 0.4
+    else:
+        g_fraction = get_value(g_percentage) / 100
+    if clamp is not False:
+        g_fraction = clamp_g_fraction(g_fraction)
+    return rn * g_fraction
+
+def clamp_g_fraction(g_fraction):
+    '''Applies the bounds of g to the fraction g/rn: a fraction above 1 is
+    set to 0.45 and a negative one to 0.05, NaN stays NaN. Arrays are
+    clamped in place.
+    '''
+    if np.ndim(g_fraction) == 0:
+        if g_fraction > 1.0:
+            return 0.45
+        if g_fraction < 0.0:
+            return 0.05
+        return g_fraction
+    g_fraction[g_fraction > 1.0] = 0.45
+    g_fraction[g_fraction < 0.0] = 0.05
+    return g_fraction
+
+def get_h_le(rn, g, ef):
+    '''This function determines latent heat flux (le) and sensible heat
+    flux (h) according to evaporative fraction (ef) based on Timmermans et
+    al. (2015)
+    '''
+    le = (rn - g) * ef
+    h = (rn - g) - le
+    return h, le
+
+def get_water(le, time_period, air_temp):
+    '''This function calculates the actual amount of water based on
+    Timmermans et al. (2015)
+    '''
+    return ((le*float(time_period)/1000000)/
+            (2.501-0.002361*(float(air_temp)-273.15)))
+
+def resolve_parameters(lst, params, lon=None, lat=None,
+                       percentile_method='exact', sol_elev_ang=None,
+                       valid=None):
+    '''Derives all scalar model parameters that are not given (None) from
+    the land surface temperatures and returns them as new ModelParameters.
+    :lst : land surface temperatures [K], zeros already set to NaN
+    :params : ModelParameters
+    :lon : longitude of the raster [dec], used if params.longitude is None
+    :lat : latitude of the raster [dec], used if params.latitude is None
+    :percentile_method : 'exact' or 'histogram', see get_tmin_tmax
+    :sol_elev_ang : solar elevation angles [deg] of every pixel, e.g. from
+        solar.sol_elev_ang_grid. Then atm_trans, sw_irr and atm_emis are
+        derived per pixel if they are not given. If None, the angle of
+        params.utc at lon and lat is used.
+    :valid : validity mask of lst for the percentiles, see get_valid_mask
+    '''
+    # get tmin and tmax if not already defined in settings
+    tmin, tmax = get_tmin_tmax(lst, params.tmin, params.tmax,
+                               params.tmin_thres, params.tmax_thres,
+                               percentile_method, valid)
+    resolved = params.copy(tmin=tmin, tmax=tmax)
+    # get air temperature and time
+    resolved.air_temp = get_air_temp(params.air_temp, tmin)
+    resolved.time_period = get_time_period(params.time_period)
+    # the location is taken from the raster if not given manually
+    if resolved.longitude is None:
+        resolved.longitude = lon
+    if resolved.latitude is None:
+        resolved.latitude = lat
+    if sol_elev_ang is not None:
+        resolved.sol_elev_ang = sol_elev_ang
+    elif params.utc is not None:
+        resolved.sol_elev_ang = get_sol_elev_ang(
+                params.utc, resolved.longitude, resolved.latitude)
+    # Determine atmospheric transmissivity
+    resolved.atm_trans = get_atm_trans(params.atm_trans, resolved.sol_elev_ang)
+    # Calculate short wave incoming radiation
+    resolved.sw_irr = get_sw_irr(params.sw_irr, resolved.atm_trans,
+                                 resolved.sol_elev_ang)
+    # Calculate atmospheric emissivity
+    resolved.atm_emis = get_atm_emis(params.atm_emis, resolved.atm_trans)
+    return resolved
+
+def compute_fluxes_stepwise(lst, resolved, clamp=None):
+    '''Calculates the albedo and all output fluxes step by step with the
+    get_* functions above. This is the readable reference for
+    compute_fluxes, which gives the same values with less memory.
+    :lst : land surface temperatures [K], zeros already set to NaN
+    :resolved : ModelParameters as returned by resolve_parameters
+    :clamp : see compute_fluxes
+    '''
+    # Calculate surface albedo
+    albedo = get_albedo(lst, resolved.tmin, resolved.tmax, clamp)
+    # Calculate evaporative fraction Lambda
+    ef = get_evap_frac(lst, resolved.tmin, resolved.tmax, clamp)
+    # Calculate fluxes
+    rn = get_rn(lst, albedo, resolved.sw_irr, resolved.surf_emis,
+                resolved.atm_emis, resolved.air_temp, resolved.rn)
+    g = get_g(lst, rn, resolved.tmin, resolved.tmax, resolved.g_percentage,
+              clamp)
+    h, le = get_h_le(rn, g, ef)
+    # calculate the actual amount of evapotranspirated water
+    water = get_water(le, resolved.time_period, resolved.air_temp)
+    return {'rn': rn, 'le': le, 'h': h, 'g': g, 'ef': ef, 'water': water,
+            'albedo': albedo}
+
+def get_bands(bands=None):
+    '''Returns the requested output bands as tuple in the order of
+    output_bands and raises a ValueError for unknown bands
+    :bands : names of output bands, all of them if None
+    '''
+    if bands is None:
+        return output_bands
+    if isinstance(bands, str):
+        bands = [band.strip() for band in bands.split(',')]
+    unknown = [band for band in bands if band not in output_bands]
+    if unknown:
+        raise ValueError('Unknown output bands {}, use some of {}'.format(
+                ', '.join(unknown), ', '.join(output_bands)))
+    if not bands:
+        raise ValueError('No output bands requested')
+    return tuple(band for band in output_bands if band in bands)
+
+def required_bands(bands=None):
+    '''Returns the output bands that have to be computed for the requested
+    bands, in the order of output_bands, e.g. only ef for ef but rn, g, ef
+    and le for water
+    :bands : names of output bands, all of them if None
+    '''
+    needed = set()
+    stack = list(get_bands(bands))
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(band_dependencies[name])
+    return tuple(band for band in output_bands if band in needed)
+
+def allocate_buffers(shape, dtype, names=output_bands + ('albedo',)):
+    '''Returns a dictionary of empty arrays that compute_fluxes can write
+    into, e.g. once for all windows of the same size
+    :shape : shape of the land surface temperature array
+    :dtype : dtype of the land surface temperature array
+    :names : names of the buffers
+    '''
+    return {name: np.empty(shape, dtype=dtype) for name in names}
+
+def scale_lst(lst, tmin, tmax, out):
+    '''Writes the scaled temperatures (lst - tmin)/(tmax - tmin) into out.
+    This and the following fill_* functions are the in-place stages of
+    compute_fluxes, every one writes one array and reads the arrays of the
+    stages before it. Parameters can be arrays that broadcast against out,
+    see compute_fluxes.
+    '''
+    tmin = get_value(tmin)
+    np.subtract(lst, tmin, out=out)
+    np.divide(out, get_value(tmax) - tmin, out=out)
+    return out
+
+def fill_albedo(scaled, clamp, mask, out):
+    '''Writes the albedo (see get_albedo) of the scaled temperatures into
+    out, mask is a boolean scratch array'''
+    np.multiply(scaled, 0.2, out=out)
+    np.add(out, 0.05, out=out)
+    np.abs(out, out=out)
+    if clamp:
+        np.copyto(out, 0.25, where=np.greater(out, 1.0, out=mask))
+        np.copyto(out, 0.05, where=np.less(out, 0.0, out=mask))
+    return out
+
+def fill_evap_frac(lst, tmin, tmax, clamp, mask, out):
+    '''Writes the evaporative fraction (see get_evap_frac) into out'''
+    tmax = get_value(tmax)
+    np.subtract(tmax, lst, out=out)
+    np.divide(out, tmax - get_value(tmin), out=out)
+    if clamp:
+        np.copyto(out, 1.0, where=np.greater_equal(out, 1.0, out=mask))
+        np.copyto(out, 0.0, where=np.less_equal(out, 0.0, out=mask))
+    return out
+
+def fill_rn(lst, albedo, resolved, out, scratch=None):
+    '''Writes the net radiation (see get_rn) into out. albedo may be out
+    itself. scratch is an array for the emitted radiation, it is allocated
+    if None.'''
+    if resolved.rn is not None:
+        # lst*0 keeps the NaN of lst, all other pixels get rn
+        np.multiply(lst, 0, out=out)
+        np.add(out, get_value(resolved.rn), out=out)
+        return out
+    surf_emis = get_value(resolved.surf_emis)
+    np.subtract(1, albedo, out=out)
+    np.multiply(out, get_value(resolved.sw_irr), out=out)
+    np.add(out, surf_emis * get_value(resolved.atm_emis) * sb_const *
+           (get_value(resolved.air_temp)**4), out=out)
+    if scratch is None:
+        scratch = np.empty(out.shape, dtype=out.dtype)
+    np.power(lst, 4, out=scratch)
+    np.multiply(scratch, surf_emis * sb_const, out=scratch)
+    np.subtract(out, scratch, out=out)
+    return out
+
+def fill_g(rn, scaled, g_percentage, clamp, mask, out):
+    '''Writes the ground heat flux (see get_g) into out, the fraction g/rn
+    is clamped before it is multiplied by rn. scaled is only used if
+    g_percentage is None.'''
+    if g_percentage is None:
+        np.multiply(scaled, 0.4, out=out)
+        np.add(out, 0.05, out=out)
+        if clamp:
+            np.copyto(out, 0.45, where=np.greater(out, 1.0, out=mask))
+            np.copyto(out, 0.05, where=np.less(out, 0.0, out=mask))
+        np.multiply(out, rn, out=out)
+    else:
+        g_fraction = get_value(g_percentage) / 100
+        if clamp:
+            g_fraction = clamp_g_fraction(g_fraction)
+        np.multiply(rn, g_fraction, out=out)
+    return out
+
+def fill_le(rn, g, ef, out, h=None):
+    '''Writes the latent heat flux (see get_h_le) into out and the
+    sensible heat flux into h if it is given'''
+    if h is None:
+        np.subtract(rn, g, out=out)
+        np.multiply(out, ef, out=out)
+    else:
+        np.subtract(rn, g, out=h)
+        np.multiply(h, ef, out=out)
+        np.subtract(h, out, out=h)
+    return out
+
+def fill_h(rn, g, le, out):
+    '''Writes the sensible heat flux (see get_h_le) of an existing latent
+    heat flux into out'''
+    np.subtract(rn, g, out=out)
+    np.subtract(out, le, out=out)
+    return out
+
+def fill_water(le, time_period, air_temp, out):
+    '''Writes the amount of water (see get_water) into out'''
+    np.multiply(le, get_value(time_period), out=out)
+    np.divide(out, 1000000, out=out)
+    np.divide(out, 2.501-0.002361*(get_value(air_temp)-273.15), out=out)
+    return out
+
+def compute_fluxes(lst, resolved, clamp=None, out=None, bands=None):
+    '''Calculates the albedo and the output fluxes for the land surface
+    temperatures with the resolved model parameters and returns them as a
+    dictionary. All equations run in one pass of in-place operations on the
+    output arrays, so no temporary arrays are created besides one boolean
+    mask and the intermediate values of bands that are not requested. The
+    operations are the same as in compute_fluxes_stepwise, in the same
+    order, so the values are the same as well. Only a manual rn is used as
+    it is, rn*lst/lst could be off by one rounding step.
+    :lst : land surface temperatures [K], zeros already set to NaN
+    :resolved : ModelParameters as returned by resolve_parameters
+    :clamp : clamp albedo, ef and g/rn to their ranges, True if None. Only
+        the valid pixels are clamped, NaN pixels stay NaN. False keeps the
+        unclamped values, as the plugin did for images with nodata.
+    :out : dictionary of arrays with the shape of lst to write the fluxes
+        into, see allocate_buffers. Missing arrays are allocated. If out is
+        given without an 'albedo' array, the albedo is computed in the rn
+        array and not returned. Arrays of bands that are not requested are
+        used for intermediate values and not returned either.
+    :bands : output bands to compute, all of them if None. Bands that no
+        requested band depends on are skipped, see required_bands.
+    All arrays have the dtype of lst, use mask_zeros to set the precision.
+    sw_irr and atm_emis can be arrays with the shape of lst, see the
+    sol_elev_ang of resolve_parameters. In general every parameter can be
+    an array that broadcasts against lst, e.g. one value per scenario of a
+    sweep, only g_percentage and rn are either given or None for all.
+    '''
+    bands = get_bands(bands)
+    needed = required_bands(bands)
+    if out is None:
+        out = {} if 'rn' not in needed else {
+                'albedo': np.empty(lst.shape, dtype=lst.dtype)}
+    else:
+        out = dict(out)
+    for name in needed:
+        if name not in out:
+            out[name] = np.empty(lst.shape, dtype=lst.dtype)
+    # the comparisons of the clamps are False for NaN, so they only touch
+    # the valid pixels and need no scan for NaN
+    clamp = clamp is not False
+    mask = np.empty(lst.shape, dtype=bool)
+
+    if ('rn' in needed or
+            ('g' in needed and resolved.g_percentage is None)):
+        # scaled temperature, the water array is free until the end
+        scaled = out.get('water')
+        if scaled is None:
+            scaled = np.empty(lst.shape, dtype=lst.dtype)
+        scale_lst(lst, resolved.tmin, resolved.tmax, scaled)
+    else:
+        scaled = None
+
+    if 'rn' in needed:
+        # Calculate surface albedo, rn is only computed from it
+        albedo = fill_albedo(scaled, clamp, mask, out.get('albedo', out['rn']))
+
+    if 'ef' in needed:
+        # Calculate evaporative fraction Lambda
+        fill_evap_frac(lst, resolved.tmin, resolved.tmax, clamp, mask,
+                       out['ef'])
+
+    if 'rn' in needed:
+        # Calculate net radiation, the h array is free until the end
+        fill_rn(lst, albedo, resolved, out['rn'], out.get('h'))
+
+    if 'g' in needed:
+        # Calculate ground heat flux
+        fill_g(out['rn'], scaled, resolved.g_percentage, clamp, mask, out['g'])
+
+    if 'le' in needed:
+        # Calculate latent and sensible heat flux
+        fill_le(out['rn'], out['g'], out['ef'], out['le'], out.get('h'))
+
+    if 'water' in needed:
+        # calculate the actual amount of evapotranspirated water
+        fill_water(out['le'], resolved.time_period, resolved.air_temp,
+                   out['water'])
+    return {name: array for name, array in out.items()
+            if name in bands or (name == 'albedo' and 'rn' in needed)}
+
+def run_model(lst, params=None, lon=None, lat=None, percentile_method='exact',
+              precision=None, bands=None, sol_elev_ang=None, valid=None):
+    '''Runs the DATTUTDUT model on an array of land surface temperatures and
+    returns a ModelResult
+    :lst : land surface temperatures [K], zeros already set to NaN
+    :params : ModelParameters, the dialog defaults are used if None
+    :lon : longitude of the raster [dec]
+    :lat : latitude of the raster [dec]
+    :percentile_method : 'exact' or 'histogram', see get_tmin_tmax
+    :precision : 'float32' or 'float64' to convert lst before the run, None
+        to compute in the dtype of lst
+    :bands : output bands to compute, all of them if None
+    :sol_elev_ang : solar elevation angles of every pixel, see
+        resolve_parameters
+    :valid : validity mask of lst (see get_valid_mask), computed if None
+    '''
+    if params is None:
+        params = ModelParameters()
+    if precision is not None:
+        lst = lst.astype(get_dtype(precision), copy=False)
+    if valid is None:
+        valid = get_valid_mask(lst)
+    resolved = resolve_parameters(lst, params, lon, lat, percentile_method,
+                                  sol_elev_ang, valid)
+    return ModelResult(resolved, lst,
+                       compute_fluxes(lst, resolved, bands=bands), valid)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - mosaic mode
+This module runs the DATTUTDUT model on many overlapping frames, e.g. the
+drone frames of Data_Examples, into one output raster. tmin and tmax come
+from the percentiles of all frames together, so every frame is scaled the
+same way. The fluxes are computed window by window of the common grid:
+every frame that overlaps a window is read (nearest neighbour), computed
+with its own utc and the scene-wide tmin and tmax, and the frames are
+combined with an overlap rule. No merged temperature raster is written;
+a VRT of the frames can be written to look at the mosaic.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import numpy as np
+
+from . import model, percentiles, streaming
+
+# How the fluxes of overlapping frames are combined: the first or last frame
+# with data, the mean of all frames or the frame whose centre is closest
+overlap_rules = ('first', 'last', 'mean', 'centre')
+# Pixel size of the common grid: the smallest or largest pixels of the
+# frames or the pixels of the first frame
+grid_resolutions = ('highest', 'lowest', 'first')
+# Tile size of the common grid if none is given
+default_tile_size = 512
+
+
+def check_north_up(geo, in_file=''):
+    '''Raises a ValueError if a geotransform is rotated or not north up'''
+    if geo[2] or geo[4] or geo[1] <= 0 or geo[5] >= 0:
+        raise ValueError('{} is not a north up raster'.format(
+                in_file or 'The raster'))
+
+def get_source_indices(geo, shape, ref_geo, window):
+    '''Returns the rows and the columns of a raster under the pixel centres
+    of a window of a reference grid (nearest neighbour), -1 outside of the
+    raster
+    :geo : GDAL geotransform of the raster
+    :shape : (rows, cols) of the raster
+    :ref_geo : GDAL geotransform of the reference grid
+    :window : (xoff, yoff, xsize, ysize) on the reference grid
+    '''
+    xoff, yoff, xsize, ysize = window
+    x = ref_geo[0] + (xoff + np.arange(xsize) + 0.5) * ref_geo[1]
+    y = ref_geo[3] + (yoff + np.arange(ysize) + 0.5) * ref_geo[5]
+    cols = np.floor((x - geo[0]) / geo[1]).astype(np.int64)
+    rows = np.floor((y - geo[3]) / geo[5]).astype(np.int64)
+    cols[(cols < 0) | (cols >= shape[1])] = -1
+    rows[(rows < 0) | (rows >= shape[0])] = -1
+    return rows, cols
+
+def get_common_grid(geos, shapes, resolution='highest'):
+    '''Returns the geotransform, rows and columns of the grid that covers
+    all rasters
+    :geos : GDAL geotransforms of the rasters, north up
+    :shapes : (rows, cols) of the rasters
+    :resolution : one of grid_resolutions
+    '''
+    if resolution not in grid_resolutions:
+        raise ValueError('Unknown grid resolution {}, use one of {}'.format(
+                resolution, ', '.join(grid_resolutions)))
+    for geo in geos:
+        check_north_up(geo)
+    left = min(geo[0] for geo in geos)
+    top = max(geo[3] for geo in geos)
+    right = max(geo[0] + shape[1] * geo[1] for geo, shape in zip(geos, shapes))
+    bottom = min(geo[3] + shape[0] * geo[5] for geo, shape in zip(geos, shapes))
+    if resolution == 'first':
+        size_x, size_y = geos[0][1], -geos[0][5]
+    else:
+        pick = min if resolution == 'highest' else max
+        size_x = pick(geo[1] for geo in geos)
+        size_y = pick(-geo[5] for geo in geos)
+    # a rounding error of the extent must not add a row or column
+    cols = int(np.ceil((right - left) / size_x - 1e-6))
+    rows = int(np.ceil((top - bottom) / size_y - 1e-6))
+    return (left, size_x, 0.0, top, 0.0, -size_y), rows, cols
+
+
+class MosaicFrame:
+    '''One input frame of a Mosaic: its grid and its footprint on the
+    common grid'''
+
+    def __init__(self, in_file, geo, shape, prj):
+        self.in_file = in_file
+        self.geo = tuple(geo)
+        self.shape = tuple(shape)
+        self.prj = prj
+        # first and last row and column on the common grid, set by Mosaic
+        self.footprint = None
+
+    def overlaps(self, window):
+        '''Returns True if the frame overlaps a window of the common grid'''
+        xoff, yoff, xsize, ysize = window
+        col0, row0, col1, row1 = self.footprint
+        return (col0 < xoff + xsize and xoff <= col1 and
+                row0 < yoff + ysize and yoff <= row1)
+
+
+class Mosaic:
+    '''A virtual mosaic of overlapping frames on a common grid. Nothing is
+    read until a window is requested.
+    '''
+
+    def __init__(self, frames, resolution='highest'):
+        '''Constructor.
+        :param frames: list of land surface temperature rasters, earlier
+            frames come first for the overlap rules first and last
+        :param resolution: pixel size of the common grid, one of
+            grid_resolutions
+        '''
+        from . import raster_io
+
+        if not frames:
+            raise ValueError('No frames given')
+        self.frames = []
+        for in_file in frames:
+            raster = raster_io.get_dataset(in_file)
+            geo = raster.GetGeoTransform()
+            check_north_up(geo, in_file)
+            frame = MosaicFrame(in_file, geo, (raster.RasterYSize,
+                                               raster.RasterXSize),
+                                raster.GetProjection())
+            if (frame.prj and self.frames and self.frames[0].prj and
+                    frame.prj != self.frames[0].prj):
+                raise ValueError('{} is not in the coordinate system of {}, '
+                                 'reproject it first'.format(in_file,
+                                                             frames[0]))
+            self.frames.append(frame)
+        self.geo, self.rows, self.cols = get_common_grid(
+                [frame.geo for frame in self.frames],
+                [frame.shape for frame in self.frames], resolution)
+        self.prj = next((frame.prj for frame in self.frames if frame.prj), '')
+        self.resolution = resolution
+        size_x, size_y = self.geo[1], -self.geo[5]
+        for frame in self.frames:
+            # the cells of the common grid under the extent of the frame
+            left = (frame.geo[0] - self.geo[0]) / size_x
+            top = (self.geo[3] - frame.geo[3]) / size_y
+            right = left + frame.shape[1] * frame.geo[1] / size_x
+            bottom = top - frame.shape[0] * frame.geo[5] / size_y
+            frame.footprint = (max(int(np.floor(left)), 0),
+                               max(int(np.floor(top)), 0),
+                               min(int(np.ceil(right)), self.cols) - 1,
+                               min(int(np.ceil(bottom)), self.rows) - 1)
+
+    def get_windows(self, tile_size=None):
+        '''Returns the windows (xoff, yoff, xsize, ysize) of the common
+        grid, tile_size is a number of pixels or a tuple (rows, cols)'''
+        if tile_size is None:
+            tile_size = default_tile_size
+        if np.isscalar(tile_size):
+            tile_size = (int(tile_size), int(tile_size))
+        return list(streaming.iter_windows(self.rows, self.cols,
+                                           tile_size[0], tile_size[1]))
+
+    def get_frames(self, window):
+        '''Returns the indices of the frames that overlap a window'''
+        return [index for index, frame in enumerate(self.frames)
+                if frame.overlaps(window)]
+
+    def read_window(self, index, window, precision=model.default_precision,
+                    distance=False):
+        '''Returns the land surface temperatures of one frame on a window of
+        the common grid, NaN outside of the frame, or None if the frame
+        does not cover any pixel centre of the window. With distance the
+        squared distance of every pixel to the centre of the frame is
+        returned as well, in frame sizes.
+        :index : index of the frame
+        :window : (xoff, yoff, xsize, ysize) on the common grid
+        :precision : 'float32' or 'float64', the dtype of the temperatures
+        :distance : also return the distance to the centre of the frame
+        '''
+        from . import raster_io
+
+        frame = self.frames[index]
+        rows, cols = get_source_indices(frame.geo, frame.shape, self.geo,
+                                        window)
+        in_rows = rows >= 0
+        in_cols = cols >= 0
+        if not in_rows.any() or not in_cols.any():
+            return (None, None) if distance else None
+        row0, row1 = rows[in_rows].min(), rows[in_rows].max()
+        col0, col1 = cols[in_cols].min(), cols[in_cols].max()
+        # only the block of the frame under the window is read
+        band = raster_io.get_dataset(frame.in_file).GetRasterBand(1)
+        block = streaming.read_window(
+                band, (int(col0), int(row0), int(col1 - col0 + 1),
+                       int(row1 - row0 + 1)), precision)
+        lst = np.full((window[3], window[2]), np.nan, dtype=block.dtype)
+        lst[np.ix_(in_rows, in_cols)] = block[np.ix_(rows[in_rows] - row0,
+                                                     cols[in_cols] - col0)]
+        if not distance:
+            return lst
+        row_distance = ((rows + 0.5) / frame.shape[0] - 0.5)**2
+        col_distance = ((cols + 0.5) / frame.shape[1] - 0.5)**2
+        return lst, row_distance[:, np.newaxis] + col_distance[np.newaxis, :]
+
+    def scan(self, params, workers=1, executor='thread',
+             resolution=percentiles.default_resolution,
+             precision=model.default_precision):
+        '''Pre-pass over all frames, returns tmin and tmax of the whole
+        scene, see streaming.scan_scene. Pixels in the overlaps are counted
+        once per frame.'''
+        histogram = percentiles.HistogramPercentiles(resolution)
+        from . import raster_io
+
+        for frame in self.frames:
+            band = raster_io.get_dataset(frame.in_file).GetRasterBand(1)
+            histogram.merge(streaming.scan_histogram(
+                    frame.in_file, streaming.get_windows(band), workers,
+                    executor, resolution, precision))
+        return streaming.get_scene_tmin_tmax(histogram, params)
+
+    def write_vrt(self, vrt_file):
+        '''Writes a GDAL VRT of the frames on the common grid, the last
+        frame is on top where they overlap'''
+        from . import raster_io
+
+        size_x, size_y = self.geo[1], -self.geo[5]
+        vrt = raster_io.gdal.BuildVRT(
+                vrt_file, [frame.in_file for frame in self.frames],
+                resolution='user', xRes=size_x, yRes=size_y,
+                outputBounds=(self.geo[0], self.geo[3] - self.rows * size_y,
+                              self.geo[0] + self.cols * size_x, self.geo[3]))
+        if vrt is None:
+            raise IOError('Could not create {}'.format(vrt_file))
+        vrt.FlushCache()
+        del vrt
+        return vrt_file
+
+
+class OverlapBuffer:
+    '''Combines the fluxes of the frames that overlap one window with an
+    overlap rule. Frames are added in their order with add.
+    '''
+
+    def __init__(self, shape, dtype, bands, rule='first'):
+        '''Constructor.
+        :param shape: (rows, cols) of the window
+        :param dtype: dtype of the fluxes
+        :param bands: names of the flux bands
+        :param rule: one of overlap_rules
+        '''
+        if rule not in overlap_rules:
+            raise ValueError('Unknown overlap rule {}, use one of {}'.format(
+                    rule, ', '.join(overlap_rules)))
+        self.rule = rule
+        self.fluxes = {flux_name: np.full(shape, np.nan, dtype=dtype)
+                       for flux_name in bands}
+        if rule == 'mean':
+            for flux_name in bands:
+                self.fluxes[flux_name][...] = 0.0
+        # frames per pixel for mean, distance of the used frame for centre
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.distance = np.full(shape, np.inf)
+
+    def add(self, fluxes, valid, distance=None):
+        '''Adds the fluxes of one frame
+        :fluxes : dictionary with the flux arrays of the frame on the window
+        :valid : pixels of the window with data of the frame
+        :distance : distance to the centre of the frame, for the rule centre
+        '''
+        if self.rule == 'first':
+            use = valid & (self.count == 0)
+        elif self.rule == 'centre':
+            use = valid & (distance < self.distance)
+            self.distance[use] = distance[use]
+        else:
+            use = valid
+        for flux_name, out in self.fluxes.items():
+            if self.rule == 'mean':
+                np.add(out, fluxes[flux_name], out=out, where=use)
+            else:
+                np.copyto(out, fluxes[flux_name], where=use)
+        self.count += valid
+
+    def finish(self):
+        '''Returns the dictionary of the combined fluxes, NaN where no
+        frame has data'''
+        if self.rule == 'mean':
+            empty = self.count == 0
+            for out in self.fluxes.values():
+                np.divide(out, np.maximum(self.count, 1), out=out,
+                          casting='unsafe')
+                out[empty] = np.nan
+        return self.fluxes
+
+
+def run_mosaic(frames, out_file, utcs=None, params=None, rule='first',
+               resolution='highest', vrt_file=None, tile_size=None,
+               workers=1, executor='thread',
+               hist_resolution=percentiles.default_resolution,
+               precision=model.default_precision, options=None, bands=None,
+               callback=None):
+    '''Runs the DATTUTDUT model on overlapping frames into one output
+    raster on the common grid of the frames, see raster_io.OutputRaster.
+    Returns the resolved model parameters of every frame.
+    :frames : list of land surface temperature rasters
+    :out_file : path and file name of the output raster
+    :utcs : list with one utc per frame, see batch.get_frame_times, or None
+        to use the utc of params for all frames
+    :params : ModelParameters shared by all frames, tmin and tmax are taken
+        from the percentiles of all frames if they are not given
+    :rule : how overlapping frames are combined, one of overlap_rules
+    :resolution : pixel size of the common grid, one of grid_resolutions
+    :vrt_file : also write a VRT of the input frames, e.g. to look at the
+        temperature mosaic
+    :tile_size : size of the windows of the common grid, a number of
+        pixels or a tuple (rows, cols)
+    :workers : number of workers of the pre-pass, see streaming.iter_pool
+    :executor : 'thread' or 'process', see streaming.iter_pool
+    :hist_resolution : bin width of the percentile histogram [K]
+    :precision : 'float32' or 'float64', the dtype of the computation and of
+        the output bands
+    :options : raster_io.OutputOptions of the output raster
+    :bands : output bands to compute and write, all of them if None
+    :callback : function called with (done, total) after each window
+    '''
+    from . import raster_io
+
+    if rule not in overlap_rules:
+        raise ValueError('Unknown overlap rule {}, use one of {}'.format(
+                rule, ', '.join(overlap_rules)))
+    streaming.check_executor(executor)
+    dtype = model.get_dtype(precision)
+    bands = model.get_bands(bands)
+    if params is None:
+        params = model.ModelParameters()
+    if utcs is None:
+        utcs = [params.utc] * len(frames)
+    elif len(utcs) != len(frames):
+        raise ValueError('{} utc times given for {} frames'.format(
+                len(utcs), len(frames)))
+    mosaic = Mosaic(frames, resolution)
+    if vrt_file is not None:
+        mosaic.write_vrt(vrt_file)
+
+    # pre-pass for the scene-wide tmin and tmax
+    tmin, tmax = mosaic.scan(params, workers, executor, hist_resolution,
+                             precision)
+    # the sun of every frame is taken at its own time and corner
+    resolved_list = []
+    for frame, utc in zip(mosaic.frames, utcs):
+        lon, lat = raster_io.get_lon_lat(frame.geo)
+        resolved_list.append(model.resolve_parameters(
+                None, params.copy(utc=utc, tmin=tmin, tmax=tmax), lon, lat))
+
+    out_raster = raster_io.OutputRaster(
+            out_file, mosaic.rows, mosaic.cols, mosaic.geo, mosaic.prj, bands,
+            precision=precision, options=options)
+    windows = mosaic.get_windows(tile_size)
+    # unfinished files are deleted, as in streaming.run_streaming
+    try:
+        for done, window in enumerate(windows, 1):
+            overlap = OverlapBuffer((window[3], window[2]), dtype, bands, rule)
+            for index in mosaic.get_frames(window):
+                lst, distance = mosaic.read_window(index, window, precision,
+                                                   distance=True)
+                if lst is None:
+                    continue
+                fluxes = model.compute_fluxes(lst, resolved_list[index],
+                                              bands=bands)
+                overlap.add(fluxes, model.get_valid_mask(lst), distance)
+            out_raster.write(overlap.finish(), window[0], window[1])
+            if callback is not None:
+                callback(done, len(windows))
+        out_raster.close()
+    except BaseException:
+        out_raster.discard()
+        raise
+    return resolved_list
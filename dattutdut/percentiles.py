@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - percentiles of the land surface temperatures
+tmin and tmax are percentiles of the valid (not NaN) land surface
+temperatures. This module finds both of them at once, either exactly for
+an array in memory or approximately with a histogram that is filled block
+by block and can be merged, e.g. for rasters that do not fit in memory.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import numpy as np
+
+# Default width of the histogram bins [K]
+default_resolution = 0.01
+# Largest number of bins of a histogram, about 80 MB of counts
+max_bins = 10**7
+# Available methods
+methods = ('exact', 'histogram')
+
+
+def exact_percentiles(lst, thresholds, valid=None):
+    '''Returns the percentiles of the valid values of lst. The valid values
+    are copied once and both percentiles come from one partition of that
+    copy, the values are the same as np.percentile.
+    :lst : land surface temperatures, NaN is not valid
+    :thresholds : percentiles between 0 and 100
+    :valid : validity mask of lst, computed if None
+    '''
+    if valid is None:
+        valid = ~np.isnan(lst)
+    valid = lst[valid]
+    if valid.size == 0:
+        raise ValueError('The image contains no valid values')
+    # the thresholds get the dtype of the image, so float32 images are
+    # interpolated in float32 as with a single np.percentile call
+    thresholds = np.asarray(thresholds, dtype=valid.dtype)
+    return [float(value) for value in np.percentile(
+            valid, thresholds, overwrite_input=True)]
+
+
+class HistogramPercentiles:
+    '''Approximate percentiles from a histogram with a fixed bin width.
+    Blocks are added with update, histograms of different blocks or workers
+    are combined with merge. The error of a percentile is at most one bin
+    width, the minimum and maximum (percentile 0 and 100) are exact. If the
+    values span more than max_bins bins, the bin width is doubled until
+    they fit, so a wide range costs precision instead of failing.
+    '''
+
+    def __init__(self, resolution=default_resolution):
+        '''Constructor.
+        :param resolution: width of the bins, in the unit of the values
+        '''
+        self.resolution = float(resolution)
+        # index of the first bin, the bin of value v is floor(v/resolution)
+        self.offset = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.nan_count = 0
+
+    @property
+    def count(self):
+        '''Number of valid values'''
+        return int(self.counts.sum())
+
+    def get_factor(self, vmin, vmax, resolution=None):
+        '''Returns the power of two the bin width has to be multiplied by,
+        so the values of the histogram and the values from vmin to vmax fit
+        into max_bins bins
+        :vmin : smallest value to add
+        :vmax : largest value to add
+        :resolution : bin width, the one of the histogram if None
+        '''
+        if resolution is None:
+            resolution = self.resolution
+        vmin, vmax = min(vmin, self.vmin), max(vmax, self.vmax)
+        if not np.isfinite(vmin) or not np.isfinite(vmax):
+            raise ValueError('The histogram can only count finite values')
+        factor = 1
+        while True:
+            width = resolution * factor
+            # the bin indices must fit into int64 as well
+            if (np.floor(vmax / width) - np.floor(vmin / width) < max_bins and
+                    max(abs(vmin), abs(vmax)) / width < 2**62):
+                return factor
+            factor *= 2
+
+    def widen(self, factor):
+        '''Multiplies the bin width by factor and adds up the counts of the
+        bins that fall into one wider bin'''
+        if factor == 1:
+            return self
+        self.resolution *= factor
+        if self.offset is not None:
+            bins = np.floor((np.arange(self.counts.size) + self.offset) /
+                            float(factor)).astype(np.int64)
+            offset = int(bins[0])
+            self.counts = np.bincount(bins - offset,
+                                      weights=self.counts).astype(np.int64)
+            self.offset = offset
+        return self
+
+    def _add_counts(self, offset, counts):
+        '''Adds counts that start at bin offset to the histogram'''
+        if self.offset is None:
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        start = min(self.offset, offset)
+        end = max(self.offset + self.counts.size, offset + counts.size)
+        if start != self.offset or end != self.offset + self.counts.size:
+            grown = np.zeros(end - start, dtype=np.int64)
+            grown[self.offset - start:self.offset - start + self.counts.size] = self.counts
+            self.offset, self.counts = start, grown
+        self.counts[offset - start:offset - start + counts.size] += counts
+
+    def update(self, block, valid=None):
+        '''Adds the valid values of a block to the histogram
+        :block : array of values, NaN is not valid
+        :valid : validity mask of block, computed if None
+        '''
+        if valid is None:
+            valid = ~np.isnan(block)
+        valid = block[valid]
+        self.nan_count += block.size - valid.size
+        if valid.size == 0:
+            return
+        vmin, vmax = float(valid.min()), float(valid.max())
+        self.widen(self.get_factor(vmin, vmax))
+        self.vmin = min(self.vmin, vmin)
+        self.vmax = max(self.vmax, vmax)
+        bins = np.floor(valid / self.resolution).astype(np.int64)
+        offset = int(bins.min())
+        self._add_counts(offset, np.bincount(bins - offset))
+
+    def merge(self, other):
+        '''Adds the counts of another HistogramPercentiles with the same
+        resolution, or one that was widened from it'''
+        ratio = max(other.resolution, self.resolution) / min(
+                other.resolution, self.resolution)
+        factor = int(round(ratio))
+        if abs(ratio - factor) > 1e-9 * ratio or factor & (factor - 1):
+            raise ValueError('Only histograms with the same resolution can be merged')
+        self.nan_count += other.nan_count
+        if other.offset is None:
+            return self
+        if other.resolution != self.resolution:
+            if other.resolution < self.resolution:
+                other = other.copy().widen(factor)
+            else:
+                self.widen(factor)
+        # both histograms are widened if their values do not fit together
+        factor = self.get_factor(other.vmin, other.vmax)
+        if factor > 1:
+            self.widen(factor)
+            other = other.copy().widen(factor)
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        self._add_counts(other.offset, other.counts)
+        return self
+
+    def copy(self):
+        '''Returns a copy of the histogram'''
+        histogram = HistogramPercentiles(self.resolution)
+        histogram.offset = self.offset
+        histogram.counts = self.counts.copy()
+        histogram.vmin, histogram.vmax = self.vmin, self.vmax
+        histogram.nan_count = self.nan_count
+        return histogram
+
+    def percentiles(self, thresholds):
+        '''Returns the percentiles of all values added so far, interpolated
+        between the two closest ranks like np.percentile
+        :thresholds : percentiles between 0 and 100
+        '''
+        if self.offset is None:
+            raise ValueError('The image contains no valid values')
+        cum_counts = np.cumsum(self.counts)
+
+        def order_statistic(k):
+            # value of the k-th smallest value, spread evenly in its bin
+            i = int(np.searchsorted(cum_counts, k, side='right'))
+            before = cum_counts[i - 1] if i > 0 else 0
+            value = (self.offset + i + (k - before + 0.5) / self.counts[i]) * self.resolution
+            return min(max(value, self.vmin), self.vmax)
+
+        values = []
+        for threshold in thresholds:
+            if float(threshold) <= 0.0:
+                values.append(self.vmin)
+            elif float(threshold) >= 100.0:
+                values.append(self.vmax)
+            else:
+                rank = float(threshold) / 100 * (cum_counts[-1] - 1)
+                lower = int(np.floor(rank))
+                value = order_statistic(lower)
+                if rank > lower:
+                    value += (rank - lower) * (order_statistic(lower + 1) - value)
+                values.append(float(value))
+        return values
+
+
+def get_percentiles(lst, thresholds, method='exact',
+                    resolution=default_resolution, valid=None):
+    '''Returns the percentiles of the valid values of lst with the given
+    method
+    :lst : land surface temperatures, NaN is not valid
+    :thresholds : percentiles between 0 and 100
+    :method : 'exact' or 'histogram'
+    :resolution : bin width for the histogram method
+    :valid : validity mask of lst, computed if None
+    '''
+    if method == 'exact':
+        return exact_percentiles(lst, thresholds, valid)
+    if method == 'histogram':
+        histogram = HistogramPercentiles(resolution)
+        histogram.update(lst, valid)
+        return histogram.percentiles(thresholds)
+    raise ValueError('Unknown percentile method {}, use one of {}'.format(
+            method, ', '.join(methods)))
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - raster input and output
+This module reads land surface temperature rasters and writes the model
+output with GDAL. It does not import Qt or QGIS.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import collections
+import os
+import threading
+
+try:
+    from osgeo import gdal
+except ImportError as error:
+    # current GDAL only ships osgeo.gdal, falling back to the old top-level
+    # gdal module only replaced this error by a misleading one
+    raise ImportError('QWaterModel needs the GDAL Python bindings '
+                      '(osgeo.gdal): {}'.format(error))
+import numpy as np
+
+from . import cache, raw_io
+from .model import (default_precision, get_bands, get_dtype, mask_zeros,
+                    output_bands)
+
+# GDAL data types of the output rasters per precision
+gdal_types = {'float32': gdal.GDT_Float32, 'float64': gdal.GDT_Float64}
+# Compressions of the output GeoTIFFs, the LERC ones are lossy
+compressions = ('NONE', 'DEFLATE', 'ZSTD', 'LZW', 'LERC', 'LERC_DEFLATE',
+                'LERC_ZSTD')
+# Values of the GDAL BIGTIFF creation option
+bigtiff_modes = ('YES', 'NO', 'IF_NEEDED', 'IF_SAFER')
+# Suffix of the temporary GeoTIFF a COG is copied from
+cog_work_suffix = '.work.tif'
+# Decoded land surface temperatures of read_lst_img, see cache.ArrayCache
+lst_cache = cache.ArrayCache(cache.default_budget)
+# Number of datasets every thread keeps open in get_dataset
+max_open_datasets = 16
+# Open uncompressed ENVI rasters as memory maps, see raw_io
+use_memmap = True
+
+# GDAL datasets must not be shared between threads, so every thread keeps
+# its own handles here
+_handles = threading.local()
+
+
+class OutputOptions:
+    '''Creation options of the output GeoTIFFs. The defaults write tiled
+    GeoTIFFs compressed with DEFLATE and the floating point predictor, which
+    QGIS can pan through quickly and which are much smaller than striped
+    uncompressed files.
+    '''
+
+    def __init__(self, tiled=True, block_size=256, compress='DEFLATE',
+                 predictor=True, level=None, max_z_error=None,
+                 bigtiff='IF_SAFER', overviews=None, resampling='AVERAGE',
+                 cog=False, band_files=False, vrt=False, nodata=np.nan):
+        '''Constructor.
+        :param tiled: write tiles instead of strips, COGs are always tiled
+        :param block_size: width and height of the tiles, a multiple of 16
+        :param compress: one of compressions
+        :param predictor: use the floating point predictor with DEFLATE,
+            ZSTD and LZW
+        :param level: compression level of DEFLATE or ZSTD, None for the
+            GDAL default
+        :param max_z_error: largest error of the lossy LERC compressions, in
+            the unit of the band, None for lossless LERC
+        :param bigtiff: one of bigtiff_modes
+        :param overviews: None for no overviews, 'auto' for halving the size
+            until the overview fits into one tile, or a list of factors
+        :param resampling: GDAL resampling of the overviews
+        :param cog: write a Cloud-Optimized GeoTIFF, needs GDAL 3.1 or later
+        :param band_files: write every band into its own file, see
+            get_band_file
+        :param vrt: also write a VRT that stacks the band files, implies
+            band_files
+        :param nodata: nodata value of the bands. Pixels without data are
+            NaN in the fluxes, with another value they are written as it.
+        '''
+        self.tiled = tiled
+        self.block_size = int(block_size)
+        self.compress = str(compress).upper()
+        self.predictor = predictor
+        self.level = level
+        self.max_z_error = max_z_error
+        self.bigtiff = str(bigtiff).upper()
+        self.overviews = overviews
+        self.resampling = str(resampling).upper()
+        self.cog = cog
+        self.band_files = band_files or vrt
+        self.vrt = vrt
+        self.nodata = float(nodata)
+        if self.compress not in compressions:
+            raise ValueError('Unknown compression {}, use one of {}'.format(
+                    compress, ', '.join(compressions)))
+        if self.bigtiff not in bigtiff_modes:
+            raise ValueError('Unknown BIGTIFF mode {}, use one of {}'.format(
+                    bigtiff, ', '.join(bigtiff_modes)))
+        if self.block_size <= 0 or self.block_size % 16 != 0:
+            raise ValueError('The block size must be a multiple of 16')
+
+    def copy(self, **changes):
+        '''Returns a copy of the options with the given values replaced'''
+        values = dict(vars(self))
+        values.update(changes)
+        return OutputOptions(**values)
+
+    def get_overview_levels(self, rows, cols):
+        '''Returns the list of overview factors for a raster of the given
+        size'''
+        if self.overviews is None:
+            return []
+        if self.overviews != 'auto':
+            return [int(factor) for factor in self.overviews]
+        levels = []
+        factor = 2
+        while max(rows, cols) * 2 / factor > self.block_size:
+            levels.append(factor)
+            factor *= 2
+        return levels
+
+    def creation_options(self):
+        '''Returns the creation options for the GTiff driver, or for the COG
+        driver if cog is set'''
+        options = []
+        if self.cog:
+            options.append('BLOCKSIZE={}'.format(self.block_size))
+        elif self.tiled:
+            options += ['TILED=YES', 'BLOCKXSIZE={}'.format(self.block_size),
+                        'BLOCKYSIZE={}'.format(self.block_size)]
+        options.append('COMPRESS={}'.format(self.compress))
+        if self.predictor and self.compress in ('DEFLATE', 'ZSTD', 'LZW'):
+            # the COG driver picks the floating point predictor itself
+            options.append('PREDICTOR=YES' if self.cog else 'PREDICTOR=3')
+        if self.level is not None:
+            if self.cog:
+                options.append('LEVEL={}'.format(int(self.level)))
+            elif self.compress in ('DEFLATE', 'LERC_DEFLATE'):
+                options.append('ZLEVEL={}'.format(int(self.level)))
+            elif self.compress in ('ZSTD', 'LERC_ZSTD'):
+                options.append('ZSTD_LEVEL={}'.format(int(self.level)))
+        if self.max_z_error is not None and self.compress.startswith('LERC'):
+            options.append('MAX_Z_ERROR={}'.format(float(self.max_z_error)))
+        options.append('BIGTIFF={}'.format(self.bigtiff))
+        if self.cog:
+            # overviews built on the work file are used by the COG driver
+            options.append('OVERVIEWS={}'.format(
+                    'NONE' if self.overviews is None else 'AUTO'))
+            options.append('RESAMPLING={}'.format(self.resampling))
+        return options
+
+    def work_options(self):
+        '''Returns the options of the temporary tiled GeoTIFF a COG is
+        copied from. It is compressed losslessly, so lossy LERC is applied
+        only once.'''
+        compress = self.compress
+        if compress.startswith('LERC'):
+            compress = 'DEFLATE'
+        return self.copy(cog=False, tiled=True, compress=compress,
+                         max_z_error=None, overviews=None)
+
+    def __repr__(self):
+        return 'OutputOptions({})'.format(', '.join(
+                '{}={!r}'.format(name, value) for name, value in vars(self).items()))
+
+
+
+def open_raster(in_file):
+    '''Opens a raster read-only and raises an IOError if that fails.
+    Uncompressed ENVI rasters are memory-mapped with raw_io.RawRaster if
+    use_memmap is set, GDAL opens all others.
+    :in_file : path and file name
+    '''
+    if use_memmap and raw_io.is_raw_raster(in_file):
+        return raw_io.RawRaster(in_file)
+    raster = gdal.Open(in_file, gdal.GA_ReadOnly)
+    if raster is None:
+        raise IOError('Could not open raster {}'.format(in_file))
+    return raster
+
+def get_dataset(in_file):
+    '''Returns a read-only dataset of in_file from the handles of the
+    current thread, so a raster is not opened again for every window or
+    run. A raster that was written since it was opened is opened again,
+    and the least recently used handles are closed beyond
+    max_open_datasets.
+    :in_file : path and file name
+    '''
+    datasets = getattr(_handles, 'datasets', None)
+    if datasets is None:
+        datasets = _handles.datasets = collections.OrderedDict()
+    file_key = cache.get_file_key(in_file)
+    if in_file in datasets and datasets[in_file][0] == file_key:
+        datasets.move_to_end(in_file)
+        return datasets[in_file][1]
+    raster = open_raster(in_file)
+    datasets[in_file] = (file_key, raster)
+    datasets.move_to_end(in_file)
+    while len(datasets) > max_open_datasets:
+        datasets.popitem(last=False)
+    return raster
+
+def close_datasets():
+    '''Closes the handles of get_dataset of the current thread'''
+    _handles.datasets = collections.OrderedDict()
+
+def get_lst_key(in_file, precision=default_precision, band_number=1):
+    '''Returns the key of the land surface temperatures read_lst_img reads:
+    the path, the modification time and the size of the file, the band and
+    the precision, or None if in_file is not a local file
+    :in_file : path and file name
+    :precision : see read_lst_img
+    :band_number : see read_lst_img
+    '''
+    file_key = cache.get_file_key(in_file)
+    if file_key is None:
+        return None
+    return file_key + (band_number, precision)
+
+def read_lst_img(in_file, precision=default_precision, band_number=1,
+                 use_cache=True):
+    '''This function reads thermal image and extracts land sturface
+    temperature (lst) projection (prj) and georeference data (geo).
+    All zeros and the nodata value of the band are set to NaN, the
+    validity mask of the model. Memory-mapped rasters (see
+    open_raster) are not changed, the NaNs are set while the values are
+    copied out of the map.
+    The decoded image is kept in lst_cache, keyed by the path, the
+    modification time and the size of the file, the band and the
+    precision, so reading the same raster again does not touch the disk.
+    Cached arrays are shared and therefore read-only.
+    :in_file : path and file name
+    :precision : 'float32' or 'float64', the dtype of lst. A Float32 raster
+        read as float32 is not copied.
+    :band_number : band of the land surface temperatures
+    :use_cache : look up and store the image in lst_cache
+    '''
+    key = get_lst_key(in_file, precision, band_number) if use_cache else None
+    if key is not None:
+        cached = lst_cache.get(key)
+        if cached is not None:
+            return cached
+    new_raster = get_dataset(in_file)
+    band = new_raster.GetRasterBand(band_number)
+    lst = mask_zeros(band.ReadAsArray(), precision, band.GetNoDataValue())
+    prj = new_raster.GetProjection()
+    geo = new_raster.GetGeoTransform()
+    if key is not None:
+        lst.flags.writeable = False
+        # older versions of the file are not needed any more
+        lst_cache.discard(lambda other: other[0] == key[0] and
+                          other[1:3] != key[1:3])
+        lst_cache.put(key, (lst, prj, geo), lst.nbytes)
+    return lst, prj, geo
+
+def get_lon_lat(geo):
+    '''Returns longitude and latitude of the upper left corner of a raster
+    :geo : GDAL geotransform
+    '''
+    return float(geo[0]), float(geo[3])
+
+def get_band_file(out_file, flux_name):
+    '''Returns the file of one band if every band is written into its own
+    file, e.g. out_le.tif for out.tif'''
+    base_name, extension = os.path.splitext(out_file)
+    return '{}_{}{}'.format(base_name, flux_name, extension or '.tif')
+
+def get_vrt_file(out_file):
+    '''Returns the VRT that stacks the band files, e.g. out.vrt for out.tif'''
+    return os.path.splitext(out_file)[0] + '.vrt'
+
+def fill_nodata(array, nodata):
+    '''Returns the array with its NaN pixels set to the nodata value, the
+    array itself if nodata is NaN'''
+    if np.isnan(nodata):
+        return array
+    return np.where(np.isnan(array), np.asarray(nodata, dtype=array.dtype),
+                    array)
+
+def get_output_files(out_file, options=None, bands=None):
+    '''Returns the files that write_output_images writes for out_file'''
+    if options is None or not options.band_files:
+        return [out_file]
+    files = [get_band_file(out_file, flux_name)
+             for flux_name in get_bands(bands)]
+    if options.vrt:
+        files.append(get_vrt_file(out_file))
+    return files
+
+def get_cog_driver():
+    '''Returns the GDAL COG driver and raises an IOError if it is missing'''
+    cog_driver = gdal.GetDriverByName('COG')
+    if cog_driver is None:
+        raise IOError('Writing a Cloud-Optimized GeoTIFF needs GDAL 3.1 or later')
+    return cog_driver
+
+def create_output_raster(out_file, rows, cols, geo, prj, nbands=None,
+                         driver=None, precision=default_precision,
+                         options=None):
+    '''Creates the GeoTIFF for the output fluxes with one band per flux in
+    the order of output_bands. After the bands are written and the raster
+    is closed, finish_output_raster builds the overviews and the COG. For
+    a COG the bands are written into a temporary GeoTIFF next to out_file.
+    :out_file : path and file name
+    :rows : number of rows
+    :cols : number of columns
+    :geo : GDAL geotransform
+    :prj : projection as wkt
+    :nbands : number of bands, one per output flux if None
+    :driver : GDAL driver, can be passed in to reuse it for many rasters
+    :precision : 'float32' or 'float64', the data type of the bands
+    :options : OutputOptions, the defaults are used if None
+    '''
+    if nbands is None:
+        nbands = len(output_bands)
+    if driver is None:
+        driver = gdal.GetDriverByName('GTiff')
+    if options is None:
+        options = OutputOptions()
+    get_dtype(precision) # raises a ValueError for unknown precisions
+    creation_options = options.creation_options()
+    if options.cog:
+        # fail before the model runs if the COG can not be written
+        get_cog_driver()
+        out_file = out_file + cog_work_suffix
+        creation_options = options.work_options().creation_options()
+    out_raster = driver.Create(out_file, cols, rows, nbands,
+                               gdal_types[precision], creation_options)
+    if out_raster is None:
+        raise IOError('Could not create raster {}'.format(out_file))
+    out_raster.SetGeoTransform(geo)
+    out_raster.SetProjection(prj)
+    for band_number in range(1, nbands + 1):
+        out_raster.GetRasterBand(band_number).SetNoDataValue(options.nodata)
+    return out_raster
+
+def finish_output_raster(out_file, options=None):
+    '''Builds the overviews of a closed output raster of
+    create_output_raster. For a COG the temporary GeoTIFF is copied to
+    out_file with the COG driver and deleted.
+    :out_file : path and file name given to create_output_raster
+    :options : the OutputOptions given to create_output_raster
+    '''
+    if options is None:
+        options = OutputOptions()
+    work_file = out_file + cog_work_suffix if options.cog else out_file
+    if options.overviews is None and not options.cog:
+        return
+    out_raster = gdal.Open(work_file, gdal.GA_Update)
+    if out_raster is None:
+        raise IOError('Could not open raster {}'.format(work_file))
+    levels = options.get_overview_levels(out_raster.RasterYSize,
+                                         out_raster.RasterXSize)
+    if levels:
+        out_raster.BuildOverviews(options.resampling, levels)
+        out_raster.FlushCache()
+    if options.cog:
+        get_cog_driver().CreateCopy(out_file, out_raster, 0,
+                                    options.creation_options())
+    work_driver = out_raster.GetDriver()
+    del out_raster
+    if options.cog:
+        work_driver.Delete(work_file)
+
+class OutputRaster:
+    '''The output rasters of one model run. The requested bands are either
+    written into one GeoTIFF in the order of output_bands, or with the
+    band_files option into one GeoTIFF per band, optionally stacked by a
+    VRT. Fluxes are written with write, e.g. window by window, and close
+    writes everything to disk.
+    '''
+
+    def __init__(self, out_file, rows, cols, geo, prj, bands=None,
+                 driver=None, precision=default_precision, options=None):
+        '''Constructor.
+        :param out_file: path and file name of the output raster
+        :param rows: number of rows
+        :param cols: number of columns
+        :param geo: GDAL geotransform
+        :param prj: projection as wkt
+        :param bands: output bands to write, all of them if None
+        :param driver: GDAL driver, see create_output_raster
+        :param precision: 'float32' or 'float64', the data type of the bands
+        :param options: OutputOptions, the defaults are used if None
+        '''
+        self.out_file = out_file
+        self.bands = get_bands(bands)
+        self.options = OutputOptions() if options is None else options
+        if self.options.band_files:
+            self.files = [get_band_file(out_file, flux_name)
+                          for flux_name in self.bands]
+            self.rasters = [create_output_raster(
+                    band_file, rows, cols, geo, prj, 1, driver, precision,
+                    self.options) for band_file in self.files]
+            self.out_bands = [raster.GetRasterBand(1) for raster in self.rasters]
+        else:
+            self.files = [out_file]
+            self.rasters = [create_output_raster(
+                    out_file, rows, cols, geo, prj, len(self.bands), driver,
+                    precision, self.options)]
+            self.out_bands = [self.rasters[0].GetRasterBand(band_number)
+                              for band_number in range(1, len(self.bands) + 1)]
+        for out_band, flux_name in zip(self.out_bands, self.bands):
+            out_band.SetDescription(flux_name)
+
+    @property
+    def layer_file(self):
+        '''The file to open as layer: the VRT, the output raster or the
+        first band file'''
+        if self.options.vrt:
+            return get_vrt_file(self.out_file)
+        return self.files[0]
+
+    def write(self, fluxes, xoff=0, yoff=0):
+        '''Writes the requested bands of a dictionary of fluxes
+        :fluxes : dictionary with the flux arrays
+        :xoff : column of the upper left pixel of the arrays
+        :yoff : row of the upper left pixel of the arrays
+        '''
+        nodata = self.options.nodata
+        for out_band, flux_name in zip(self.out_bands, self.bands):
+            out_band.WriteArray(fill_nodata(fluxes[flux_name], nodata), xoff,
+                                yoff)
+
+    def close(self):
+        '''Writes the rasters to disk and builds the overviews, COGs and
+        the VRT'''
+        # Flush Cache
+        for raster in self.rasters:
+            raster.FlushCache()
+        # all handles are released, so the rasters are closed
+        self.out_bands = self.rasters = raster = None
+        for out_file in self.files:
+            finish_output_raster(out_file, self.options)
+        if self.options.vrt:
+            vrt = gdal.BuildVRT(get_vrt_file(self.out_file), self.files,
+                                separate=True)
+            if vrt is None:
+                raise IOError('Could not create {}'.format(
+                        get_vrt_file(self.out_file)))
+            for band_number, flux_name in enumerate(self.bands, 1):
+                vrt.GetRasterBand(band_number).SetDescription(flux_name)
+            vrt.FlushCache()
+            del vrt
+
+    def discard(self):
+        '''Releases the rasters without finishing them and deletes their
+        files, e.g. when a run is cancelled'''
+        self.out_bands = self.rasters = None
+        paths = [get_vrt_file(self.out_file)] if self.options.vrt else []
+        for out_file in self.files:
+            paths.extend((out_file, out_file + cog_work_suffix))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def write_output_images(out_file, fluxes, geo, prj, driver=None, options=None,
+                        bands=None, callback=None):
+    '''This function writes the output fluxes into a GeoTIFF with one band
+    per flux in the order of output_bands, or into one GeoTIFF per flux,
+    see OutputRaster. Returns the file to open as layer.
+    :out_file : path and file name
+    :fluxes : dictionary with the flux arrays
+    :geo : GDAL geotransform
+    :prj : projection as wkt
+    :driver : GDAL driver, see create_output_raster
+    :options : OutputOptions, see create_output_raster
+    :bands : output bands to write, all bands in fluxes if None
+    :callback : function called with (rows written, rows) after every strip
+        of one block height. An exception raised by it, e.g. to cancel the
+        run, or while the files are finished deletes the unfinished files.
+    The bands are Float64 for float64 fluxes and Float32 otherwise.
+    '''
+    if bands is None:
+        bands = [flux_name for flux_name in output_bands if flux_name in fluxes]
+    bands = get_bands(bands)
+    rows, cols = np.shape(fluxes[bands[0]])
+    precision = ('float64' if fluxes[bands[0]].dtype == np.float64
+                 else 'float32')
+    out_raster = OutputRaster(out_file, rows, cols, geo, prj, bands, driver,
+                              precision, options)
+    # Write the fluxes to their bands
+    try:
+        if callback is None:
+            out_raster.write(fluxes)
+        else:
+            strip = out_raster.options.block_size
+            for yoff in range(0, rows, strip):
+                out_raster.write({flux_name: fluxes[flux_name][yoff:yoff + strip]
+                                  for flux_name in bands}, 0, yoff)
+                callback(min(yoff + strip, rows), rows)
+        # overviews, the COG and the VRT are built here, their errors
+        # delete the unfinished files as well
+        out_raster.close()
+    except BaseException:
+        out_raster.discard()
+        raise
+    return out_raster.layer_file
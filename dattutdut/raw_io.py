@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - memory-mapped raw rasters
+This module opens uncompressed ENVI rasters (flat binary grids with a .hdr
+header) as NumPy memory maps instead of reading them with GDAL. A band is
+a read-only view of the file, so the model reads only the pages it
+touches and the data is neither copied up front nor changed. RawRaster
+and RawBand offer the parts of the GDAL dataset and band interface that
+raster_io and streaming use, so raster_io.open_raster returns them for
+these files. It does not need GDAL.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import os
+import numpy as np
+
+# NumPy types of the ENVI data type codes
+envi_types = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8', 12: 'u2',
+              13: 'u4', 14: 'i8', 15: 'u8'}
+# Interleaves of the bands in the file
+interleaves = ('bsq', 'bil', 'bip')
+
+
+def get_header_file(in_file):
+    '''Returns the ENVI header of a raster, raster.hdr or raster.bin.hdr,
+    or None if there is none'''
+    for header_file in (os.path.splitext(in_file)[0] + '.hdr',
+                        in_file + '.hdr'):
+        if header_file != in_file and os.path.isfile(header_file):
+            return header_file
+    return None
+
+def read_envi_header(header_file):
+    '''Returns the fields of an ENVI header as dictionary of strings with
+    lower case keys, values in braces can span several lines'''
+    with open(header_file) as input_file:
+        text = input_file.read()
+    if not text.lstrip().startswith('ENVI'):
+        raise IOError('{} is not an ENVI header'.format(header_file))
+    fields = {}
+    lines = iter(text.splitlines()[1:])
+    for line in lines:
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        value = value.strip()
+        if value.startswith('{'):
+            while '}' not in value:
+                value += ' ' + next(lines, '}').strip()
+            value = value[1:value.rindex('}')].strip()
+        fields[key.strip().lower()] = value
+    return fields
+
+def get_geo_transform(map_info):
+    '''Returns the GDAL geotransform of the map info field of an ENVI
+    header: projection, reference pixel (x, y, starting at 1), easting and
+    northing of the reference pixel and the pixel size'''
+    values = [value.strip() for value in map_info.split(',')]
+    ref_x, ref_y, easting, northing, size_x, size_y = [
+            float(value) for value in values[1:7]]
+    return (easting - (ref_x - 1) * size_x, size_x, 0.0,
+            northing + (ref_y - 1) * size_y, 0.0, -size_y)
+
+def is_raw_raster(in_file):
+    '''Returns True if in_file is an uncompressed ENVI raster that can be
+    memory-mapped'''
+    header_file = get_header_file(in_file)
+    if header_file is None:
+        return False
+    try:
+        fields = read_envi_header(header_file)
+    except (IOError, UnicodeDecodeError):
+        return False
+    return (fields.get('file type', 'ENVI').upper().startswith('ENVI') and
+            fields.get('file compression', '0') == '0' and
+            int(fields.get('data type', 0)) in envi_types and
+            fields.get('interleave', 'bsq').lower() in interleaves)
+
+
+class RawBand:
+    '''One band of a RawRaster, a read-only view of the memory map. It
+    behaves like the GDAL bands used by raster_io and streaming.
+    '''
+
+    def __init__(self, array, nodata=None):
+        '''Constructor.
+        :param array: read-only (rows, cols) view of the memory map
+        :param nodata: value of the data ignore value field, or None
+        '''
+        self.array = array
+        self.nodata = nodata
+        self.YSize, self.XSize = array.shape
+
+    def ReadAsArray(self, xoff=0, yoff=0, win_xsize=None, win_ysize=None):
+        '''Returns a read-only view of a window, nothing is copied'''
+        if win_xsize is None:
+            win_xsize = self.XSize - xoff
+        if win_ysize is None:
+            win_ysize = self.YSize - yoff
+        return self.array[yoff:yoff + win_ysize, xoff:xoff + win_xsize]
+
+    def GetBlockSize(self):
+        '''Rows are contiguous in the file, streaming combines them into
+        windows of streaming.min_window_pixels'''
+        return [self.XSize, 1]
+
+    def GetNoDataValue(self):
+        return self.nodata
+
+
+class RawRaster:
+    '''An uncompressed ENVI raster opened as NumPy memory map. It behaves
+    like the GDAL datasets used by raster_io and streaming.
+    '''
+
+    def __init__(self, in_file):
+        '''Constructor.
+        :param in_file: path and file name of the binary file, the header
+            is found with get_header_file
+        '''
+        header_file = get_header_file(in_file)
+        if header_file is None:
+            raise IOError('{} has no ENVI header'.format(in_file))
+        fields = read_envi_header(header_file)
+        self.in_file = in_file
+        self.RasterXSize = int(fields['samples'])
+        self.RasterYSize = int(fields['lines'])
+        self.RasterCount = int(fields.get('bands', 1))
+        self.interleave = fields.get('interleave', 'bsq').lower()
+        dtype = np.dtype(envi_types[int(fields['data type'])])
+        # byte order 1 is big endian
+        self.dtype = dtype.newbyteorder(
+                '>' if fields.get('byte order', '0') == '1' else '<')
+        self.offset = int(fields.get('header offset', 0))
+        self.nodata = (float(fields['data ignore value'])
+                       if 'data ignore value' in fields else None)
+        self.geo = (get_geo_transform(fields['map info'])
+                    if 'map info' in fields else (0.0, 1.0, 0.0, 0.0, 0.0, 1.0))
+        self.prj = fields.get('coordinate system string', '')
+        shapes = {'bsq': (self.RasterCount, self.RasterYSize, self.RasterXSize),
+                  'bil': (self.RasterYSize, self.RasterCount, self.RasterXSize),
+                  'bip': (self.RasterYSize, self.RasterXSize, self.RasterCount)}
+        self.data = np.memmap(in_file, self.dtype, 'r', self.offset,
+                              shapes[self.interleave])
+
+    def GetRasterBand(self, band_number):
+        '''Returns a RawBand, band_number starts at 1'''
+        if not 1 <= band_number <= self.RasterCount:
+            raise IOError('{} has no band {}'.format(self.in_file,
+                                                      band_number))
+        index = band_number - 1
+        if self.interleave == 'bsq':
+            array = self.data[index]
+        elif self.interleave == 'bil':
+            array = self.data[:, index, :]
+        else:
+            array = self.data[:, :, index]
+        return RawBand(array, self.nodata)
+
+    def GetGeoTransform(self):
+        return self.geo
+
+    def GetProjection(self):
+        return self.prj
+
+
+def write_envi(out_file, array, geo=None, prj='', interleave='bsq',
+               byte_order='<'):
+    '''Writes an array of shape (rows, cols) or (bands, rows, cols) as ENVI
+    raster with header, e.g. to hand rasters to other tools or for tests
+    :out_file : path and file name of the binary file, the header gets the
+        extension .hdr
+    :array : values of the bands
+    :geo : GDAL geotransform, north up
+    :prj : projection as wkt
+    :interleave : one of interleaves
+    :byte_order : '<' or '>'
+    '''
+    array = np.asarray(array)
+    if array.ndim == 2:
+        array = array[np.newaxis]
+    codes = {np.dtype(code): number for number, code in envi_types.items()}
+    dtype = array.dtype.newbyteorder('=')
+    if dtype not in codes:
+        raise ValueError('ENVI cannot store {} values'.format(array.dtype))
+    if interleave not in interleaves:
+        raise ValueError('Unknown interleave {}, use one of {}'.format(
+                interleave, ', '.join(interleaves)))
+    bands, rows, cols = array.shape
+    order = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (1, 2, 0)}
+    np.ascontiguousarray(array.transpose(order[interleave]),
+                         dtype.newbyteorder(byte_order)).tofile(out_file)
+    lines = ['ENVI', 'samples = {}'.format(cols), 'lines = {}'.format(rows),
+             'bands = {}'.format(bands), 'header offset = 0',
+             'file type = ENVI Standard',
+             'data type = {}'.format(codes[dtype]),
+             'interleave = {}'.format(interleave),
+             'byte order = {}'.format(1 if byte_order == '>' else 0)]
+    if geo is not None:
+        lines.append('map info = {{Arbitrary, 1, 1, {!r}, {!r}, {!r}, {!r}}}'
+                     .format(geo[0], geo[3], geo[1], -geo[5]))
+    if prj:
+        lines.append('coordinate system string = {{{}}}'.format(prj))
+    with open(os.path.splitext(out_file)[0] + '.hdr', 'w') as output_file:
+        output_file.write('\n'.join(lines) + '\n')
+    return out_file
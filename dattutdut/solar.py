@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - solar geometry
+The solar elevation angle as vectorized NumPy function. Times, longitudes
+and latitudes can be scalars or arrays that broadcast against each other,
+e.g. one time per frame against a grid of pixel locations. Single values
+are memoized per (time, location), so frames with the same time and
+location share one calculation.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+
+This part is based on the SunPositionCalculator by mperezcorrales
+original repository = https://github.com/mperezcorrales/SunPositionCalculator
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import collections
+import threading
+import numpy as np
+
+# Number of (time, location) values kept by the memo
+cache_size = 4096
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def to_datetime64(utc):
+    '''Returns utc as datetime64 array with a resolution of seconds
+    :utc : datetime, string in the format YYYY-MM-DDTHH:MM:SS, datetime64 or
+        an array or list of them
+    '''
+    return np.asarray(utc, dtype='datetime64[s]')
+
+def sol_elev_ang(utc, lon, lat):
+    '''Returns the solar elevation angle [deg] for all combinations of the
+    broadcast inputs, a float for scalar inputs
+    :utc : time(s), see to_datetime64
+    :lon : longitude(s) [dec]
+    :lat : latitude(s) [dec]
+    '''
+    utc = to_datetime64(utc)
+    #get day of the year, hour and minute from the datetime format
+    day = utc.astype('datetime64[D]')
+    doy = (day - utc.astype('datetime64[Y]')).astype(np.float64) + 1
+    minutes = (utc - day).astype('timedelta64[m]').astype(np.int64)
+    daytime = (minutes // 60).astype(np.float64) + (minutes % 60) / 60
+
+    g = (360 / 365.25) * (doy + daytime/24)
+    g_radians = np.radians(g)
+    declination = (0.396372 - 22.91327 * np.cos(g_radians) + 4.02543 *
+                   np.sin(g_radians) - 0.387205 * np.cos(2 * g_radians)
+                   + 0.051967 * np.sin(2 * g_radians) - 0.154527 *
+                   np.cos(3 * g_radians) + 0.084798 * np.sin(3 * g_radians))
+
+    time_correction = (0.004297 + 0.107029 * np.cos(g_radians) - 1.837877 *
+                       np.sin(g_radians) - 0.837378 * np.cos(2 * g_radians) -
+                       2.340475 * np.sin(2 * g_radians))
+
+    SHA = (daytime - 12) * 15 + np.asarray(lon, dtype=np.float64) + time_correction
+    SHA = np.where(SHA > 180, SHA - 360, np.where(SHA < -180, SHA + 360, SHA))
+
+    lat_radians = np.radians(np.asarray(lat, dtype=np.float64))
+    d_radians = np.radians(declination)
+    SHA_radians = np.radians(SHA)
+
+    # rounding can push the cosine slightly beyond [-1, 1]
+    SZA_radians = np.arccos(np.clip(
+            np.sin(lat_radians) * np.sin(d_radians) + np.cos(lat_radians)
+            * np.cos(d_radians) * np.cos(SHA_radians), -1.0, 1.0))
+
+    SEA = 90 - np.degrees(SZA_radians)
+    if np.ndim(SEA) == 0:
+        return float(SEA)
+    return SEA
+
+def _cache_key(utc, lon, lat):
+    '''Returns the memo key of one time and location'''
+    return (int(to_datetime64(utc).astype(np.int64)), float(lon), float(lat))
+
+def _store(key, value):
+    '''Stores one value in the memo and drops the oldest ones'''
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > cache_size:
+            _cache.popitem(last=False)
+
+def cached_sol_elev_ang(utc, lon, lat):
+    '''Returns the solar elevation angle [deg] of one time and location,
+    memoized per (time, location)
+    :utc : time, see to_datetime64
+    :lon : longitude [dec]
+    :lat : latitude [dec]
+    '''
+    key = _cache_key(utc, lon, lat)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    value = sol_elev_ang(utc, lon, lat)
+    _store(key, value)
+    return value
+
+def prime_cache(utcs, lons, lats):
+    '''Computes the solar elevation angles of many (time, location) pairs
+    in one vectorized call and memoizes them, e.g. for all frames of a
+    batch before the first frame is read
+    :utcs : times, see to_datetime64
+    :lons : longitudes [dec], one per time or one for all
+    :lats : latitudes [dec], one per time or one for all
+    '''
+    utcs, lons, lats = np.broadcast_arrays(to_datetime64(utcs),
+                                           np.asarray(lons, dtype=np.float64),
+                                           np.asarray(lats, dtype=np.float64))
+    values = np.atleast_1d(sol_elev_ang(utcs, lons, lats))
+    for utc, lon, lat, value in zip(utcs.ravel(), lons.ravel(), lats.ravel(),
+                                    values.ravel()):
+        _store(_cache_key(utc, lon, lat), float(value))
+
+def clear_cache():
+    '''Empties the memo'''
+    with _cache_lock:
+        _cache.clear()
+
+def pixel_lon_lat(geo, rows, cols):
+    '''Returns the longitudes and latitudes of pixel centers as two arrays
+    that broadcast to (len(rows), len(cols)). The geotransform must be in
+    geographic coordinates, like for the upper left corner in
+    raster_io.get_lon_lat.
+    :geo : GDAL geotransform
+    :rows : row indices, e.g. np.arange(number of rows)
+    :cols : column indices
+    '''
+    rows = np.asarray(rows, dtype=np.float64)[:, np.newaxis] + 0.5
+    cols = np.asarray(cols, dtype=np.float64)[np.newaxis, :] + 0.5
+    lon = geo[0] + cols * geo[1] + rows * geo[2]
+    lat = geo[3] + cols * geo[4] + rows * geo[5]
+    return lon, lat
+
+def _coarse_indices(size, step):
+    '''Returns every step-th index of an axis and always the last one'''
+    indices = np.arange(0, size, step)
+    if indices[-1] != size - 1:
+        indices = np.append(indices, size - 1)
+    return indices
+
+def _interpolate_axis(values, coarse, size, axis):
+    '''Interpolates values given at the coarse indices of an axis linearly
+    to all size indices of that axis'''
+    if coarse.size == 1:
+        return np.repeat(values, size, axis=axis)
+    fine = np.arange(size)
+    lower = np.clip(np.searchsorted(coarse, fine, side='right') - 1,
+                    0, coarse.size - 2)
+    weight = (fine - coarse[lower]) / (coarse[lower + 1] - coarse[lower])
+    shape = [1] * values.ndim
+    shape[axis] = size
+    weight = weight.reshape(shape)
+    return (np.take(values, lower, axis=axis) * (1 - weight) +
+            np.take(values, lower + 1, axis=axis) * weight)
+
+def sol_elev_ang_grid(utc, geo, rows, cols, step=1):
+    '''Returns the solar elevation angle [deg] of every pixel of a raster.
+    With step > 1 the angle is only computed for every step-th pixel and
+    interpolated bilinearly in between, which is accurate to far below a
+    hundredth degree for grids of some kilometers. Many times give one
+    grid per time, with shape (number of times, rows, cols).
+    :utc : time or array of times, see to_datetime64
+    :geo : GDAL geotransform in geographic coordinates
+    :rows : number of rows
+    :cols : number of columns
+    :step : distance of the computed pixels
+    '''
+    row_indices = _coarse_indices(rows, max(1, int(step)))
+    col_indices = _coarse_indices(cols, max(1, int(step)))
+    lon, lat = pixel_lon_lat(geo, row_indices, col_indices)
+    utc = to_datetime64(utc)
+    if utc.ndim:
+        utc = utc.reshape(utc.shape + (1, 1))
+    grid = np.asarray(sol_elev_ang(utc, lon, lat))
+    if row_indices.size != rows:
+        grid = _interpolate_axis(grid, row_indices, rows, grid.ndim - 2)
+    if col_indices.size != cols:
+        grid = _interpolate_axis(grid, col_indices, cols, grid.ndim - 1)
+    return grid
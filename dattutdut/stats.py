@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - output statistics
+This module computes the statistics of the land surface temperatures, the
+albedo and the output fluxes in one pass. The statistics are accumulated
+block by block and can be merged, so they can also be collected window by
+window in the streaming mode. They are written as the .csv file of the
+plugin, or as machine-readable CSV or JSON.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import csv
+import json
+import numpy as np
+
+from .model import format_utc, output_bands
+from .percentiles import HistogramPercentiles
+
+# Names of the fluxes in the stats file
+flux_labels = {
+    'rn': 'net radiation [W/m²]',
+    'le': 'latent heat flux [W/m²]',
+    'h': 'sensible heat flux [W/m²]',
+    'g': 'ground heat flux [W/m²]',
+    'ef': 'evaporative fraction [-]',
+    'water': 'water amount [mm/time/m²]',
+}
+# Bands of the statistics, the inputs first
+stats_bands = ('lst', 'albedo') + output_bands
+# Percentiles of every band
+default_percentiles = (5, 50, 95)
+# Width of the histogram bins of the percentiles, in the unit of the band
+resolutions = {'lst': 0.01, 'albedo': 1e-4, 'rn': 0.01, 'le': 0.01, 'h': 0.01,
+               'g': 0.01, 'ef': 1e-4, 'water': 1e-5}
+# Formats of the stats files
+stats_formats = ('text', 'csv', 'json')
+
+
+class BandStatistics:
+    '''Running statistics of the valid (not NaN) values of one band: count,
+    mean, standard deviation, minimum, maximum and percentiles. Blocks are
+    added with update, statistics of other blocks or workers are combined
+    with merge. The mean and the variance are accumulated in float64 with
+    the pairwise update of Chan et al. (1979).
+    '''
+
+    def __init__(self, resolution=0.01, with_percentiles=True):
+        '''Constructor.
+        :param resolution: bin width of the percentile histogram
+        :param with_percentiles: collect the histogram for the percentiles
+        '''
+        self.count = 0
+        self.nan_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = (HistogramPercentiles(resolution)
+                          if with_percentiles else None)
+
+    def _combine(self, count, mean, m2):
+        '''Adds the count, mean and sum of squared deviations of a block'''
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, block, valid=None, scratch=None):
+        '''Adds the valid values of a block. No copies of the block are
+        made besides the histogram of the percentiles.
+        :block : array of values, NaN is not valid
+        :valid : boolean array of the valid values, computed if None
+        :scratch : array with the shape of block for the squared deviations,
+            e.g. shared by all bands of a block
+        '''
+        if valid is None:
+            valid = ~np.isnan(block)
+        count = int(np.count_nonzero(valid))
+        self.nan_count += block.size - count
+        if count == 0:
+            return
+        mean = float(np.add.reduce(block, axis=None, dtype=np.float64,
+                                   where=valid)) / count
+        if scratch is None:
+            scratch = np.empty(block.shape, dtype=block.dtype)
+        np.subtract(block, mean, out=scratch)
+        np.square(scratch, out=scratch)
+        m2 = float(np.add.reduce(scratch, axis=None, dtype=np.float64,
+                                 where=valid))
+        self.add_moments(count, mean, m2,
+                         float(np.min(block, where=valid, initial=np.inf)),
+                         float(np.max(block, where=valid, initial=-np.inf)))
+        if self.histogram is not None:
+            self.histogram.update(block, valid)
+
+    def add_moments(self, count, mean, m2, minimum, maximum):
+        '''Adds a block of valid values that is already reduced to its
+        count, mean, sum of squared deviations, minimum and maximum, e.g.
+        one row of a reduction along an axis. The histogram of the
+        percentiles is not updated.
+        '''
+        if count == 0:
+            return
+        self._combine(count, mean, m2)
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def merge(self, other):
+        '''Adds the statistics of another BandStatistics'''
+        self.nan_count += other.nan_count
+        if other.count == 0:
+            return self
+        self._combine(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.merge(other.histogram)
+        return self
+
+    @property
+    def std(self):
+        '''Standard deviation of the valid values, like np.std'''
+        if self.count == 0:
+            return np.nan
+        return float(np.sqrt(self.m2 / self.count))
+
+    def as_dict(self, percentiles=default_percentiles):
+        '''Returns the statistics as dictionary, NaN for an empty band'''
+        values = {'count': self.count, 'nan_count': self.nan_count,
+                  'mean': self.mean if self.count else np.nan,
+                  'std': self.std,
+                  'min': self.min if self.count else np.nan,
+                  'max': self.max if self.count else np.nan}
+        if self.histogram is not None and percentiles:
+            if self.count:
+                results = self.histogram.percentiles(percentiles)
+            else:
+                results = [np.nan] * len(percentiles)
+            for percentile, value in zip(percentiles, results):
+                values['p{:g}'.format(percentile)] = value
+        return values
+
+
+class FluxStatistics:
+    '''Statistics of the land surface temperatures, the albedo and the
+    output fluxes of one model run. All bands are updated together, with
+    one validity mask per block: the albedo and the fluxes are NaN exactly
+    where the land surface temperatures are.
+    '''
+
+    def __init__(self, bands=stats_bands, percentiles=default_percentiles):
+        '''Constructor.
+        :param bands: names of the bands, see stats_bands
+        :param percentiles: percentiles between 0 and 100 of every band,
+            an empty tuple for none
+        '''
+        self.percentiles = tuple(percentiles)
+        self.bands = {name: BandStatistics(resolutions.get(name, 0.01),
+                                           bool(self.percentiles))
+                      for name in bands}
+
+    def update(self, arrays, valid=None):
+        '''Adds one block of all bands that are in arrays
+        :arrays : dictionary of arrays with the same shape, e.g. the fluxes
+            of compute_fluxes plus 'lst'
+        :valid : validity mask of the block, e.g. ModelResult.valid. It is
+            computed from 'lst' or the first band if None.
+        '''
+        present = [name for name in self.bands if name in arrays]
+        if not present:
+            return
+        if valid is None:
+            valid = ~np.isnan(arrays['lst' if 'lst' in arrays
+                                     else present[0]])
+        scratch = np.empty(valid.shape, dtype=arrays[present[0]].dtype)
+        for name in present:
+            self.bands[name].update(arrays[name], valid, scratch)
+
+    def merge(self, other):
+        '''Adds the statistics of another FluxStatistics'''
+        for name, band_stats in other.bands.items():
+            if name in self.bands:
+                self.bands[name].merge(band_stats)
+        return self
+
+    def as_dict(self):
+        '''Returns a dictionary with the statistics of every band that got
+        values'''
+        return {name: band_stats.as_dict(self.percentiles)
+                for name, band_stats in self.bands.items()
+                if band_stats.count or band_stats.nan_count}
+
+    def __getitem__(self, name):
+        return self.bands[name]
+
+
+def get_statistics(result, percentiles=default_percentiles):
+    '''Returns the FluxStatistics of a ModelResult
+    :result : ModelResult of the model run
+    :percentiles : see FluxStatistics
+    '''
+    statistics = FluxStatistics(percentiles=percentiles)
+    arrays = dict(result.fluxes)
+    arrays['lst'] = result.lst
+    statistics.update(arrays, result.valid)
+    return statistics
+
+def format_parameter(value):
+    '''Returns a model parameter as text, the mean for per-pixel values'''
+    if np.ndim(value) > 0:
+        return str(np.nanmean(value))
+    return str(value)
+
+def get_parameter_values(params):
+    '''Returns the resolved model parameters as dictionary for JSON, times
+    as text and per-pixel values as their mean'''
+    values = params.as_dict()
+    values['sol_elev_ang'] = params.sol_elev_ang
+    for name, value in values.items():
+        if name == 'utc':
+            values[name] = format_utc(value)
+        elif value is not None:
+            values[name] = (float(np.nanmean(value)) if np.ndim(value) > 0
+                            else float(value))
+    return values
+
+def write_stats(file, flux_name, band_stats):
+    '''Writes mean, min and max of a flux as one line to the stats file
+    :file : open text file
+    :flux_name : label of the flux
+    :band_stats : BandStatistics of the flux
+    '''
+    file.write(flux_name + ' ' + str(band_stats.mean) + ' ' +
+               str(band_stats.min) + ' ' + str(band_stats.max) + '\n')
+
+def write_output_stats(out_file, input_name, result, statistics=None):
+    '''This function creates the output .csv file
+    :out_file : path and file name of the .csv file
+    :input_name : name of the input raster
+    :result : ModelResult of the model run
+    :statistics : FluxStatistics of the run, computed from result if None
+    '''
+    params = result.parameters
+    if statistics is None:
+        statistics = get_statistics(result, percentiles=())
+    # write the output data in a .csv file
+    with open(out_file, 'w') as output_file:
+        # write an out file with the most important stats
+        # model parameters
+        output_file.write('QWaterModel output stats:' + '\n')
+        output_file.write('Input file name: ' + str(input_name) + '\n')
+        output_file.write('utc: ' + str(format_utc(params.utc)) + '\n')
+        output_file.write('Temperature information:' + '\n')
+        output_file.write('tmin: ' + str(params.tmin) + '\n')
+        output_file.write('tmax: ' + str(params.tmax) + '\n')
+        output_file.write('temp mean: ' + str(statistics['lst'].mean) + '\n')
+        output_file.write('Model parameters:' + '\n')
+        output_file.write('surf_emis: ' + str(params.surf_emis) + '\n')
+        output_file.write('atm_emis: ' + format_parameter(params.atm_emis) + '\n')
+        output_file.write('atm_trans: ' + format_parameter(params.atm_trans) + '\n')
+        output_file.write('solar_elev_ang: ' + format_parameter(params.sol_elev_ang) + '\n')
+        if statistics['albedo'].count:
+            output_file.write('albedo mean: ' + str(statistics['albedo'].mean) + '\n')
+        output_file.write('sw_irr: ' + format_parameter(params.sw_irr) + '\n')
+        output_file.write('air_temp: ' + str(params.air_temp) + '\n')
+        output_file.write('time_period: ' + str(params.time_period) + '\n')
+        output_file.write('Output raster information:' + '\n')
+        output_file.write('flux ' + 'mean ' + 'min ' + 'max ' + '\n')
+        # only the bands that were computed
+        for flux_name in flux_labels:
+            if not statistics[flux_name].count:
+                continue
+            write_stats(output_file, flux_labels[flux_name], statistics[flux_name])
+
+def write_stats_csv(out_file, statistics):
+    '''Writes the statistics as CSV with a header and one row per band
+    :out_file : path and file name of the .csv file
+    :statistics : FluxStatistics
+    '''
+    rows = statistics.as_dict()
+    columns = ['band']
+    for values in rows.values():
+        columns += [column for column in values if column not in columns]
+    with open(out_file, 'w', newline='') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(columns)
+        for name, values in rows.items():
+            writer.writerow([name] + [values.get(column, '')
+                                      for column in columns[1:]])
+
+def write_stats_json(out_file, input_name, result, statistics):
+    '''Writes the input name, the resolved model parameters and the
+    statistics of every band as JSON
+    :out_file : path and file name of the .json file
+    :input_name : name of the input raster
+    :result : ModelResult of the model run, only its parameters are used
+    :statistics : FluxStatistics
+    '''
+    # NaN is not valid JSON, empty values become null
+    bands = {name: {key: (None if isinstance(value, float) and np.isnan(value)
+                          else value) for key, value in values.items()}
+             for name, values in statistics.as_dict().items()}
+    document = {'input': str(input_name),
+                'parameters': get_parameter_values(result.parameters),
+                'bands': bands}
+    with open(out_file, 'w') as output_file:
+        json.dump(document, output_file, indent=2)
+
+def write_stats_file(out_file, input_name, result, statistics=None,
+                     stats_format='text'):
+    '''Writes the stats file of a model run in one of stats_formats
+    :out_file : path and file name
+    :input_name : name of the input raster
+    :result : ModelResult of the model run
+    :statistics : FluxStatistics, computed from result if None
+    :stats_format : 'text' for the .csv file of the plugin, 'csv' or 'json'
+    '''
+    if stats_format not in stats_formats:
+        raise ValueError('Unknown stats format {}, use one of {}'.format(
+                stats_format, ', '.join(stats_formats)))
+    if statistics is None:
+        statistics = get_statistics(
+                result, () if stats_format == 'text' else default_percentiles)
+    if stats_format == 'text':
+        write_output_stats(out_file, input_name, result, statistics)
+    elif stats_format == 'csv':
+        write_stats_csv(out_file, statistics)
+    else:
+        write_stats_json(out_file, input_name, result, statistics)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - streaming mode
+This module runs the DATTUTDUT model window by window, so rasters that are
+larger than the memory can be processed. Only one window of the input and
+of the six output bands is held in memory at a time. Scene-wide values
+like tmin and tmax are derived in a separate pre-pass over the raster.
+Both passes can run in a pool of workers that read the windows in
+parallel, the output is always written by the calling thread.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import concurrent.futures
+import os
+import threading
+import numpy as np
+
+from . import model, percentiles
+
+# Blocks of striped rasters are combined until a window has at least this
+# many pixels, reading row by row would be very slow
+min_window_pixels = 2**20
+# Pools that can be used to compute the windows in parallel
+executors = {
+    'thread': concurrent.futures.ThreadPoolExecutor,
+    'process': concurrent.futures.ProcessPoolExecutor,
+}
+
+# Flux buffers of every worker thread
+_worker_state = threading.local()
+
+
+def iter_windows(rows, cols, block_rows, block_cols,
+                 min_pixels=min_window_pixels):
+    '''Yields the windows (xoff, yoff, xsize, ysize) that cover a raster.
+    :rows : number of rows of the raster
+    :cols : number of columns of the raster
+    :block_rows : number of rows of one block
+    :block_cols : number of columns of one block
+    :min_pixels : blocks that span the whole width are stacked until a
+        window has at least this many pixels
+    '''
+    block_rows = max(1, min(int(block_rows), rows))
+    block_cols = max(1, min(int(block_cols), cols))
+    if block_cols == cols and block_rows * cols < min_pixels:
+        block_rows = min(rows, block_rows * max(1, min_pixels // (block_rows * cols)))
+    for yoff in range(0, rows, block_rows):
+        for xoff in range(0, cols, block_cols):
+            yield (xoff, yoff, min(block_cols, cols - xoff),
+                   min(block_rows, rows - yoff))
+
+def get_windows(band, tile_size=None):
+    '''Returns the windows of a GDAL band. The windows follow the block
+    structure of the band unless a tile size is given.
+    :band : GDAL band
+    :tile_size : None, a number of pixels or a tuple (rows, cols)
+    '''
+    if tile_size is None:
+        block_cols, block_rows = band.GetBlockSize()
+    elif np.isscalar(tile_size):
+        block_rows = block_cols = int(tile_size)
+    else:
+        block_rows, block_cols = tile_size
+    return list(iter_windows(band.YSize, band.XSize, block_rows, block_cols))
+
+def read_window(band, window, precision=model.default_precision):
+    '''Reads one window of the land surface temperatures, zeros and the
+    nodata value of the band are set to NaN
+    :band : GDAL band
+    :window : (xoff, yoff, xsize, ysize)
+    :precision : 'float32' or 'float64', the dtype of the window
+    '''
+    return model.mask_zeros(band.ReadAsArray(*window), precision,
+                            band.GetNoDataValue())
+
+def check_executor(executor):
+    '''Raises a ValueError if executor is not one of executors'''
+    if executor not in executors:
+        raise ValueError('Unknown executor {}, use one of {}'.format(
+                executor, ', '.join(sorted(executors))))
+
+def _worker_band(in_file):
+    '''Returns the first band of in_file from the handles of the current
+    worker, see raster_io.get_dataset'''
+    from . import raster_io
+
+    return raster_io.get_dataset(in_file).GetRasterBand(1)
+
+def _pool_task(task, in_file, window, args):
+    '''Runs task with the band of the current worker'''
+    return task(_worker_band(in_file), window, *args)
+
+def iter_pool(task, in_file, windows, args=(), workers=1, executor='thread'):
+    '''Yields task(band, window, *args) for all windows of in_file. With
+    more than one worker the windows are read and processed in a pool and
+    the results are yielded in the order they are finished. At most two
+    windows per worker are in flight, so the memory stays flat if the
+    caller is slower than the workers.
+    :task : module level function that takes a GDAL band and a window
+    :in_file : path and file name of the land surface temperature raster
+    :windows : list of windows as returned by get_windows
+    :args : further arguments of task
+    :workers : number of workers, None for one per CPU core
+    :executor : 'thread' or 'process'. Processes need the dattutdut package
+        to be importable by the worker processes, so they are meant for
+        scripts and batch jobs rather than for QGIS itself
+    '''
+    check_executor(executor)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        band = _worker_band(in_file)
+        for window in windows:
+            yield task(band, window, *args)
+        return
+
+    with executors[executor](max_workers=workers) as pool:
+        pending = set()
+        for window in windows:
+            if len(pending) >= 2 * workers:
+                done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(_pool_task, task, in_file, window, args))
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+def scan_window(band, window, resolution=percentiles.default_resolution,
+                precision=model.default_precision):
+    '''Reads one window and returns the HistogramPercentiles of its valid
+    values, this is the task of the pre-pass'''
+    histogram = percentiles.HistogramPercentiles(resolution)
+    histogram.update(read_window(band, window, precision))
+    return histogram
+
+def compute_window(band, window, resolved, clamp=None, reuse_buffers=False,
+                   precision=model.default_precision, bands=None):
+    '''Reads one window and computes its fluxes, this is the task of the
+    main pass. Returns the window together with the dictionary of fluxes,
+    which also holds the land surface temperatures of the window as
+    'lst'.
+    :band : GDAL band
+    :window : (xoff, yoff, xsize, ysize)
+    :resolved : ModelParameters as returned by resolve_parameters
+    :clamp : see compute_fluxes
+    :reuse_buffers : write the fluxes into the same arrays for all windows
+        of the same size. The arrays are overwritten by the next window, so
+        this is only safe if the fluxes are written before that.
+    :precision : 'float32' or 'float64', the dtype of the fluxes
+    :bands : output bands to compute, all of them if None
+    '''
+    lst = read_window(band, window, precision)
+    buffers = None
+    if reuse_buffers:
+        cache = getattr(_worker_state, 'buffers', None)
+        if cache is None:
+            cache = _worker_state.buffers = {}
+        key = (lst.shape, lst.dtype.str, bands)
+        if key not in cache:
+            names = model.required_bands(bands)
+            if 'rn' in names:
+                names += ('albedo',)
+            cache[key] = model.allocate_buffers(lst.shape, lst.dtype, names)
+        buffers = cache[key]
+    fluxes = model.compute_fluxes(lst, resolved, clamp, buffers, bands)
+    fluxes['lst'] = lst
+    return window, fluxes
+
+def scan_histogram(in_file, windows, workers=1, executor='thread',
+                   resolution=percentiles.default_resolution,
+                   precision=model.default_precision):
+    '''Returns the HistogramPercentiles of the whole raster, the histograms
+    of all windows are merged into one, so the raster is read only once.
+    :in_file : path and file name of the land surface temperature raster
+    :windows : list of windows as returned by get_windows
+    :workers : see iter_pool
+    :executor : see iter_pool
+    :resolution : bin width of the histogram [K]
+    :precision : 'float32' or 'float64', the dtype the windows are read in
+    '''
+    histogram = percentiles.HistogramPercentiles(resolution)
+    for window_histogram in iter_pool(scan_window, in_file, windows,
+                                      (resolution, precision), workers,
+                                      executor):
+        histogram.merge(window_histogram)
+    return histogram
+
+def get_scene_tmin_tmax(histogram, params):
+    '''Returns tmin and tmax, either from the model parameters or as
+    percentiles of the histogram of the scene
+    :histogram : HistogramPercentiles of the scene
+    :params : ModelParameters
+    '''
+    if histogram.offset is None:
+        raise ValueError('The raster contains no valid values')
+    tmin, tmax = params.tmin, params.tmax
+    if tmin is None or tmax is None:
+        values = histogram.percentiles([params.tmin_thres, params.tmax_thres])
+        if tmin is None:
+            tmin = values[0]
+        if tmax is None:
+            tmax = values[1]
+    return float(tmin), float(tmax)
+
+def scan_scene(in_file, windows, params, workers=1, executor='thread',
+               resolution=percentiles.default_resolution,
+               precision=model.default_precision):
+    '''Pre-pass over the whole raster, see scan_histogram. Returns tmin
+    and tmax, either from the model parameters or as percentiles of the
+    histogram, and whether the raster contains pixels without data.
+    :in_file : path and file name of the land surface temperature raster
+    :windows : list of windows as returned by get_windows
+    :params : ModelParameters
+    :workers : see iter_pool
+    :executor : see iter_pool
+    :resolution : bin width of the histogram [K]
+    :precision : 'float32' or 'float64', the dtype the windows are read in
+    '''
+    histogram = scan_histogram(in_file, windows, workers, executor,
+                               resolution, precision)
+    tmin, tmax = get_scene_tmin_tmax(histogram, params)
+    return tmin, tmax, histogram.nan_count > 0
+
+def iter_computed_windows(in_file, windows, resolved, clamp=None,
+                          workers=1, executor='thread',
+                          precision=model.default_precision, bands=None):
+    '''Yields (window, fluxes) for all windows, see iter_pool. Without a
+    pool the fluxes of all windows are written into the same buffers, so
+    they must be used before the next window is requested.
+    '''
+    reuse_buffers = workers is not None and workers <= 1
+    try:
+        for item in iter_pool(compute_window, in_file, windows,
+                              (resolved, clamp, reuse_buffers, precision,
+                               bands), workers, executor):
+            yield item
+    finally:
+        # free the buffers of this thread
+        _worker_state.buffers = {}
+
+def run_streaming(in_file, out_file, params=None, tile_size=None, workers=1,
+                  executor='thread', resolution=percentiles.default_resolution,
+                  precision=model.default_precision, options=None,
+                  bands=None, stats_file=None, stats_format='text'):
+    '''Runs the DATTUTDUT model window by window on a raster and writes the
+    output bands, see raster_io.OutputRaster. Returns the resolved model
+    parameters.
+    :in_file : path and file name of the land surface temperature raster
+    :out_file : path and file name of the output raster
+    :params : ModelParameters, the dialog defaults are used if None
+    :tile_size : None to follow the block structure of the input, a number
+        of pixels or a tuple (rows, cols)
+    :workers : number of workers that read and compute the windows in
+        parallel, None for one per CPU core. The output is always written
+        by the calling thread
+    :executor : 'thread' or 'process', see iter_pool
+    :resolution : bin width of the percentile histogram [K]
+    :precision : 'float32' or 'float64', the dtype of the computation and of
+        the output bands
+    :options : raster_io.OutputOptions of the output raster
+    :bands : output bands to compute and write, all of them if None
+    :stats_file : path and file name of a stats file, the statistics are
+        collected window by window while the fluxes are written
+    :stats_format : format of the stats file, see stats.write_stats_file
+    '''
+    # GDAL is only needed here, the window helpers above work without it
+    from . import raster_io, stats
+
+    check_executor(executor)
+    model.get_dtype(precision)
+    bands = model.get_bands(bands)
+    if stats_format not in stats.stats_formats:
+        raise ValueError('Unknown stats format {}, use one of {}'.format(
+                stats_format, ', '.join(stats.stats_formats)))
+    if params is None:
+        params = model.ModelParameters()
+    in_raster = raster_io.get_dataset(in_file)
+    band = in_raster.GetRasterBand(1)
+    geo = in_raster.GetGeoTransform()
+    prj = in_raster.GetProjection()
+    lon, lat = raster_io.get_lon_lat(geo)
+    windows = get_windows(band, tile_size)
+
+    # pre-pass for the scene-wide values
+    tmin, tmax = scan_scene(in_file, windows, params, workers, executor,
+                            resolution, precision)[:2]
+    resolved = model.resolve_parameters(
+            None, params.copy(tmin=tmin, tmax=tmax), lon, lat)
+
+    out_raster = raster_io.OutputRaster(
+            out_file, band.YSize, band.XSize, geo, prj, bands,
+            precision=precision, options=options)
+    statistics = None
+    if stats_file is not None:
+        statistics = stats.FluxStatistics(percentiles=(
+                () if stats_format == 'text' else stats.default_percentiles))
+    # an error or a cancel in a window deletes the unfinished files, so
+    # they can not be taken for a result
+    try:
+        for window, fluxes in iter_computed_windows(
+                in_file, windows, resolved, None, workers, executor,
+                precision, bands):
+            out_raster.write(fluxes, window[0], window[1])
+            if statistics is not None:
+                statistics.update(fluxes)
+        out_raster.close()
+    except BaseException:
+        out_raster.discard()
+        raise
+    if statistics is not None:
+        stats.write_stats_file(stats_file, in_file,
+                               model.ModelResult(resolved, None, {}),
+                               statistics, stats_format)
+    return resolved
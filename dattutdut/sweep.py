@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - parameter sweeps
+This module runs the DATTUTDUT model for many sets of parameters over the
+same land surface temperatures, e.g. a grid of surface emissivities or
+Monte Carlo samples for an uncertainty analysis. The scenarios are
+computed together: the parameters get a scenario axis that broadcasts
+against the valid pixels, which are processed in blocks. Only the
+statistics of every scenario are kept unless the fluxes are asked for.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import csv
+import itertools
+import numpy as np
+
+from . import model, stats
+from .percentiles import get_percentiles
+
+# Resolved parameters the fluxes are computed from, they get the scenario
+# axis
+flux_parameters = ('tmin', 'tmax', 'surf_emis', 'atm_emis', 'air_temp',
+                   'time_period', 'sw_irr', 'g_percentage', 'rn')
+# Maximum number of values of one block of all scenarios and pixels, the
+# buffers of a block stay in the CPU cache
+default_max_elements = 2**18
+
+
+def parameter_grid(**values):
+    '''Returns one scenario (dictionary of model parameters) for every
+    combination of the given values, the last parameter changes fastest
+    :values : lists of values per name of ModelParameters, e.g.
+        surf_emis=[0.95, 0.98, 1.0]
+    '''
+    names = list(values)
+    return [dict(zip(names, combination))
+            for combination in itertools.product(*values.values())]
+
+def monte_carlo_samples(n, seed=None, **distributions):
+    '''Returns n scenarios with random model parameters
+    :n : number of scenarios
+    :seed : seed of the random numbers
+    :distributions : per name of ModelParameters either (low, high) for a
+        uniform distribution or a function that takes a
+        numpy.random.Generator and n and returns n values, e.g.
+        lambda rng, n: rng.normal(0.98, 0.01, n)
+    '''
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for name, distribution in distributions.items():
+        if callable(distribution):
+            samples[name] = np.asarray(distribution(rng, n), dtype=np.float64)
+        else:
+            low, high = distribution
+            samples[name] = rng.uniform(low, high, n)
+    return [{name: float(values[i]) for name, values in samples.items()}
+            for i in range(n)]
+
+def resolve_scenarios(lst, scenarios, params=None, lon=None, lat=None,
+                      percentile_method='exact', valid=None):
+    '''Returns the resolved ModelParameters of every scenario. The
+    percentiles of all tmin and tmax thresholds are computed together.
+    :lst : land surface temperatures [K], zeros already set to NaN
+    :scenarios : list of dictionaries with the parameters that differ
+        from params
+    :params : ModelParameters shared by all scenarios, the dialog defaults
+        if None
+    :valid : validity mask of lst, see model.get_valid_mask
+    '''
+    if params is None:
+        params = model.ModelParameters()
+    for scenario in scenarios:
+        unknown = [name for name in scenario
+                   if name not in model.ModelParameters.names]
+        if unknown:
+            raise ValueError('Unknown model parameters {}'.format(
+                    ', '.join(unknown)))
+    scenario_params = [params.copy(**scenario) for scenario in scenarios]
+    thresholds = sorted(
+            {float(threshold) for scenario in scenario_params
+             for value, threshold in ((scenario.tmin, scenario.tmin_thres),
+                                      (scenario.tmax, scenario.tmax_thres))
+             if value is None})
+    values = {}
+    if thresholds:
+        values = dict(zip(thresholds, get_percentiles(
+                lst, thresholds, percentile_method, valid=valid)))
+    resolved = []
+    for scenario in scenario_params:
+        tmin = scenario.tmin
+        if tmin is None:
+            tmin = values[float(scenario.tmin_thres)]
+        tmax = scenario.tmax
+        if tmax is None:
+            tmax = values[float(scenario.tmax_thres)]
+        resolved.append(model.resolve_parameters(
+                lst, scenario.copy(tmin=tmin, tmax=tmax), lon, lat,
+                percentile_method))
+    return resolved
+
+def stack_parameters(resolved):
+    '''Returns ModelParameters whose flux parameters are column arrays with
+    one row per scenario, so they broadcast against a row of pixels.
+    g_percentage and rn have to be given for all scenarios or for none.
+    :resolved : list of resolved ModelParameters
+    '''
+    stacked = resolved[0].copy()
+    for name in flux_parameters:
+        values = [getattr(params, name) for params in resolved]
+        given = [value is not None for value in values]
+        if not any(given):
+            continue
+        if not all(given):
+            raise ValueError('{} must be given for all scenarios or for '
+                             'none'.format(name))
+        if any(np.ndim(value) > 0 for value in values):
+            raise ValueError('{} must be one value per scenario'.format(name))
+        setattr(stacked, name,
+                np.array(values, dtype=np.float64)[:, np.newaxis])
+    return stacked
+
+
+class SweepResult:
+    '''Holds the output of a sweep: the scenarios, their resolved model
+    parameters, the FluxStatistics of every scenario and, if asked for, the
+    fluxes as arrays of shape (scenarios, rows, cols).
+    '''
+
+    def __init__(self, scenarios, parameters, statistics, fluxes=None):
+        self.scenarios = scenarios
+        self.parameters = parameters
+        self.statistics = statistics
+        self.fluxes = fluxes
+
+    def __len__(self):
+        return len(self.scenarios)
+
+    def get_summary(self, band, statistic='mean'):
+        '''Returns one statistic of a band for every scenario as array
+        :band : name of the band, e.g. 'le'
+        :statistic : key of BandStatistics.as_dict, e.g. 'std' or 'p95'
+        '''
+        return np.array([statistics.as_dict()[band][statistic]
+                         for statistics in self.statistics], dtype=np.float64)
+
+    def get_sensitivity(self, name, band, statistic='mean'):
+        '''Returns the slope of a statistic of a band over a parameter from
+        a least squares line through all scenarios, e.g. the change of the
+        mean le per unit of surf_emis
+        :name : name of the model parameter
+        :band : name of the band
+        :statistic : see get_summary
+        '''
+        values = np.array([float(getattr(params, name))
+                           for params in self.parameters])
+        summary = self.get_summary(band, statistic)
+        if np.ptp(values) == 0:
+            return np.nan
+        return float(np.polyfit(values, summary, 1)[0])
+
+
+def update_statistics(statistics, name, block, scratch):
+    '''Adds the rows of a block to the statistics of their scenarios. The
+    moments of all rows are reduced along the pixel axis together, rows
+    with NaN values are added one by one.
+    :statistics : FluxStatistics of the scenarios of the block
+    :name : name of the band
+    :block : array of shape (scenarios, pixels)
+    :scratch : array with the shape of block
+    '''
+    count = block.shape[1]
+    means = np.add.reduce(block, axis=1, dtype=np.float64) / count
+    # NaN values make the mean of their row NaN
+    has_nan = np.isnan(means)
+    np.subtract(block, means[:, np.newaxis], out=scratch)
+    np.square(scratch, out=scratch)
+    m2s = np.add.reduce(scratch, axis=1, dtype=np.float64)
+    minima = block.min(axis=1)
+    maxima = block.max(axis=1)
+    for i, scenario_stats in enumerate(statistics):
+        band_stats = scenario_stats[name]
+        if has_nan[i]:
+            band_stats.update(block[i], scratch=scratch[i])
+            continue
+        band_stats.add_moments(count, float(means[i]), float(m2s[i]),
+                               float(minima[i]), float(maxima[i]))
+        if band_stats.histogram is not None:
+            band_stats.histogram.update(block[i])
+
+def run_sweep(lst, scenarios, params=None, lon=None, lat=None,
+              percentile_method='exact', precision=None, bands=None,
+              percentiles=stats.default_percentiles, keep_fluxes=False,
+              max_elements=default_max_elements):
+    '''Runs the model for every scenario and returns a SweepResult. The
+    valid pixels are copied once and all scenarios are computed in blocks
+    of at most max_elements values with model.compute_fluxes, clamped as
+    in run_model. The values are those of run_model for float64, for
+    float32 they can differ by a rounding step because the parameters of
+    the scenarios are float64 arrays.
+    :lst : land surface temperatures [K], zeros already set to NaN
+    :scenarios : list of dictionaries with the parameters that differ from
+        params, see parameter_grid and monte_carlo_samples
+    :params : ModelParameters shared by all scenarios
+    :lon : longitude of the raster [dec]
+    :lat : latitude of the raster [dec]
+    :percentile_method : 'exact' or 'histogram', see model.get_tmin_tmax
+    :precision : 'float32' or 'float64' to convert lst before the run
+    :bands : output bands to compute, all of them if None
+    :percentiles : percentiles of the statistics, see FluxStatistics
+    :keep_fluxes : also return the fluxes of all scenarios, this needs
+        scenarios times the memory of one run
+    :max_elements : size of the blocks, scenarios * pixels
+    '''
+    if not scenarios:
+        raise ValueError('No scenarios given')
+    if precision is not None:
+        lst = lst.astype(model.get_dtype(precision), copy=False)
+    bands = model.get_bands(bands)
+    valid = model.get_valid_mask(lst)
+    resolved = resolve_scenarios(lst, scenarios, params, lon, lat,
+                                 percentile_method, valid)
+    pixels = np.flatnonzero(valid.ravel())
+    values = lst.ravel()[pixels]
+    invalid = lst.size - pixels.size
+
+    names = list(bands)
+    if 'rn' in model.required_bands(bands):
+        names.append('albedo')
+    statistics = [stats.FluxStatistics(names, percentiles)
+                  for scenario in scenarios]
+    fluxes = None
+    if keep_fluxes:
+        fluxes = {name: np.full((len(scenarios), lst.size), np.nan,
+                                dtype=lst.dtype) for name in names}
+
+    # scenarios and pixels per block
+    n_scenarios = max(1, min(len(scenarios), max_elements // 1024))
+    n_pixels = max(1, min(pixels.size, max_elements // n_scenarios))
+    buffers = model.allocate_buffers(
+            (n_scenarios, n_pixels), lst.dtype,
+            model.required_bands(bands) + ('albedo',))
+    scratch = np.empty((n_scenarios, n_pixels), dtype=lst.dtype)
+    for first in range(0, len(scenarios), n_scenarios):
+        last = min(first + n_scenarios, len(scenarios))
+        stacked = stack_parameters(resolved[first:last])
+        for start in range(0, pixels.size, n_pixels):
+            stop = min(start + n_pixels, pixels.size)
+            shape = (last - first, stop - start)
+            # the pixels broadcast against the scenario axis without a copy
+            block = np.broadcast_to(values[start:stop], shape)
+            out = {name: array[:shape[0], :shape[1]]
+                   for name, array in buffers.items()}
+            block_fluxes = model.compute_fluxes(block, stacked, True, out,
+                                                bands)
+            for name in names:
+                update_statistics(statistics[first:last], name,
+                                  block_fluxes[name], scratch[:shape[0],
+                                                              :shape[1]])
+            if fluxes is not None:
+                for name in names:
+                    fluxes[name][first:last, pixels[start:stop]] = \
+                        block_fluxes[name]
+    for scenario_stats in statistics:
+        for name in names:
+            scenario_stats[name].nan_count += invalid
+    if fluxes is not None:
+        fluxes = {name: array.reshape((len(scenarios),) + lst.shape)
+                  for name, array in fluxes.items()}
+    return SweepResult(scenarios, resolved, statistics, fluxes)
+
+def write_sweep_csv(out_file, result, statistics=('mean', 'std', 'min', 'max')):
+    '''Writes one row per scenario with its parameters and the statistics
+    of every band
+    :out_file : path and file name of the .csv file
+    :result : SweepResult
+    :statistics : keys of BandStatistics.as_dict to write
+    '''
+    names = []
+    for scenario in result.scenarios:
+        names.extend(name for name in scenario if name not in names)
+    bands = list(result.statistics[0].bands)
+    with open(out_file, 'w', newline='') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(['scenario'] + names + [
+                '{}_{}'.format(band, statistic) for band in bands
+                for statistic in statistics])
+        for index, (scenario, scenario_stats) in enumerate(
+                zip(result.scenarios, result.statistics)):
+            values = scenario_stats.as_dict()
+            writer.writerow([index] + [scenario.get(name, '') for name in names] +
+                            [values[band][statistic] for band in bands
+                             for statistic in statistics])
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - temporal upscaling
+This module integrates the latent heat flux of a series of frames of the
+same field, e.g. the hourly frames of Data_Examples, into the
+evapotranspiration [mm] of the whole period or day. The frames are put
+onto the grid of the first one and computed one after the other; only the
+running sums and the last frame are kept, so the memory does not grow
+with the number of frames.
+
+Two upscaling methods are available:
+trapezoid: the water equivalent of le is integrated over time with the
+    trapezoidal rule, optionally from 0 at the start of the period (e.g.
+    sunrise) and to 0 at its end (e.g. sunset).
+ef: the evaporative fraction is taken as constant over the day (Crago
+    1996). The mean ef of the frames is multiplied with the available
+    energy of the period, which is either given (e.g. the daily net
+    radiation of a weather station) or integrated from rn - g of the
+    frames like le.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import numpy as np
+
+from . import model
+from .mosaic import check_north_up, get_source_indices
+
+# Upscaling methods
+methods = ('trapezoid', 'ef')
+# Bands of the output raster, in this order
+temporal_bands = ('et', 'ef', 'hours', 'frames')
+
+
+def get_latent_heat(air_temp):
+    '''Returns the latent heat of vaporization [MJ/kg] at the air
+    temperature [K], as in model.get_water'''
+    return 2.501-0.002361*(model.get_value(air_temp)-273.15)
+
+def regrid(lst, geo, ref_geo, ref_shape):
+    '''Returns lst on the grid of a reference frame, nearest neighbour.
+    Pixels of the reference grid outside of lst are NaN. Both grids must be
+    north up and in the same coordinate system, see mosaic.get_source_indices.
+    :lst : land surface temperatures [K]
+    :geo : GDAL geotransform of lst
+    :ref_geo : GDAL geotransform of the reference grid
+    :ref_shape : (rows, cols) of the reference grid
+    '''
+    if tuple(geo) == tuple(ref_geo) and lst.shape == tuple(ref_shape):
+        return lst
+    check_north_up(geo)
+    check_north_up(ref_geo)
+    rows, cols = ref_shape
+    src_rows, src_cols = get_source_indices(geo, lst.shape, ref_geo,
+                                            (0, 0, cols, rows))
+    in_cols = src_cols >= 0
+    in_rows = src_rows >= 0
+    out = np.full((rows, cols), np.nan, dtype=lst.dtype)
+    out[np.ix_(in_rows, in_cols)] = lst[np.ix_(src_rows[in_rows],
+                                               src_cols[in_cols])]
+    return out
+
+
+class TemporalResult:
+    '''Output of a temporal upscaling: the arrays of temporal_bands and the
+    time span they cover.
+    et : evapotranspiration of the period [mm]
+    ef : mean evaporative fraction of the frames [-]
+    hours : hours of the period that were integrated per pixel
+    frames : number of frames with data per pixel
+    '''
+
+    def __init__(self, arrays, start, end, method):
+        self.arrays = arrays
+        self.start = start
+        self.end = end
+        self.method = method
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+
+class TemporalAccumulator:
+    '''Running sums of the temporal upscaling. Frames are added in time
+    order with add, finish returns the TemporalResult. Besides the sums
+    only the water equivalents of the last frame are kept.
+    '''
+
+    def __init__(self, shape, method='trapezoid', start=None, end=None,
+                 available_energy=None):
+        '''Constructor.
+        :param shape: (rows, cols) of the common grid
+        :param method: one of methods
+        :param start: utc at which le is 0, e.g. sunrise, None to start
+            with the first frame
+        :param end: utc at which le is 0 again, e.g. sunset, None to end
+            with the last frame
+        :param available_energy: available energy of the period [MJ/m²],
+            a number or an array of shape, for the ef method. If None it
+            is integrated from rn - g of the frames.
+        '''
+        if method not in methods:
+            raise ValueError('Unknown upscaling method {}, use one of '
+                             '{}'.format(method, ', '.join(methods)))
+        self.shape = tuple(shape)
+        self.method = method
+        self.start = None if start is None else model.parse_utc(start)
+        self.end = None if end is None else model.parse_utc(end)
+        self.available_energy = available_energy
+        self.integrate_energy = method == 'ef' and available_energy is None
+        # integrated water equivalent of le (trapezoid) or rn - g (ef) [mm]
+        self.total = np.zeros(self.shape)
+        self.seconds = np.zeros(self.shape)
+        self.ef_sum = np.zeros(self.shape)
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.latent_heat_sum = 0.0
+        self.frames_added = 0
+        self.first_utc = None
+        self.last_utc = None
+        self.last_rate = None
+        self.last_valid = None
+        self._scratch = np.empty(self.shape)
+
+    def get_rate(self, result):
+        '''Returns the water equivalent per second [mm/s] of a frame that
+        is integrated: le, or rn - g for the ef method'''
+        rate = np.empty(self.shape)
+        if self.method == 'ef':
+            np.subtract(result['rn'], result['g'], out=rate)
+            model.fill_water(rate, 1.0, result.parameters.air_temp, rate)
+        else:
+            model.fill_water(result['le'], 1.0, result.parameters.air_temp,
+                             rate)
+        return rate
+
+    def integrate(self, seconds, rate, valid):
+        '''Adds the trapezoid between the last frame and a frame with the
+        given rate and validity mask, seconds after it'''
+        if seconds <= 0:
+            raise ValueError('The frames must be added in time order')
+        both = self.last_valid & valid
+        np.add(self.last_rate, rate, out=self._scratch)
+        np.multiply(self._scratch, seconds / 2, out=self._scratch)
+        np.add(self.total, self._scratch, out=self.total, where=both)
+        np.add(self.seconds, seconds, out=self.seconds, where=both)
+
+    def add(self, utc, result):
+        '''Adds one frame
+        :utc : time of the frame
+        :result : ModelResult of the frame on the common grid with le and ef,
+            and rn and g for the ef method
+        '''
+        utc = model.parse_utc(utc)
+        if (self.start is not None and utc < self.start or
+                self.end is not None and utc > self.end):
+            raise ValueError('The frame at {} is outside of the period'.format(
+                    model.format_utc(utc)))
+        if result['ef'].shape != self.shape:
+            raise ValueError('The frame has the size {} but the grid {}'.format(
+                    result['ef'].shape, self.shape))
+        valid = result.valid
+        self.ef_sum += np.where(valid, result['ef'], 0.0)
+        self.count += valid
+        self.latent_heat_sum += float(np.mean(get_latent_heat(
+                result.parameters.air_temp)))
+        self.frames_added += 1
+        if self.method == 'trapezoid' or self.integrate_energy:
+            rate = self.get_rate(result)
+            if self.last_utc is None and self.start is not None:
+                # le rises from 0 at the start of the period
+                self.last_rate = np.zeros(self.shape)
+                self.last_valid = np.ones(self.shape, dtype=bool)
+                self.last_utc = self.start
+            if self.last_utc is not None:
+                self.integrate((utc - self.last_utc).total_seconds(), rate,
+                               valid)
+            self.last_rate = rate
+            self.last_valid = valid
+        elif self.last_utc is not None and utc <= self.last_utc:
+            raise ValueError('The frames must be added in time order')
+        if self.first_utc is None:
+            self.first_utc = utc
+        self.last_utc = utc
+
+    def finish(self):
+        '''Returns the TemporalResult of the frames added so far'''
+        if self.first_utc is None:
+            raise ValueError('No frames were added')
+        if self.last_rate is not None and self.end is not None:
+            # le falls to 0 at the end of the period
+            self.integrate((self.end - self.last_utc).total_seconds(),
+                           np.zeros(self.shape), self.last_valid)
+            self.last_utc = self.end
+            self.last_rate = None
+        frames = self.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ef = np.where(frames > 0, self.ef_sum / frames, np.nan)
+        if self.method == 'trapezoid':
+            et = self.total.copy()
+        elif self.integrate_energy:
+            et = ef * self.total
+        else:
+            # the given available energy as water at the mean latent heat
+            latent_heat = self.latent_heat_sum / self.frames_added
+            et = ef * (np.asarray(self.available_energy, dtype=np.float64) /
+                       latent_heat)
+        if self.method == 'trapezoid' or self.integrate_energy:
+            hours = self.seconds / 3600
+        else:
+            period = (self.end or self.last_utc) - (self.start or
+                                                   self.first_utc)
+            hours = np.where(frames > 0, period.total_seconds() / 3600, 0.0)
+        # pixels that were never integrated have no value
+        et = np.where((hours > 0) & (frames > 0), et, np.nan)
+        return TemporalResult({'et': et, 'ef': ef, 'hours': hours,
+                               'frames': frames.astype(np.float64)},
+                              self.start or self.first_utc,
+                              self.end or self.last_utc, self.method)
+
+
+def write_temporal_raster(out_file, result, geo, prj,
+                          precision=model.default_precision, options=None):
+    '''Writes the bands of a TemporalResult into one GeoTIFF in the order of
+    temporal_bands
+    :out_file : path and file name
+    :result : TemporalResult
+    :geo : GDAL geotransform of the common grid
+    :prj : projection as wkt
+    :precision : 'float32' or 'float64', the data type of the bands
+    :options : raster_io.OutputOptions, the defaults are used if None
+    '''
+    from . import raster_io
+
+    if options is None:
+        options = raster_io.OutputOptions()
+    rows, cols = result['et'].shape
+    out_raster = raster_io.create_output_raster(
+            out_file, rows, cols, geo, prj, len(temporal_bands), None,
+            precision, options)
+    dtype = model.get_dtype(precision)
+    for band_number, band_name in enumerate(temporal_bands, 1):
+        band = out_raster.GetRasterBand(band_number)
+        band.SetDescription(band_name)
+        band.WriteArray(raster_io.fill_nodata(
+                result[band_name].astype(dtype), options.nodata))
+    out_raster.FlushCache()
+    del band, out_raster
+    raster_io.finish_output_raster(out_file, options)
+    return out_file
+
+def run_temporal(frames, utcs, params=None, out_file=None, method='trapezoid',
+                 start=None, end=None, available_energy=None,
+                 precision=model.default_precision, options=None,
+                 callback=None):
+    '''Runs the DATTUTDUT model on every frame and integrates the frames to
+    the evapotranspiration of the period, see TemporalAccumulator. One
+    frame is held in memory at a time. Returns the TemporalResult.
+    :frames : list of land surface temperature rasters in time order
+    :utcs : list with one utc per frame, see batch.get_frame_times
+    :params : ModelParameters shared by all frames, the utc is replaced
+    :out_file : GeoTIFF for the bands of temporal_bands, not written if None
+    :method : one of methods
+    :start : utc at which le is 0, e.g. sunrise
+    :end : utc at which le is 0 again, e.g. sunset
+    :available_energy : available energy of the period [MJ/m²] for the ef
+        method
+    :precision : 'float32' or 'float64', the dtype of the computation and of
+        the output bands
+    :options : raster_io.OutputOptions of the output raster
+    :callback : function called with (index, frame, resolved) after each
+        frame
+    '''
+    from . import raster_io
+
+    if len(utcs) != len(frames):
+        raise ValueError('{} utc times given for {} frames'.format(
+                len(utcs), len(frames)))
+    if not frames:
+        raise ValueError('No frames given')
+    if params is None:
+        params = model.ModelParameters()
+    model.get_dtype(precision)
+    bands = ('le', 'ef', 'rn', 'g') if method == 'ef' else ('le', 'ef')
+    accumulator = None
+    for index, (frame, utc) in enumerate(zip(frames, utcs)):
+        # the frames are read only once, they are not kept in the cache
+        lst, prj, geo = raster_io.read_lst_img(frame, precision,
+                                               use_cache=False)
+        lon, lat = raster_io.get_lon_lat(geo)
+        if accumulator is None:
+            ref_geo, ref_prj, ref_shape = geo, prj, lst.shape
+            accumulator = TemporalAccumulator(ref_shape, method, start, end,
+                                              available_energy)
+        elif prj and ref_prj and prj != ref_prj:
+            raise ValueError('{} is not in the coordinate system of {}, '
+                             'reproject it first'.format(frame, frames[0]))
+        lst = regrid(lst, geo, ref_geo, ref_shape)
+        result = model.run_model(lst, params.copy(utc=utc), lon, lat,
+                                 bands=bands)
+        accumulator.add(utc, result)
+        if callback is not None:
+            callback(index, frame, result.parameters)
+        # free the arrays of this frame before the next one is read
+        del lst, result
+    temporal_result = accumulator.finish()
+    if out_file is not None:
+        write_temporal_raster(out_file, temporal_result, ref_geo, ref_prj,
+                              precision, options)
+    return temporal_result
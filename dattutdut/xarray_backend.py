@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - xarray backend
+This module runs the DATTUTDUT model on an xarray DataArray of land
+surface temperatures, e.g. from a zarr store, instead of a GeoTIFF:
+
+    lst = open_lst('archive.zarr', 'lst', chunks={'y': 2048, 'x': 2048})
+    fluxes = run_model_dataset(lst, ModelParameters(utc='...'))
+    write_dataset(fluxes, 'fluxes.zarr')
+
+With a dask-chunked DataArray the fluxes are a lazy Dataset of the six
+output bands: every chunk is computed with model.compute_fluxes, the same
+equations as get_rn, get_g, get_h_le and get_water, when the Dataset is
+computed or written, so large archives are computed chunk by chunk by the
+dask scheduler. Only tmin and tmax need a pre-pass over all chunks (a
+merged histogram as in the streaming mode) if they are not given.
+Needs xarray and dask, rioxarray is used for the CRS and transform if it
+is installed.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import os
+import numpy as np
+
+from . import model, percentiles, streaming
+
+# Units of the output variables
+units = {'rn': 'W m-2', 'le': 'W m-2', 'h': 'W m-2', 'g': 'W m-2',
+         'ef': '1', 'water': 'mm'}
+# Long names of the output variables
+long_names = {'rn': 'net radiation', 'le': 'latent heat flux',
+              'h': 'sensible heat flux', 'g': 'ground heat flux',
+              'ef': 'evaporative fraction',
+              'water': 'evapotranspirated water in the time period'}
+# Formats of write_dataset and their extensions
+dataset_formats = {'zarr': ('.zarr',), 'netcdf': ('.nc', '.nc4', '.netcdf')}
+
+
+def import_xarray():
+    '''Returns the xarray module and raises an ImportError that tells what
+    to install if xarray or dask are missing'''
+    try:
+        import dask  # noqa: F401
+        import xarray
+    except ImportError as error:
+        raise ImportError('The xarray backend needs xarray and dask, install '
+                          'them with pip install xarray dask: {}'.format(error))
+    return xarray
+
+def get_spatial_dims(lst):
+    '''Returns the names of the row and column dimensions of a DataArray,
+    its last two dimensions'''
+    if lst.ndim != 2:
+        raise ValueError('The land surface temperatures must have two '
+                         'dimensions (rows, columns), not {}; select one '
+                         'time step'.format(', '.join(lst.dims)))
+    return lst.dims
+
+def get_geo_transform(lst):
+    '''Returns the GDAL geotransform of a DataArray: from rioxarray, from
+    the transform attribute (affine order, as rasterio), from the
+    GeoTransform of its spatial_ref coordinate or from the coordinates of
+    the pixel centres'''
+    rio = getattr(lst, 'rio', None) if _has_rioxarray() else None
+    if rio is not None and rio.crs is not None:
+        return tuple(rio.transform().to_gdal())
+    transform = lst.attrs.get('transform')
+    if transform is not None and len(transform) >= 6:
+        a, b, c, d, e, f = [float(value) for value in transform[:6]]
+        return (c, a, b, f, d, e)
+    if 'spatial_ref' in lst.coords:
+        geo_transform = lst.coords['spatial_ref'].attrs.get('GeoTransform')
+        if geo_transform:
+            return tuple(float(value) for value in geo_transform.split())
+    row_dim, col_dim = get_spatial_dims(lst)
+    if row_dim not in lst.coords or col_dim not in lst.coords:
+        raise ValueError('The DataArray has neither a transform nor '
+                         'coordinates of {} and {}'.format(row_dim, col_dim))
+    x = np.asarray(lst.coords[col_dim], dtype=np.float64)
+    y = np.asarray(lst.coords[row_dim], dtype=np.float64)
+    if x.size < 2 or y.size < 2:
+        raise ValueError('The geotransform of a DataArray with one row or '
+                         'column can not be derived from its coordinates')
+    size_x = (x[-1] - x[0]) / (x.size - 1)
+    size_y = (y[-1] - y[0]) / (y.size - 1)
+    return (x[0] - size_x / 2, size_x, 0.0, y[0] - size_y / 2, 0.0, size_y)
+
+def get_crs_wkt(lst):
+    '''Returns the CRS of a DataArray as wkt, '' if it has none'''
+    if _has_rioxarray() and lst.rio.crs is not None:
+        return lst.rio.crs.to_wkt()
+    if 'spatial_ref' in lst.coords:
+        spatial_ref = lst.coords['spatial_ref'].attrs
+        return spatial_ref.get('crs_wkt', spatial_ref.get('spatial_ref', ''))
+    return str(lst.attrs.get('crs', ''))
+
+def get_nodata(lst):
+    '''Returns the nodata value of a DataArray or None'''
+    if _has_rioxarray() and lst.rio.nodata is not None:
+        return float(lst.rio.nodata)
+    for name in ('nodata', '_FillValue', 'missing_value'):
+        value = lst.attrs.get(name, lst.encoding.get(name))
+        if value is not None:
+            return float(value)
+    return None
+
+def _has_rioxarray():
+    '''Returns True if rioxarray is installed, it adds the rio accessor'''
+    try:
+        import rioxarray  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _copy_block(block, precision):
+    '''Returns a copy of a chunk in the dtype of the precision, mask_zeros
+    would otherwise write NaN into the data of an in-memory DataArray'''
+    return np.array(block, dtype=model.get_dtype(precision))
+
+def _scan_block(block, nodata, resolution, precision):
+    '''Returns the HistogramPercentiles of the valid values of one chunk'''
+    histogram = percentiles.HistogramPercentiles(resolution)
+    histogram.update(model.mask_zeros(_copy_block(block, precision),
+                                      precision, nodata))
+    return histogram
+
+def _compute_block(block, resolved, bands, nodata, precision):
+    '''Computes the fluxes of one chunk, returns one array per band'''
+    lst = model.mask_zeros(_copy_block(block, precision), precision, nodata)
+    fluxes = model.compute_fluxes(lst, resolved, bands=bands)
+    if len(bands) == 1:
+        return fluxes[bands[0]]
+    return tuple(fluxes[flux_name] for flux_name in bands)
+
+def scan_dataarray(lst, params, resolution=percentiles.default_resolution,
+                   precision=model.default_precision):
+    '''Pre-pass over all chunks of a DataArray, returns tmin and tmax,
+    either from the model parameters or as percentiles of one merged
+    histogram, see streaming.scan_scene. The chunks are scanned in
+    parallel by the dask scheduler.
+    :lst : DataArray of land surface temperatures [K]
+    :params : ModelParameters
+    :resolution : bin width of the histogram [K]
+    :precision : 'float32' or 'float64', the dtype the chunks are read in
+    '''
+    import dask
+
+    if params.tmin is not None and params.tmax is not None:
+        return float(params.tmin), float(params.tmax)
+    nodata = get_nodata(lst)
+    data = lst.data
+    if hasattr(data, 'to_delayed'):
+        blocks = list(data.to_delayed().ravel())
+    else:
+        blocks = [data]
+    histograms = dask.compute(*[
+            dask.delayed(_scan_block)(block, nodata, resolution, precision)
+            for block in blocks])
+    histogram = percentiles.HistogramPercentiles(resolution)
+    for block_histogram in histograms:
+        histogram.merge(block_histogram)
+    return streaming.get_scene_tmin_tmax(histogram, params)
+
+def run_model_dataset(lst, params=None, lon=None, lat=None, bands=None,
+                      precision=model.default_precision,
+                      resolution=percentiles.default_resolution):
+    '''Runs the DATTUTDUT model on a DataArray and returns an xarray Dataset
+    with one variable per output band, on the coordinates of lst. For a
+    dask-chunked lst the variables are lazy dask arrays with the chunks of
+    lst, nothing is computed until they are computed or written.
+    :lst : DataArray of land surface temperatures [K] with two dimensions
+        (rows, columns), zeros and the nodata value are not valid
+    :params : ModelParameters, the dialog defaults are used if None. If
+        tmin or tmax are None they are taken from the percentiles of all
+        chunks in a pre-pass, see scan_dataarray.
+    :lon : longitude of the sun angle, the upper left corner of lst (from
+        its transform) if None, like the plugin
+    :lat : latitude of the sun angle, see lon
+    :bands : output bands to compute, all of them if None
+    :precision : 'float32' or 'float64', the dtype of the fluxes
+    :resolution : bin width of the percentile histogram [K]
+    '''
+    xarray = import_xarray()
+
+    get_spatial_dims(lst)
+    bands = model.get_bands(bands)
+    dtype = model.get_dtype(precision)
+    if params is None:
+        params = model.ModelParameters()
+    geo = get_geo_transform(lst)
+    if lon is None or lat is None:
+        corner_lon, corner_lat = float(geo[0]), float(geo[3])
+        lon = corner_lon if lon is None else lon
+        lat = corner_lat if lat is None else lat
+    tmin, tmax = scan_dataarray(lst, params, resolution, precision)
+    resolved = model.resolve_parameters(
+            None, params.copy(tmin=tmin, tmax=tmax), lon, lat)
+    outputs = xarray.apply_ufunc(
+            _compute_block, lst,
+            kwargs={'resolved': resolved, 'bands': bands,
+                    'nodata': get_nodata(lst), 'precision': precision},
+            output_core_dims=[[] for flux_name in bands],
+            dask='parallelized', output_dtypes=[dtype] * len(bands),
+            keep_attrs=False)
+    if len(bands) == 1:
+        outputs = (outputs,)
+    variables = {}
+    for flux_name, output in zip(bands, outputs):
+        output.attrs = {'units': units[flux_name],
+                        'long_name': long_names[flux_name]}
+        variables[flux_name] = output
+    dataset = xarray.Dataset(variables)
+    # the parameters of the run, None can not be stored in zarr or NetCDF
+    dataset.attrs = {'dattutdut_' + name: (model.format_utc(value)
+                                           if name == 'utc' else float(value))
+                     for name, value in resolved.as_dict().items()
+                     if value is not None}
+    dataset.attrs['transform'] = [geo[1], geo[2], geo[0], geo[4], geo[5],
+                                  geo[3]]
+    crs = get_crs_wkt(lst)
+    if crs:
+        dataset.attrs['crs'] = crs
+    if 'spatial_ref' in lst.coords:
+        dataset = dataset.assign_coords(spatial_ref=lst.coords['spatial_ref'])
+    return dataset
+
+def get_dataset_format(out_file, dataset_format=None):
+    '''Returns the format of write_dataset for a file, from its extension if
+    dataset_format is None'''
+    if dataset_format is not None:
+        if dataset_format not in dataset_formats:
+            raise ValueError('Unknown dataset format {}, use one of {}'.format(
+                    dataset_format, ', '.join(sorted(dataset_formats))))
+        return dataset_format
+    extension = os.path.splitext(out_file.rstrip('/'))[1].lower()
+    for name, extensions in dataset_formats.items():
+        if extension in extensions:
+            return name
+    raise ValueError('Can not tell the format of {}, use .zarr or .nc or '
+                     'give the format'.format(out_file))
+
+def write_dataset(dataset, out_file, dataset_format=None, scheduler=None,
+                  num_workers=None):
+    '''Computes a Dataset of run_model_dataset chunk by chunk and writes it
+    to a zarr store or a NetCDF file
+    :dataset : Dataset of run_model_dataset
+    :out_file : path of the zarr store or the NetCDF file, an existing
+        store is overwritten
+    :dataset_format : 'zarr' or 'netcdf', from the extension if None
+    :scheduler : dask scheduler, e.g. 'threads', 'processes' or
+        'synchronous', the active one if None
+    :num_workers : number of workers of the local scheduler
+    '''
+    import dask
+
+    dataset_format = get_dataset_format(out_file, dataset_format)
+    config = {}
+    if scheduler is not None:
+        config['scheduler'] = scheduler
+    if num_workers is not None:
+        config['num_workers'] = num_workers
+    with dask.config.set(**config):
+        if dataset_format == 'zarr':
+            dataset.to_zarr(out_file, mode='w')
+        else:
+            dataset.to_netcdf(out_file)
+    return out_file
+
+def open_lst(in_file, variable=None, chunks='auto'):
+    '''Opens the land surface temperatures of a zarr store, a NetCDF file or
+    (with rioxarray) a GeoTIFF as dask-chunked DataArray
+    :in_file : path of the store or file
+    :variable : variable of the land surface temperatures, the only one of
+        the store if None
+    :chunks : chunks of the DataArray, see xarray.open_dataset
+    '''
+    xarray = import_xarray()
+
+    extension = os.path.splitext(in_file.rstrip('/'))[1].lower()
+    if extension in ('.tif', '.tiff'):
+        if not _has_rioxarray():
+            raise ImportError('Opening {} needs rioxarray'.format(in_file))
+        import rioxarray
+
+        lst = rioxarray.open_rasterio(in_file, chunks=chunks)
+        # the first band, like read_lst_img
+        return lst.isel(band=0, drop=True)
+    if extension in dataset_formats['zarr']:
+        dataset = xarray.open_zarr(in_file, chunks=chunks)
+    else:
+        dataset = xarray.open_dataset(in_file, chunks=chunks)
+    if variable is None:
+        names = list(dataset.data_vars)
+        if len(names) != 1:
+            raise ValueError('{} has the variables {}, give the one of the '
+                             'land surface temperatures'.format(
+                                     in_file, ', '.join(names)))
+        variable = names[0]
+    return dataset[variable]
@@ -35,24 +35,19 @@ Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
 '''
 
 # Import libraries
+# Only what the toolbar icon and the Processing provider need is imported
+# when QGIS starts. The dialog, the DATTUTDUT model (NumPy) and GDAL are
+# imported on the first run, see run and start_task.
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction, QFileDialog
-from qgis.core import QgsProject, Qgis, QgsRasterLayer
+from qgis.core import QgsApplication, QgsProject, QgsRasterLayer, QgsTask
 # Initialize Qt resources from file resources.py
 from .resources import *
-# Import the code for the dialog
-from .qwatermodel_dialog import QWaterModelDialog
 import os.path
-# Import Libraries for the EB-Model
-import gdal
-import numpy as np
-import math
-import datetime
-
-# Define global variables
-sb_const = 5.6704*10**(-8) # Stefan Bolzmann constant
-sw_exo = 1361.5 # exo-atmospheric short wave radiation
+import threading
+# Import the Processing provider
+from .qwatermodel_provider import QWaterModelProvider
 
 # 
 class QWaterModel:
@@ -88,6 +83,14 @@ class QWaterModel:
         # Check if plugin was started the first time in current QGIS session
         # Must be set in initGui() to survive plugin reloads
         self.first_start = None
+        # Keeps the intermediate arrays, so a second run with other
+        # parameters only recomputes what changed, created on the first run
+        self.incremental_model = None
+        self.model_lock = threading.Lock()
+        # Tasks that were added to the task manager, a reference is kept
+        # until they are finished
+        self.tasks = []
+        self.provider = None
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -179,8 +182,15 @@ class QWaterModel:
 
         return action
 
+    def initProcessing(self):
+        '''Registers the Processing provider, qgis_process calls this
+        without initGui.'''
+        self.provider = QWaterModelProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self):
         '''Create the menu entries and toolbar icons inside the QGIS GUI.'''
+        self.initProcessing()
 
         icon_path = ':/plugins/qwatermodel/icon.png'
         self.add_action(
@@ -200,6 +210,16 @@ class QWaterModel:
                 self.tr(u'&QWaterModel'),
                 action)
             self.iface.removeToolBarIcon(action)
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+        # stop the tasks and free the arrays of the last run
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        with self.model_lock:
+            if self.incremental_model is not None:
+                self.incremental_model.reset()
             
     def select_input_file(self):
         '''Opens a file browser and populates the output_name lineEdit widget
@@ -225,372 +245,60 @@ class QWaterModel:
                 self.dlg, 'Select output file name','','*.csv')
         self.dlg.output_name.setText(filename)
         
-    def read_lst_img(self,in_file, na_val=None):
-            '''This function reads thermal image and extracts land sturface 
-            temperature (lst) projection (prj) and georeference data (geo).
-            :in_file : path and file name
-            :na_val : float that specifies NaN values
-            '''            
-            new_raster = gdal.Open(in_file,gdal.GA_ReadOnly)
-            self.dlg.lst = new_raster.GetRasterBand(1).ReadAsArray()
-            self.dlg.prj = new_raster.GetProjection()
-            self.dlg.geo = new_raster.GetGeoTransform()
-            self.dlg.lon = float(self.dlg.geo[0])
-            self.dlg.lat = float(self.dlg.geo[3])
-            # set all zeros to NaN
-            self.dlg.lst[self.dlg.lst == 0.0] = self.dlg.na_val
-                    
-    def get_model_parameters(self,in_file):
-        '''This function reads the input of the gui and assigns it to the parameters'''
-        self.dlg.na_val = None
-        #input
-        self.read_lst_img(in_file) # read the lst image
-        self.dlg.tmin_thres = self.dlg.min_temp_threshold_input.text()
-        self.dlg.tmax_thres = self.dlg.max_temp_threshold_input.text()
-        self.dlg.tmin = self.dlg.min_temp_input.text()
-        self.dlg.tmax = self.dlg.max_temp_input.text()
-        self.dlg.utc = self.dlg.utc_input.text()
-        self.dlg.albedo = None 
-        self.dlg.surf_emis = self.dlg.surf_emis_input.text()
-        self.dlg.atm_trans = self.dlg.atm_trans_input.text()
-        self.dlg.atm_emis = self.dlg.atm_emis_input.text()
-        self.dlg.air_temp = self.dlg.air_temp_input.text()
-        self.dlg.time_period = self.dlg.time_period_input.text() 
-        self.dlg.sw_irr = self.dlg.sw_irr_input.text()
-        self.dlg.g_percentage = self.dlg.g_percentage_input.text()
-        self.dlg.longitude_manual = self.dlg.longitude_manual_input.text()
-        self.dlg.latitude_manual = self.dlg.latitude_manual_input.text()
-        
-        # results
-        self.dlg.rn = self.dlg.rn_input.text()
-        self.dlg.h = None # sensible heat flux
-        self.dlg.le = None # latent heat flux
-        self.dlg.g = None # ground heat flux
-        self.dlg.ef = None # evaporative fraction
-        self.dlg.water = None #amount of water
-        
-    def get_tmin_tmax(self):
-        '''This function defines tmin and tmax (minimum and maximum temperatures) 
-        from the gui input or from the image itself
-        '''
-        if self.dlg.tmin == '':
-            self.dlg.tmin  = np.percentile(self.dlg.lst[~np.isnan(self.dlg.lst)], 
-                                                        float(self.dlg.tmin_thres))
-        else:
-            pass
-        if self.dlg.tmax == '':
-            self.dlg.tmax  = np.percentile(self.dlg.lst[~np.isnan(self.dlg.lst)], 
-                                                        float(self.dlg.tmax_thres))
-        else:
-            pass
-        
-    def get_air_temp(self):
-        '''Determines air temperature: either air temperature is given with 
-        input or the minimum temperature tmin is taken as air temperature as
-        in Timmermans et al. (2015)
-        '''
-        if self.dlg.air_temp == '':
-            self.dlg.air_temp = self.dlg.tmin
-        else:
-            pass
-        
-    def get_time_period(self):
-        '''This function determines the time slot for temporal upscaling of 
-        evapotranspirated water amount in seconds. 
-        '''
-        if self.dlg.time_period == '':
-            self.dlg.time_period = 3600
-        else:
-            pass
-        
-    def get_albedo(self):
-        '''This function determines surface albedo from input or from land surface 
-        temperatures and minimum and maximum temperatures based on Timmermans et al.
-        (2015), Brutsaert (1982) and Garrat (1992)
-        '''
-        if self.dlg.albedo == None:
-            self.dlg.albedo = abs(0.05 + ((self.dlg.lst-float(self.dlg.tmin))/
-                                 (float(self.dlg.tmax)-float(self.dlg.tmin))) * 0.2)
-        else:
-            pass
-        if np.isnan(np.sum(self.dlg.albedo)):
-            pass
-        else:
-            self.dlg.albedo[self.dlg.albedo > 1.0] = 0.25
-            self.dlg.albedo[self.dlg.albedo < 0.0] = 0.05
-        
-            
-    def get_atm_trans(self):
-        '''This function determines atmospheric transmissivity 
-        an adapted from Burridge and Gadd (1977) or on manual input from the GUI
-        '''
-        if self.dlg.atm_trans == '':
-            self.dlg.atm_trans = 0.6 + 0.2 * np.sin(np.deg2rad(self.get_sol_elev_ang()))
-        else:
-            pass
-            
-    def get_sol_elev_ang(self):
-        '''This part is based on the SunPositionCalculator by mperezcorrales
-        original repository = https://github.com/mperezcorrales/SunPositionCalculator'''
-        
-        if self.dlg.longitude_manual == '' and self.dlg.latitude_manual == '':
-            #get day of the year, hour and minute from the datetime format
-            utc = datetime.datetime.strptime(str(self.dlg.utc),'%Y-%m-%dT%H:%M:%S')
-            doy = float(utc.strftime('%j'))
-            
-            daytime = float(utc.hour + utc.minute/60)
-            
-            g = (360 / 365.25) * (doy + daytime/24)
-            g_radians = math.radians(g)
-            declination = (0.396372 - 22.91327 * math.cos(g_radians) + 4.02543 *
-                           math.sin(g_radians) - 0.387205 * math.cos(2 * g_radians) 
-                           + 0.051967 * math.sin(2 * g_radians) - 0.154527 * 
-                           math.cos(3 * g_radians) + 0.084798 * math.sin(3 * g_radians))
-    
-            time_correction = (0.004297 + 0.107029 * math.cos(g_radians) - 1.837877 * 
-                               math.sin(g_radians) - 0.837378 * math.cos(2 * g_radians) - 
-                               2.340475 * math.sin(2 * g_radians))
-    
-            SHA = (daytime - 12) * 15 + self.dlg.lon + time_correction
-    
-            if (SHA > 180):
-                SHA = SHA - 360
-            elif (SHA < -180):
-                SHA = SHA + 360
-            else:
-                SHA = SHA
-            lat_radians = math.radians(self.dlg.lat)
-            d_radians = math.radians(declination)
-            SHA_radians = math.radians(SHA)
-    
-            SZA_radians = math.acos(
-                    math.sin(lat_radians) * math.sin(d_radians) + math.cos(lat_radians) 
-                    * math.cos(d_radians) * math.cos(SHA_radians))
-    
-            SZA = math.degrees(SZA_radians)
-    
-            SEA = 90 - SZA
-            
-            return SEA
-            
-        else:
-            #get day of the year, hour and minute from the datetime format
-            utc = datetime.datetime.strptime(str(self.dlg.utc),'%Y-%m-%dT%H:%M:%S')
-            doy = float(utc.strftime('%j'))
-                
-            daytime = float(utc.hour + utc.minute/60)
-                
-            g = (360 / 365.25) * (doy + daytime/24)
-            g_radians = math.radians(g)
-            declination = (0.396372 - 22.91327 * math.cos(g_radians) + 4.02543 *
-                           math.sin(g_radians) - 0.387205 * math.cos(2 * g_radians) 
-                           + 0.051967 * math.sin(2 * g_radians) - 0.154527 * 
-                           math.cos(3 * g_radians) + 0.084798 * math.sin(3 * g_radians))
-        
-            time_correction = (0.004297 + 0.107029 * math.cos(g_radians) - 1.837877 * 
-                               math.sin(g_radians) - 0.837378 * math.cos(2 * g_radians) - 
-                               2.340475 * math.sin(2 * g_radians))
-        
-            SHA = (daytime - 12) * 15 + float(self.dlg.longitude_manual) + time_correction
-        
-            if (SHA > 180):
-                SHA = SHA - 360
-            elif (SHA < -180):
-                SHA = SHA + 360
-            else:
-                SHA = SHA
-            lat_radians = math.radians(float(self.dlg.latitude_manual))
-            d_radians = math.radians(declination)
-            SHA_radians = math.radians(SHA)
-        
-            SZA_radians = math.acos(
-                    math.sin(lat_radians) * math.sin(d_radians) + math.cos(lat_radians) 
-                    * math.cos(d_radians) * math.cos(SHA_radians))
-        
-            SZA = math.degrees(SZA_radians)
-        
-            SEA = 90 - SZA
-                
-            return SEA
-                    
-      
-    def get_sw_irr(self):
-        '''This function determines short-wave irradiance, either from manual
-        input, as described in Timmermans et al. (2015), or based on Burridge 
-        and Gadd (1974) 
-        '''
-        # if a measured sw_irr value is available
-        if self.dlg.sw_irr != '':
-            pass
-        # if both time and sw_irr are not available 
-        elif self.dlg.sw_irr == '' and self.dlg.utc == '':
-            self.dlg.sw_irr = float(self.dlg.atm_trans) * sw_exo
-        # if utc is available but sw_irr is not
-        # this multiplies the solar constant first with atmospheric transmissivity and also with 
-        # the sinus of solar elevation angle to  
-        elif self.dlg.utc != '' and self.dlg.sw_irr == '':
-            self.dlg.sw_irr = sw_exo * float(self.dlg.atm_trans) * np.sin(np.deg2rad(self.get_sol_elev_ang()))
-        else:
-            pass
-        
-    def get_atm_emis(self):
-        '''This function determines etermines atmospheric emissivity either from
-        manual input based on Bastiaanssen et al. (1998)
-        '''
-        if self.dlg.atm_emis != '':
-            pass
-        else:
-            self.dlg.atm_emis = 1.08 * (- math.log(float(self.dlg.atm_trans)))**0.265
-            
-    def get_evap_frac(self):
-        '''This function determines the evaporative fraction as in Timmermans 
-        et al. (2015) it further applies a maximum and a minimum value
-        '''
-        self.dlg.ef = (float(self.dlg.tmax)-self.dlg.lst)/(
-                float(self.dlg.tmax)-float(self.dlg.tmin))
-        if np.isnan(np.sum(self.dlg.ef)):
-            pass
-        else:
-            self.dlg.ef[self.dlg.ef >= 1.0] = 1.0
-            self.dlg.ef[self.dlg.ef <= 0.0] = 0.0
-            
-    def get_rn(self):
-        '''This function calculates net radiation (rn) as in Timmermans et al. 
-        (2015)
-        '''
-        # if no value for rn is specified
-        if self.dlg.rn == '':
-            self.dlg.rn = ((1-self.dlg.albedo) * float(self.dlg.sw_irr) + 
-                           float(self.dlg.surf_emis) * float(self.dlg.atm_emis) * 
-                           sb_const * (float(self.dlg.air_temp)**4) - 
-                           float(self.dlg.surf_emis) * sb_const * 
-                           (self.dlg.lst**4))
-        # if rn is specified 
-        else: 
-            self.dlg.rn = float(self.dlg.rn)*self.dlg.lst/self.dlg.lst
-            
-    def get_g(self):
-        '''This function determines the ground heat flux (g). g is computed as 
-        a linear function of Rn similar as described in Liebethal and Foken (2007).
-        Default values from the GUI are based on Ogée et al. (2001). If no value
-        is given, g is computed according to Timmermans et al. (2015)
-        '''
-        if self.dlg.g_percentage == '':
-            self.dlg.g = self.dlg.rn * (0.05 + ((self.dlg.lst-float(self.dlg.tmin))/
-                                 (float(self.dlg.tmax)-float(self.dlg.tmin))) * 0.4)
-            
-        else:
-            self.dlg.g = self.dlg.rn * (float(self.dlg.g_percentage) / 100)
-                
-        if np.isnan(np.sum(self.dlg.g)):
-            pass
-        else:
-            self.dlg.g[self.dlg.g > 1.0] = 0.45
-            self.dlg.g[self.dlg.g < 0.0] = 0.05
-        
-    def get_h_le(self):
-        '''This function determines latent heat flux (le) and sensible heat 
-        flux (h) according to evaporative fraction (ef) based on Timmermans et
-        al. (2015)
-        '''
-        self.dlg.le = (self.dlg.rn - self.dlg.g) * self.dlg.ef
-        self.dlg.h = (self.dlg.rn -self.dlg.g) - self.dlg.le
-        
-    def get_water(self):
-        '''This function calculates the actual amount of water based on 
-        Timmermans et al. (2015)
-        '''
-        if self.dlg.water == None:
-            self.dlg.water = ((self.dlg.le*float(self.dlg.time_period)/1000000)/
-                              (2.501-0.002361*(float(self.dlg.air_temp)-273.15)))
-        else: 
-            pass
-        
-    def write_output_images(self):
-        '''This function writes the output data into a GeoTIFF'''
-        
-        rows,cols=np.shape(self.dlg.g)
-        driver = gdal.GetDriverByName('GTiff')
-        nbands=6
-        out_raster = driver.Create(self.dlg.output_raster_name.text(), cols, 
-                                   rows, nbands, gdal.GDT_Float32)
-        out_raster.SetGeoTransform(self.dlg.geo)
-        out_raster.SetProjection(self.dlg.prj)
-        # Write net radiation rn to band 1
-        band_1=out_raster.GetRasterBand(1)
-        band_1.SetNoDataValue(0)
-        band_1.WriteArray(self.dlg.rn)
-        band_1.FlushCache()
-        # Write latent heat flux le to band 2
-        band_2=out_raster.GetRasterBand(2)
-        band_2.SetNoDataValue(0)
-        band_2.WriteArray(self.dlg.le)
-        band_2.FlushCache()
-        # Write sensible heat flux h to band 3
-        band_3=out_raster.GetRasterBand(3)
-        band_3.SetNoDataValue(0)
-        band_3.WriteArray(self.dlg.h)
-        band_3.FlushCache()
-        # Write ground heat flux to band 4
-        band_4=out_raster.GetRasterBand(4)
-        band_4.SetNoDataValue(0)
-        band_4.WriteArray(self.dlg.g)
-        band_4.FlushCache()
-        # Write evaporative fraction to band 5
-        band_5=out_raster.GetRasterBand(5)
-        band_5.SetNoDataValue(0)
-        band_5.WriteArray(self.dlg.ef)
-        band_5.FlushCache()
-        # Write actual amount of evapotranspirated water to band 6
-        band_6=out_raster.GetRasterBand(6)
-        band_6.SetNoDataValue(0)
-        band_6.WriteArray(self.dlg.water)
-        band_6.FlushCache()
-                
-        # Flush Cache
-        out_raster.FlushCache()
-        del out_raster
+    def get_model_parameters(self):
+        '''This function reads the input of the gui and returns it as 
+        ModelParameters, empty fields are derived by the model'''
+        from .dattutdut import model
+
+        return model.ModelParameters.from_strings(
+                utc=self.dlg.utc_input.text(),
+                tmin_thres=self.dlg.min_temp_threshold_input.text(),
+                tmax_thres=self.dlg.max_temp_threshold_input.text(),
+                tmin=self.dlg.min_temp_input.text(),
+                tmax=self.dlg.max_temp_input.text(),
+                surf_emis=self.dlg.surf_emis_input.text(),
+                atm_trans=self.dlg.atm_trans_input.text(),
+                atm_emis=self.dlg.atm_emis_input.text(),
+                air_temp=self.dlg.air_temp_input.text(),
+                time_period=self.dlg.time_period_input.text(),
+                sw_irr=self.dlg.sw_irr_input.text(),
+                g_percentage=self.dlg.g_percentage_input.text(),
+                rn=self.dlg.rn_input.text(),
+                longitude=self.dlg.longitude_manual_input.text(),
+                latitude=self.dlg.latitude_manual_input.text())
         
-        # load layer into qgis
-        qgis_raster = QgsRasterLayer(self.dlg.output_raster_name.text(), 'QWaterModel Output')
-        QgsProject.instance().addMapLayer(qgis_raster)
-        
-    def write_stats(self,file,flux_name,flux):
-        file.write(flux_name + ' ' + str(np.mean(flux[~np.isnan(flux)])) + ' ' +
-                              str(np.min(flux[~np.isnan(flux)])) + ' ' +
-                              str(np.max(flux[~np.isnan(flux)])) + '\n'
-                              )
-        
-    def write_output_stats(self):
-        '''This function creates the output .csv file'''
-        # write the output data in a .csv file
-        with open(self.dlg.output_name.text(), 'w') as output_file:
-            # write an out file with the most important stats
-            # model parameters
-            output_file.write('QWaterModel output stats:' + '\n')
-            output_file.write('Input file name: ' + str(self.dlg.input_name.text()) + '\n')
-            output_file.write('utc: ' + str(self.dlg.utc) + '\n')
-            output_file.write('Temperature information:' + '\n')
-            output_file.write('tmin: ' + str(self.dlg.tmin) + '\n')
-            output_file.write('tmax: ' + str(self.dlg.tmax) + '\n')
-            output_file.write('temp mean: ' + str(np.mean(self.dlg.lst[~np.isnan(self.dlg.lst)])) + '\n')
-            output_file.write('Model parameters:' + '\n')
-            output_file.write('surf_emis: ' + str(self.dlg.surf_emis) + '\n')
-            output_file.write('atm_emis: ' + str(self.dlg.atm_emis) + '\n')
-            output_file.write('atm_trans: ' + str(self.dlg.atm_trans) + '\n')
-            output_file.write('solar_elev_ang: ' + str(self.get_sol_elev_ang()) + '\n')
-            output_file.write('albedo mean: ' + str(np.mean(self.dlg.albedo[~np.isnan(self.dlg.albedo)])) + '\n')
-            output_file.write('sw_irr: ' + str(self.dlg.sw_irr) + '\n')
-            output_file.write('air_temp: ' + str(self.dlg.air_temp) + '\n')
-            output_file.write('time_period: ' + str(self.dlg.time_period) + '\n')
-            output_file.write('Output raster information:' + '\n')
-            output_file.write('flux ' + 'mean ' + 'min ' + 'max ' + '\n')
-            self.write_stats(output_file,'net radiation [W/m²]',self.dlg.rn)
-            self.write_stats(output_file,'latent heat flux [W/m²]',self.dlg.le)
-            self.write_stats(output_file,'sensible heat flux [W/m²]',self.dlg.h)
-            self.write_stats(output_file,'ground heat flux [W/m²]',self.dlg.g)
-            self.write_stats(output_file,'evaporative fraction [-]',self.dlg.ef)
-            self.write_stats(output_file,'water amount [mm/time/m²]',self.dlg.water)
+    def get_profile_setting(self):
+        '''Returns True if the stages of a run are measured and written to
+        the message log, set QWaterModel/instrumentation to true in the
+        advanced settings'''
+        return QSettings().value('QWaterModel/instrumentation', False,
+                                 type=bool)
+
+    def get_incremental_model(self):
+        '''Returns the IncrementalModel of the plugin, the model is imported
+        and created on the first call'''
+        if self.incremental_model is None:
+            from .dattutdut import incremental
+
+            self.incremental_model = incremental.IncrementalModel()
+        return self.incremental_model
+
+    def start_task(self):
+        '''Adds a task that runs the model with the current input of the
+        gui to the QGIS task manager'''
+        # the task imports the model and GDAL
+        from .qwatermodel_task import QWaterModelTask
+
+        # forget the tasks that are finished
+        self.tasks = [task for task in self.tasks if task.status() not in
+                      (QgsTask.Complete, QgsTask.Terminated)]
+        task = QWaterModelTask(
+                self.iface, self.dlg.input_name.text(),
+                self.dlg.output_raster_name.text(), self.dlg.output_name.text(),
+                self.get_model_parameters(), self.get_incremental_model(),
+                self.model_lock, self.get_profile_setting())
+        self.tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
             
     def run(self):
         '''This function runs the plugin'''
@@ -598,6 +306,9 @@ class QWaterModel:
         # Create the dialog with elements (after translation) and keep reference
         # Only create GUI ONCE in callback, so that it will only load when the plugin is started
         if self.first_start == True:
+            # the .ui file is only loaded when the dialog is first needed
+            from .qwatermodel_dialog import QWaterModelDialog
+
             self.first_start = False
             self.dlg = QWaterModelDialog()
             self.dlg.search_input_button.clicked.connect(self.select_input_file)
@@ -610,39 +321,6 @@ class QWaterModel:
         result = self.dlg.exec_()
         # See if OK was pressed
         if result:
-            # define in raster
-            in_file = self.dlg.input_name.text()
-            #selected_input_rastername = QgsProject.instance().mapLayersByName(input_rastername)[0]
-            # get all the model parameters
-            self.get_model_parameters(in_file)
-            # get tmin and tmax if not already defined in settings
-            self.get_tmin_tmax()
-            # get air temperature
-            self.get_air_temp()
-            # get time
-            self.get_time_period()
-            # Calculate surface albedo 
-            self.get_albedo()
-            # Determine atmospheric transmissivity
-            self.get_atm_trans()
-            # Calculate short wave incoming radiation. 
-            self.get_sw_irr()
-            # Calculate atmospheric emissivity
-            self.get_atm_emis()
-            # Calculate evaporative fraction Lambda 
-            self.get_evap_frac()
-            # Calculate fluxes
-            self.get_rn()
-            self.get_g()
-            self.get_h_le()
-            # calculate the actual amount of evapotranspirated water
-            self.get_water()
-            # write results to a .tif file and load it into qgis
-            self.write_output_images()
-            # write output stats file 
-            self.write_output_stats()
-                         
-            # Display a push message that QWaterModel was successful
-            self.iface.messageBar().pushMessage(
-                    'Success', 'QWaterModel was successfull!',
-                    level=Qgis.Success, duration=3)       
+            # run the DATTUTDUT model in the background, the output layer
+            # is loaded into qgis when the task is finished
+            self.start_task()
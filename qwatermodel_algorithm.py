@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - Processing algorithm
+This module contains the DATTUTDUT model as a QGIS Processing algorithm
+with the fields of the QWaterModel dialog as parameters. It can be used in
+the Processing toolbox, in models, in the batch runner and headless with
+qgis_process run qwatermodel:dattutdut.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingException,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterDestination,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterString)
+# The DATTUTDUT energy-balance model and GDAL are imported when the
+# algorithm runs, not when QGIS loads the provider
+
+# Number parameters: name, label, default of the dialog (None for an empty
+# field, which the model derives) and the ModelParameters field
+number_parameters = (
+    ('TMIN_THRES', 'Percentile Min. Temp.', 0.5, 'tmin_thres'),
+    ('TMAX_THRES', 'Percentile Max. Temp.', 100, 'tmax_thres'),
+    ('TMIN', 'Min. Temp. [K]', None, 'tmin'),
+    ('TMAX', 'Max. Temp. [K]', None, 'tmax'),
+    ('SURF_EMIS', 'Surface emissivity', 1.0, 'surf_emis'),
+    ('ATM_TRANS', 'Atmospheric transmissivity', 0.7, 'atm_trans'),
+    ('ATM_EMIS', 'Atmospheric emissivity', 0.8, 'atm_emis'),
+    ('AIR_TEMP', 'Air temperature [K]', None, 'air_temp'),
+    ('TIME_PERIOD', 'Time period [s]', 3600, 'time_period'),
+    ('SW_IRR', 'Short-wave irradiance [W/m²]', None, 'sw_irr'),
+    ('G_PERCENTAGE', 'Ground heat flux %', None, 'g_percentage'),
+    ('RN', 'Net radiation [W/m²]', None, 'rn'),
+    ('LONGITUDE', 'Measured longitude [dec]', None, 'longitude'),
+    ('LATITUDE', 'Measured latitude [dec]', None, 'latitude'),
+)
+
+
+class ProcessingCancelled(Exception):
+    '''Raised in the write callback when the feedback was cancelled'''
+
+
+class QWaterModelAlgorithm(QgsProcessingAlgorithm):
+    '''Runs the DATTUTDUT model on a land surface temperature raster and
+    writes the output raster and the stats file of the plugin.
+    '''
+
+    INPUT = 'INPUT'
+    UTC = 'UTC'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_STATS = 'OUTPUT_STATS'
+    PROFILE = 'PROFILE'
+
+    def tr(self, string):
+        return QCoreApplication.translate('QWaterModelAlgorithm', string)
+
+    def createInstance(self):
+        return QWaterModelAlgorithm()
+
+    def name(self):
+        return 'dattutdut'
+
+    def displayName(self):
+        return self.tr('DATTUTDUT evapotranspiration')
+
+    def shortHelpString(self):
+        return self.tr(
+                'Calculates net radiation, latent, sensible and ground heat '
+                'flux, the evaporative fraction and the amount of '
+                'evapotranspirated water from a land surface temperature '
+                'raster [K] with the DATTUTDUT energy-balance model. Empty '
+                'parameters are derived from the image, as in the QWaterModel '
+                'dialog.')
+
+    def initAlgorithm(self, config=None):
+        '''Adds the fields of the dialog as parameters'''
+        self.addParameter(QgsProcessingParameterRasterLayer(
+                self.INPUT, self.tr('Land surface temperature raster [K]')))
+        self.addParameter(QgsProcessingParameterString(
+                self.UTC, self.tr('Coordinated Universal Time UTC '
+                                  '(YYYY-MM-DDTHH:MM:SS)'),
+                optional=True))
+        for name, label, default, field in number_parameters:
+            self.addParameter(QgsProcessingParameterNumber(
+                    name, self.tr(label), QgsProcessingParameterNumber.Double,
+                    default, optional=True))
+        self.addParameter(QgsProcessingParameterRasterDestination(
+                self.OUTPUT, self.tr('Output raster')))
+        self.addParameter(QgsProcessingParameterFileDestination(
+                self.OUTPUT_STATS, self.tr('Output stats file'),
+                'CSV files (*.csv)', optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+                self.PROFILE, self.tr('Log the time and memory of every '
+                                      'stage'), False, optional=True))
+
+    def get_model_parameters(self, parameters, context):
+        '''Returns the ModelParameters of the algorithm parameters, missing
+        parameters get the default of the dialog'''
+        from .dattutdut import model
+
+        fields = {'utc': self.parameterAsString(parameters, self.UTC, context)}
+        for name, label, default, field in number_parameters:
+            if parameters.get(name) in (None, ''):
+                fields[field] = default
+            else:
+                fields[field] = self.parameterAsDouble(parameters, name,
+                                                       context)
+        return model.ModelParameters.from_strings(**fields)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        '''Runs the model, the algorithm runs in its own thread and does not
+        share any state, so Processing can run several in parallel'''
+        from .dattutdut import instrumentation, model, raster_io, stats
+
+        layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if layer is None:
+            raise QgsProcessingException(self.invalidRasterError(
+                    parameters, self.INPUT))
+        in_file = layer.source()
+        out_file = self.parameterAsOutputLayer(parameters, self.OUTPUT,
+                                               context)
+        stats_file = self.parameterAsFileOutput(parameters, self.OUTPUT_STATS,
+                                                context)
+        params = self.get_model_parameters(parameters, context)
+
+        profile = self.parameterAsBoolean(parameters, self.PROFILE, context)
+        profiler = None
+        if profile or instrumentation.hooks:
+            profiler = instrumentation.Profiler(
+                    in_file, [lambda record: feedback.pushInfo(
+                            instrumentation.format_record(record))]
+                    if profile else ())
+
+        feedback.pushInfo(self.tr('Reading {}').format(in_file))
+        lst, prj, geo = instrumentation.measure_read(profiler, in_file)
+        lon, lat = raster_io.get_lon_lat(geo)
+        feedback.setProgress(10)
+        tmin, tmax = instrumentation.measure(
+                profiler, 'percentiles', model.get_tmin_tmax, lst,
+                params.tmin, params.tmax, params.tmin_thres,
+                params.tmax_thres)
+        model_result = instrumentation.measure(
+                profiler, 'fluxes', model.run_model, lst,
+                params.copy(tmin=tmin, tmax=tmax), lon, lat)
+        resolved = model_result.parameters
+        feedback.pushInfo('tmin={} tmax={}'.format(resolved.tmin,
+                                                    resolved.tmax))
+        feedback.setProgress(50)
+
+        def report(done, total):
+            if feedback.isCanceled():
+                raise ProcessingCancelled()
+            feedback.setProgress(50 + 45 * done / total)
+        try:
+            instrumentation.measure_write(profiler, out_file,
+                                          model_result.fluxes, geo, prj,
+                                          callback=report)
+        except ProcessingCancelled:
+            return {}
+        results = {self.OUTPUT: out_file}
+        if stats_file:
+            instrumentation.measure_stats(profiler, stats.write_output_stats,
+                                          stats_file, in_file, model_result)
+            results[self.OUTPUT_STATS] = stats_file
+        if profile:
+            # the sidecar is written next to the stats file if there is one
+            profile_file = profiler.write_json(
+                    instrumentation.get_sidecar_file(stats_file or out_file))
+            feedback.pushInfo(self.tr('Stage measurements written to '
+                                      '{}').format(profile_file))
+        feedback.setProgress(100)
+        return results
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - Processing provider
+This module registers the QWaterModel algorithms in the QGIS Processing
+framework.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+import os.path
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from .qwatermodel_algorithm import QWaterModelAlgorithm
+
+
+class QWaterModelProvider(QgsProcessingProvider):
+    '''Processing provider of QWaterModel, the algorithms are listed in
+    the toolbox and qgis_process as qwatermodel:<algorithm>.
+    '''
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(QWaterModelAlgorithm())
+
+    def id(self):
+        return 'qwatermodel'
+
+    def name(self):
+        return 'QWaterModel'
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icon.png'))
+
+    def longName(self):
+        return self.name()
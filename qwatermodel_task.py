@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+'''
+/***************************************************************************
+QWaterModel - background task
+This module runs the DATTUTDUT model as a QgsTask, so QGIS stays usable
+during a run. The task reports its progress while the model stages are
+computed and while the output raster is written block by block, and it
+can be cancelled between two stages or blocks. Every press on OK adds one
+task, so several frames can wait in the QGIS task manager.
+With instrumentation the time, bytes and memory of every stage are written
+to the QGIS message log and into a .profile.json file next to the stats
+file.
+                              -------------------
+        begin                : 2020-01-11
+        copyright            : (C) 2020 by Florian Ellsäßer
+        email                : el-flori@gmx.de
+ ***************************************************************************/
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+'''
+
+# Import libraries
+from qgis.core import Qgis, QgsMessageLog, QgsProject, QgsRasterLayer, QgsTask
+# Import the DATTUTDUT energy-balance model
+from .dattutdut import instrumentation, raster_io, stats
+
+# Share of the progress bar of every step of a run [%]
+read_progress = 10
+model_progress = 40
+write_progress = 45
+
+
+class TaskCancelled(Exception):
+    '''Raised at a checkpoint of a cancelled task'''
+
+
+class QWaterModelTask(QgsTask):
+    '''Runs the DATTUTDUT model on one land surface temperature raster,
+    writes the output raster and the stats file and adds the output layer
+    to the project when it is finished.
+    '''
+
+    def __init__(self, iface, in_file, output_raster_name, output_name,
+                 params, incremental_model, model_lock, profile=False):
+        '''Constructor.
+        :param iface: QgsInterface for the messages of the finished task
+        :param in_file: land surface temperature raster
+        :param output_raster_name: output GeoTIFF
+        :param output_name: stats file
+        :param params: ModelParameters of the dialog
+        :param incremental_model: IncrementalModel shared by the tasks of
+            the plugin, so unchanged stages are not computed again
+        :param model_lock: lock of the incremental model, one task at a
+            time computes with it
+        :param profile: measure the stages, see dattutdut.instrumentation.
+            They are also measured if hooks were added with
+            instrumentation.add_hook.
+        '''
+        super().__init__('QWaterModel {}'.format(in_file), QgsTask.CanCancel)
+        self.iface = iface
+        self.in_file = in_file
+        self.output_raster_name = output_raster_name
+        self.output_name = output_name
+        self.params = params
+        self.incremental_model = incremental_model
+        self.model_lock = model_lock
+        self.profile = profile
+        self.layer_file = None
+        self.exception = None
+
+    def checkpoint(self, progress):
+        '''Sets the progress [%] and stops the task if it was cancelled'''
+        if self.isCanceled():
+            raise TaskCancelled()
+        self.setProgress(progress)
+
+    def run(self):
+        '''Runs the model in the background thread of the task. Nothing in
+        here may touch the GUI.'''
+        try:
+            profiler = None
+            if self.profile or instrumentation.hooks:
+                profiler = instrumentation.Profiler(
+                        self.in_file, [self.log_record] if self.profile
+                        else ())
+            # the key of the file is taken before it is read, so a file that
+            # is written meanwhile is not mistaken for the one read
+            lst_key = raster_io.get_lst_key(self.in_file)
+            lst, prj, geo = instrumentation.measure_read(profiler,
+                                                         self.in_file)
+            lon, lat = raster_io.get_lon_lat(geo)
+            self.checkpoint(read_progress)
+            # the arrays of a run are not changed by later runs, so they
+            # can be written after the lock is released
+            with self.model_lock:
+                self.checkpoint(read_progress)
+                self.incremental_model.set_lst(lst, key=lst_key)
+                # the percentiles are kept for the run
+                instrumentation.measure(
+                        profiler, 'percentiles',
+                        self.incremental_model.resolve, self.params, lon,
+                        lat)
+                model_result = instrumentation.measure(
+                        profiler, 'fluxes', self.incremental_model.run,
+                        lst, self.params, lon, lat,
+                        callback=lambda index, total, name: self.checkpoint(
+                                read_progress +
+                                model_progress * (index + 1) / total))
+            start = read_progress + model_progress
+            self.layer_file = instrumentation.measure_write(
+                    profiler, self.output_raster_name, model_result.fluxes,
+                    geo, prj, callback=lambda done, total: self.checkpoint(
+                            start + write_progress * done / total))
+            instrumentation.measure_stats(
+                    profiler, stats.write_output_stats, self.output_name,
+                    self.in_file, model_result)
+            if self.profile:
+                profiler.write_json(instrumentation.get_sidecar_file(
+                        self.output_name))
+            self.setProgress(100)
+            return True
+        except TaskCancelled:
+            return False
+        except Exception as exception:
+            self.exception = exception
+            return False
+
+    def log_record(self, record):
+        '''Writes a StageRecord to the QGIS message log, which can be used
+        from the thread of the task'''
+        QgsMessageLog.logMessage(instrumentation.format_record(record),
+                                 'QWaterModel', Qgis.Info)
+
+    def finished(self, result):
+        '''Adds the output layer to the project or reports why the task
+        failed, in the GUI thread'''
+        if result:
+            # load layer into qgis
+            qgis_raster = QgsRasterLayer(self.layer_file, 'QWaterModel Output')
+            QgsProject.instance().addMapLayer(qgis_raster)
+            # Display a push message that QWaterModel was successful
+            self.iface.messageBar().pushMessage(
+                    'Success', 'QWaterModel was successfull!',
+                    level=Qgis.Success, duration=3)
+        elif self.exception is not None:
+            QgsMessageLog.logMessage(
+                    '{}: {}'.format(self.in_file, self.exception),
+                    'QWaterModel', Qgis.Critical)
+            self.iface.messageBar().pushMessage(
+                    'Error', 'QWaterModel failed: {}'.format(self.exception),
+                    level=Qgis.Critical)
+        else:
+            self.iface.messageBar().pushMessage(
+                    'Cancelled', 'QWaterModel was cancelled for {}'.format(
+                            self.in_file),
+                    level=Qgis.Warning, duration=3)
@@ -0,0 +1,171 @@
+# coding=utf-8
+"""Batch mode test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import batch, cli, model
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+DRONE_DATA = os.path.join(os.path.dirname(__file__), os.pardir,
+                          'Data_Examples', 'Drone_Data')
+
+
+class DattutdutBatchTest(unittest.TestCase):
+    """Test the batch mode and the command line interface."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.frames = [
+            write_lst_file(os.path.join(self.tmp_dir, '{}.tif'.format(i)),
+                           make_lst(12, 15, seed=i))
+            for i in range(200, 203)]
+        self.out_dir = os.path.join(self.tmp_dir, 'out')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find_frames(self):
+        """Test the drone example frames are found in order."""
+        frames = batch.find_frames(DRONE_DATA)
+        self.assertEqual(len(frames), 13)
+        self.assertTrue(frames[0].endswith('200.tif'))
+        self.assertTrue(frames[-1].endswith('212.tif'))
+
+    def test_frame_times(self):
+        """Test the utc times from start and interval and from a file."""
+        utcs = batch.get_frame_times(self.frames, start='2017-08-07T02:00:00',
+                                     interval=1800)
+        self.assertEqual(utcs[2], datetime.datetime(2017, 8, 7, 3, 0, 0))
+        times_file = os.path.join(self.tmp_dir, 'times.csv')
+        with open(times_file, 'w') as out_file:
+            for frame, utc in zip(self.frames, utcs):
+                out_file.write('{},{}\n'.format(os.path.basename(frame),
+                                                model.format_utc(utc)))
+        self.assertEqual(batch.get_frame_times(self.frames,
+                                               times_file=times_file), utcs)
+        with self.assertRaises(ValueError):
+            batch.get_frame_times(self.frames, utcs=utcs[:2])
+
+    def test_run_batch(self):
+        """Test per-frame outputs and the stack have the same values."""
+        utcs = batch.get_frame_times(self.frames, start='2017-08-07T02:00:00',
+                                     interval=3600)
+        stack_file = os.path.join(self.tmp_dir, 'stack.tif')
+        resolved = batch.run_batch(self.frames, utcs, out_dir=self.out_dir,
+                                   stack_file=stack_file)
+        self.assertEqual(len(resolved), 3)
+        self.assertEqual(resolved[1].utc, utcs[1])
+        from dattutdut import raster_io
+        stack = raster_io.open_raster(stack_file)
+        self.assertEqual(stack.RasterCount, 18)
+        frame = raster_io.open_raster(
+            batch.get_output_name(self.frames[1], self.out_dir))
+        np.testing.assert_array_equal(
+            stack.GetRasterBand(8).ReadAsArray(),
+            frame.GetRasterBand(2).ReadAsArray())
+        self.assertTrue(os.path.exists(
+            batch.get_output_name(self.frames[2], self.out_dir, '.csv')))
+
+    def test_stack_grids(self):
+        """Test frames of other sizes and origins are placed on the stack."""
+        from dattutdut import raster_io
+        frames = [
+            write_lst_file(os.path.join(self.tmp_dir, 'g{}.tif'.format(i)),
+                           make_lst(rows, cols, seed=i), geo)
+            for i, (rows, cols, geo) in enumerate((
+                (12, 15, (13.0, 0.001, 0, 52.0, 0, -0.001)),
+                (14, 16, (13.002, 0.001, 0, 51.999, 0, -0.001)),
+                (13, 18, (12.999, 0.001, 0, 52.001, 0, -0.001))))]
+        utcs = batch.get_frame_times(frames, start='2017-08-07T02:00:00',
+                                     interval=3600)
+        stack_file = os.path.join(self.tmp_dir, 'stack.tif')
+        batch.run_batch(frames, utcs, out_dir=self.out_dir,
+                        stack_file=stack_file, bands=['le'])
+        stack = raster_io.open_raster(stack_file)
+        np.testing.assert_allclose(stack.GetGeoTransform(),
+                                   (12.999, 0.001, 0, 52.001, 0, -0.001))
+        self.assertEqual((stack.RasterYSize, stack.RasterXSize), (16, 19))
+        le = stack.GetRasterBand(2).ReadAsArray()
+        frame = raster_io.open_raster(
+            batch.get_output_name(frames[1], self.out_dir))
+        np.testing.assert_array_equal(le[2:16, 3:19],
+                                      frame.GetRasterBand(1).ReadAsArray())
+        self.assertTrue(np.all(np.isnan(le[:2])))
+        self.assertTrue(np.all(np.isnan(le[:, :3])))
+
+    def test_failed_stack(self):
+        """Test a failing batch deletes the unfinished stack."""
+        utcs = batch.get_frame_times(self.frames, start='2017-08-07T02:00:00',
+                                     interval=3600)
+        stack_file = os.path.join(self.tmp_dir, 'stack.tif')
+
+        def cancel(index, frame, resolved):
+            """Cancels the batch after the second frame."""
+            if index == 1:
+                raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            batch.run_batch(self.frames, utcs, stack_file=stack_file,
+                            callback=cancel)
+        self.assertFalse(os.path.exists(stack_file))
+        # a rotated frame is found before anything is written
+        write_lst_file(self.frames[2], make_lst(12, 15),
+                       (13.0, 0.001, 0.0001, 52.0, 0, -0.001))
+        with self.assertRaises(ValueError):
+            batch.run_batch(self.frames, utcs, out_dir=self.out_dir,
+                            stack_file=stack_file)
+        self.assertFalse(os.path.exists(stack_file))
+        self.assertFalse(os.path.exists(self.out_dir) and
+                         os.listdir(self.out_dir))
+
+    def test_cli_batch(self):
+        """Test the batch command with a derived atm_trans."""
+        exit_code = cli.main([
+            'batch', os.path.join(self.tmp_dir, '*.tif'),
+            '--utc', '2017-08-07T06:00:00', '2017-08-07T07:00:00',
+            '2017-08-07T08:00:00', '--out-dir', self.out_dir,
+            '--atm-trans', '', '--surf-emis', '0.98'])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(len(os.listdir(self.out_dir)), 6)
+
+    def test_cli_parameters(self):
+        """Test options become model parameters and keep the defaults."""
+        args = cli.build_parser().parse_args([
+            'batch', self.tmp_dir, '--start', '2017-08-07T06:00:00',
+            '--interval', '60', '--out-dir', self.out_dir, '--tmin', '290',
+            '--atm-emis', ''])
+        params = cli.parameters_from_args(args)
+        self.assertEqual(params.tmin, 290.0)
+        self.assertIsNone(params.atm_emis)
+        self.assertEqual(params.atm_trans, 0.7)
+        # the times per frame are not a model parameter
+        args = cli.build_parser().parse_args([
+            'batch', self.tmp_dir, '--utc', '2017-08-07T06:00:00',
+            '2017-08-07T06:01:00', '--out-dir', self.out_dir])
+        self.assertIsNone(cli.parameters_from_args(args).utc)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutBatchTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
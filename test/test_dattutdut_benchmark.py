@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Benchmark test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import ast
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dattutdut import benchmark
+
+
+class DattutdutBenchmarkTest(unittest.TestCase):
+    """Test the benchmark records every stage."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_size(self):
+        """Test square and rectangular sizes."""
+        self.assertEqual(benchmark.parse_size('64'), (64, 64))
+        self.assertEqual(benchmark.parse_size('32x128'), (32, 128))
+        with self.assertRaises(ValueError):
+            benchmark.parse_size('big')
+
+    def test_synthetic(self):
+        """Test the in-memory stages and the streaming mode."""
+        work_dir = os.path.join(self.tmp_dir, 'work')
+        records = benchmark.run_benchmarks(
+            synthetic_sizes=[(40, 30), (64, 64)], work_dir=work_dir, repeat=2,
+            max_memory_pixels=2000)
+        summary = benchmark.summarize(records)
+        self.assertEqual([(row['raster'], row['stage']) for row in summary],
+                         [('synthetic_40x30', stage)
+                          for stage in benchmark.stages] +
+                         [('synthetic_64x64', 'streaming')])
+        self.assertTrue(all(row['runs'] == 2 and row['seconds'] > 0
+                            for row in summary))
+        self.assertEqual(summary[0]['pixels'], 1200)
+        # the synthetic rasters are deleted
+        self.assertFalse(any(name.startswith('synthetic')
+                             for name in os.listdir(work_dir)))
+        json_file = os.path.join(self.tmp_dir, 'bench.json')
+        benchmark.write_benchmark_json(json_file, records)
+        with open(json_file) as in_file:
+            document = json.load(in_file)
+        self.assertEqual(len(document['records']), 12)
+        self.assertIn('synthetic_64x64', benchmark.format_summary(summary))
+
+    def test_startup_imports(self):
+        """Test the modules loaded at QGIS startup defer the model."""
+        deferred = [name.split('.')[0] for name in benchmark.deferred_modules]
+        for module in ('__init__',) + benchmark.startup_modules + (
+                'qwatermodel_algorithm',):
+            with open(os.path.join(benchmark.plugin_dir,
+                                   module + '.py')) as in_file:
+                tree = ast.parse(in_file.read())
+            # only the imports of the module itself, not of its functions
+            names = []
+            for node in tree.body:
+                if isinstance(node, ast.Import):
+                    names.extend(alias.name for alias in node.names)
+                elif isinstance(node, ast.ImportFrom):
+                    names.append(node.module or '')
+                    names.extend(alias.name for alias in node.names)
+            for name in names:
+                self.assertNotIn(name.split('.')[0], deferred,
+                                 '{} imports {}'.format(module, name))
+
+    def test_startup_needs_qgis(self):
+        """Test the startup benchmark tells that QGIS is missing."""
+        try:
+            import qgis.core  # noqa: F401
+        except ImportError:
+            with self.assertRaises(IOError):
+                benchmark.measure_startup(repeat=1)
+        else:
+            startup = benchmark.measure_startup(repeat=1)
+            self.assertEqual(startup['deferred_imported'], [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutBenchmarkTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,73 @@
+# coding=utf-8
+"""Cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import cache
+
+
+class DattutdutCacheTest(unittest.TestCase):
+    """Test the least recently used array cache."""
+
+    def test_budget(self):
+        """Test the least recently used values are dropped."""
+        array_cache = cache.ArrayCache(max_bytes=3000)
+        for key in 'abc':
+            array_cache.put(key, np.zeros(100), 800)
+        self.assertIsNotNone(array_cache.get('a'))
+        array_cache.put('d', np.zeros(100), 800)
+        self.assertIsNone(array_cache.get('b'))
+        self.assertEqual(len(array_cache), 3)
+        self.assertEqual(array_cache.nbytes, 2400)
+        array_cache.put('e', np.zeros(1000), 8000)
+        self.assertNotIn('e', array_cache)
+        array_cache.set_budget(1000)
+        self.assertEqual(len(array_cache), 1)
+        self.assertIn('d', array_cache)
+        self.assertEqual((array_cache.hits, array_cache.misses), (1, 1))
+
+    def test_discard(self):
+        """Test matching keys are dropped."""
+        array_cache = cache.ArrayCache()
+        array_cache.put(('a', 1), 1, 10)
+        array_cache.put(('a', 2), 2, 10)
+        array_cache.put(('b', 1), 3, 10)
+        array_cache.discard(lambda key: key[0] == 'a')
+        self.assertEqual(len(array_cache), 1)
+        self.assertEqual(array_cache.nbytes, 10)
+
+    def test_file_key(self):
+        """Test the key of a file changes when it is written again."""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'lst.tif')
+            with open(path, 'w') as out_file:
+                out_file.write('1')
+            key = cache.get_file_key(path)
+            os.utime(path, ns=(0, 10**9))
+            self.assertNotEqual(cache.get_file_key(path), key)
+            self.assertIsNone(cache.get_file_key('/vsimem/lst.tif'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,125 @@
+# coding=utf-8
+"""Incremental model test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import unittest
+
+import numpy as np
+
+from dattutdut import incremental, model
+
+from test.test_dattutdut_model import make_lst
+
+
+class DattutdutIncrementalTest(unittest.TestCase):
+    """Test only the stages with changed inputs are recomputed."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.lst = model.mask_zeros(make_lst())
+        self.params = model.ModelParameters(utc='2017-08-07T06:00:00')
+        self.model = incremental.IncrementalModel()
+
+    def assert_same_as_run_model(self, result, params, bands=None):
+        """Checks a result against a full model run."""
+        expected = model.run_model(self.lst, params, 13.0, 52.0, bands=bands)
+        self.assertEqual(sorted(result.fluxes), sorted(expected.fluxes))
+        for name, array in expected.fluxes.items():
+            np.testing.assert_array_equal(result[name], array)
+
+    def test_recomputed_stages(self):
+        """Test the stages that depend on a changed parameter."""
+        self.model.run(self.lst, self.params, 13.0, 52.0)
+        self.assertEqual(len(self.model.recomputed), 8)
+        first = self.model.run(self.lst, self.params, 13.0, 52.0)
+        self.assertEqual(self.model.recomputed, ())
+        water = first['water'].copy()
+        params = self.params.copy(time_period=1800)
+        result = self.model.run(self.lst, params, 13.0, 52.0)
+        self.assertEqual(self.model.recomputed, ('water',))
+        progress = []
+        self.model.run(self.lst, params, 13.0, 52.0, bands=['water'],
+                       callback=lambda *args: progress.append(args))
+        self.assertEqual(progress[-1], (6, 7, 'water'))
+        self.assert_same_as_run_model(result, params)
+        # the earlier result keeps its values
+        np.testing.assert_array_equal(first['water'], water)
+        params = params.copy(g_percentage=20)
+        result = self.model.run(self.lst, params, 13.0, 52.0)
+        self.assertEqual(self.model.recomputed, ('g', 'le', 'h', 'water'))
+        self.assert_same_as_run_model(result, params)
+        params = params.copy(tmax_thres=99)
+        result = self.model.run(self.lst, params, 13.0, 52.0)
+        self.assertEqual(len(self.model.recomputed), 8)
+        self.assert_same_as_run_model(result, params)
+
+    def test_new_lst(self):
+        """Test other temperatures recompute every stage."""
+        self.model.run(self.lst, self.params, 13.0, 52.0)
+        self.lst = model.mask_zeros(make_lst(seed=1))
+        result = self.model.run(self.lst, self.params, 13.0, 52.0)
+        self.assertEqual(len(self.model.recomputed), 8)
+        self.assert_same_as_run_model(result, self.params)
+
+    def test_lst_key(self):
+        """Test a new array with the key of the last run keeps the stages."""
+        key = ('lst.tif', 1, 100, 1, 'float32')
+        self.model.run(self.lst, self.params, 13.0, 52.0, key=key)
+        result = self.model.run(self.lst.copy(), self.params, 13.0, 52.0,
+                                key=key)
+        self.assertEqual(self.model.recomputed, ())
+        self.assert_same_as_run_model(result, self.params)
+        self.model.run(self.lst.copy(), self.params, 13.0, 52.0,
+                       key=key[:1] + (2,) + key[2:])
+        self.assertEqual(len(self.model.recomputed), 8)
+
+    def test_failed_stage(self):
+        """Test a stage that failed is computed again by the next run."""
+        self.model.run(self.lst, self.params, 13.0, 52.0)
+        compute_stage = self.model.compute_stage
+
+        def fail_water(name, resolved, mask):
+            """Fails like a cancelled or out of memory computation."""
+            if name == 'water':
+                raise MemoryError()
+            return compute_stage(name, resolved, mask)
+
+        self.model.compute_stage = fail_water
+        params = self.params.copy(time_period=1800)
+        with self.assertRaises(MemoryError):
+            self.model.run(self.lst, params, 13.0, 52.0)
+        self.model.compute_stage = compute_stage
+        result = self.model.run(self.lst, params, 13.0, 52.0)
+        self.assertEqual(self.model.recomputed, ('water',))
+        self.assert_same_as_run_model(result, params)
+
+    def test_selected_bands(self):
+        """Test stages left out of a run are updated by the next one."""
+        result = self.model.run(self.lst, self.params, 13.0, 52.0,
+                                bands=['ef'])
+        self.assertEqual(self.model.recomputed, ('ef',))
+        self.assert_same_as_run_model(result, self.params, ['ef'])
+        self.model.run(self.lst, self.params, 13.0, 52.0)
+        params = self.params.copy(surf_emis=0.98)
+        self.model.run(self.lst, params, 13.0, 52.0, bands=['g'])
+        self.assertEqual(self.model.recomputed, ('rn', 'g'))
+        # le, h and water still have the old rn and g
+        result = self.model.run(self.lst, params, 13.0, 52.0)
+        self.assertEqual(self.model.recomputed, ('le', 'h', 'water'))
+        self.assert_same_as_run_model(result, params)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutIncrementalTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,100 @@
+# coding=utf-8
+"""Instrumentation test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import batch, instrumentation
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+
+class DattutdutInstrumentationTest(unittest.TestCase):
+    """Test the stages are measured and passed to the hooks."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_measure(self):
+        """Test a stage is recorded and the value is returned."""
+        seen = []
+        profiler = instrumentation.Profiler('lst.tif', [seen.append])
+        value = profiler.measure('fluxes', np.ones, (100, 100), pixels=10000,
+                                 bytes_written=lambda value: value.nbytes)
+        self.assertEqual(value.shape, (100, 100))
+        self.assertEqual(seen, profiler.records)
+        record = profiler.records[0]
+        self.assertEqual((record.raster, record.stage, record.pixels),
+                         ('lst.tif', 'fluxes', 10000))
+        self.assertEqual(record.bytes_written, 80000)
+        self.assertGreaterEqual(record.peak_alloc, 80000)
+        # the pixels of the last stage are kept
+        profiler.measure('stats', np.mean, value)
+        self.assertEqual(profiler.records[1].pixels, 10000)
+        # without a profiler the function is only called
+        self.assertEqual(instrumentation.measure(None, 'stats', max, 1, 2,
+                                                 bytes_read=5), 2)
+
+    def test_global_hook(self):
+        """Test a hook of the module gets the records of every profiler."""
+        seen = []
+        instrumentation.add_hook(seen.append)
+        try:
+            instrumentation.Profiler('a').measure('read', len, 'abc')
+            instrumentation.Profiler('b').measure('read', len, 'abc')
+        finally:
+            instrumentation.remove_hook(seen.append)
+        self.assertEqual([record.raster for record in seen], ['a', 'b'])
+        self.assertEqual(instrumentation.hooks, [])
+
+    def test_batch_sidecar(self):
+        """Test the batch mode writes a sidecar next to the stats file."""
+        frame = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'),
+                               make_lst())
+        out_dir = os.path.join(self.tmp_dir, 'out')
+        seen = []
+        batch.run_batch([frame], ['2017-08-07T06:00:00'], out_dir=out_dir,
+                        profile=True, hooks=[seen.append])
+        stats_file = batch.get_output_name(frame, out_dir, '.csv')
+        sidecar = instrumentation.get_sidecar_file(stats_file)
+        self.assertEqual(os.path.dirname(sidecar), out_dir)
+        with open(sidecar) as in_file:
+            document = json.load(in_file)
+        self.assertEqual([stage['stage'] for stage in document['stages']],
+                         ['read', 'percentiles', 'fluxes', 'write', 'stats'])
+        self.assertEqual([record.stage for record in seen],
+                         ['read', 'percentiles', 'fluxes', 'write', 'stats'])
+        self.assertEqual(document['pixels'], 600)
+        self.assertEqual(document['stages'][0]['bytes_read'],
+                         os.path.getsize(frame))
+        self.assertEqual(document['stages'][4]['bytes_written'],
+                         os.path.getsize(stats_file))
+        self.assertGreater(document['bytes_written'],
+                           document['stages'][4]['bytes_written'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutInstrumentationTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""Job manifest test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dattutdut import cli, jobs, model
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+YAML_MANIFEST = '''
+defaults:
+  output_dir: out
+  parameters: {surf_emis: 0.98, g_percentage: 10}
+  options: {compress: ZSTD, block_size: 128}
+  bands: [le, water]
+jobs:
+  - input: 0.tif
+    utc: 2017-08-07T08:00:00
+  - input: 1.tif
+    utc: '2017-08-07T09:00:00'
+    output: special/1.tif
+    stats: false
+    parameters: {atm_trans: null}
+'''
+
+
+class DattutdutJobsTest(unittest.TestCase):
+    """Test the jobs of a manifest are run like a scheduler needs it."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.frames = [
+            write_lst_file(os.path.join(self.tmp_dir, '{}.tif'.format(i)),
+                           make_lst(12, 15, seed=i))
+            for i in range(2)]
+        self.manifest = os.path.join(self.tmp_dir, 'jobs.json')
+        self.write_manifest({'jobs': [
+            {'input': '0.tif', 'utc': '2017-08-07T08:00:00',
+             'output': 'out/0.tif'},
+            {'input': '1.tif', 'utc': '2017-08-07T09:00:00',
+             'output': 'out/1.tif', 'parameters': {'rn': 500}}]})
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def write_manifest(self, content):
+        """Writes a JSON manifest."""
+        with open(self.manifest, 'w') as out_file:
+            json.dump(content, out_file)
+
+    def test_load_yaml(self):
+        """Test defaults are merged into the jobs of a YAML manifest."""
+        try:
+            import yaml  # noqa: F401
+        except ImportError:
+            self.skipTest('PyYAML is not installed')
+        manifest = os.path.join(self.tmp_dir, 'jobs.yaml')
+        with open(manifest, 'w') as out_file:
+            out_file.write(YAML_MANIFEST)
+        first, second = jobs.load_jobs(manifest)
+        self.assertEqual(first.out_file, os.path.join(
+                self.tmp_dir, 'out', '0_qwatermodel.tif'))
+        self.assertEqual(first.stats_file, os.path.join(
+                self.tmp_dir, 'out', '0_qwatermodel.csv'))
+        self.assertEqual(first.params.surf_emis, 0.98)
+        self.assertEqual(first.params.atm_trans, 0.7)
+        self.assertEqual(first.params.utc, model.parse_utc(
+                '2017-08-07T08:00:00'))
+        self.assertEqual(first.options.compress, 'ZSTD')
+        self.assertEqual(first.bands, ('le', 'water'))
+        self.assertEqual(second.out_file, os.path.join(
+                self.tmp_dir, 'special', '1.tif'))
+        self.assertIsNone(second.stats_file)
+        self.assertIsNone(second.params.atm_trans)
+        self.assertEqual(second.params.g_percentage, 10.0)
+
+    def test_invalid_manifest(self):
+        """Test a wrong manifest stops before any job runs."""
+        for entry in ({'input': '0.tif'},
+                      {'input': '0.tif', 'utc': '2017-08-07'},
+                      {'input': '0.tif', 'utc': '2017-08-07T08:00:00',
+                       'parameters': {'surface_emis': 1.0}},
+                      {'input': '0.tif', 'utc': '2017-08-07T08:00:00',
+                       'ouput': 'x.tif'}):
+            self.write_manifest({'jobs': [entry]})
+            with self.assertRaises(ValueError):
+                jobs.load_jobs(self.manifest)
+
+    def test_skip_up_to_date(self):
+        """Test jobs are run once and again after the input changed."""
+        statuses = jobs.run_jobs(jobs.load_jobs(self.manifest), workers=2)
+        self.assertEqual([status.state for status in statuses],
+                         ['done', 'done'])
+        self.assertEqual(statuses[1].resolved.rn, 500.0)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, 'out',
+                                                    '0.csv')))
+        statuses = jobs.run_jobs(jobs.load_jobs(self.manifest))
+        self.assertEqual([status.state for status in statuses],
+                         ['skipped', 'skipped'])
+        # a newer input runs its job again
+        later = time.time() + 10
+        os.utime(self.frames[1], (later, later))
+        statuses = jobs.run_jobs(jobs.load_jobs(self.manifest))
+        self.assertEqual([status.state for status in statuses],
+                         ['skipped', 'done'])
+        statuses = jobs.run_jobs(jobs.load_jobs(self.manifest), force=True)
+        self.assertEqual([status.state for status in statuses],
+                         ['done', 'done'])
+
+    def test_run_command(self):
+        """Test the exit code is 1 if a job fails."""
+        self.assertEqual(cli.main(['run', self.manifest, '--quiet']), 0)
+        self.write_manifest({'jobs': [
+            {'input': '0.tif', 'utc': '2017-08-07T08:00:00',
+             'output': 'out/0.tif'},
+            {'input': 'missing.tif', 'utc': '2017-08-07T09:00:00'}]})
+        self.assertEqual(cli.main(['run', self.manifest, '--quiet']), 1)
+        self.write_manifest({'jobs': []})
+        self.assertEqual(cli.main(['run', self.manifest]), 1)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutJobsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
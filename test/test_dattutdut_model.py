@@ -0,0 +1,229 @@
+# coding=utf-8
+"""DATTUTDUT engine test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import unittest
+
+import numpy as np
+
+from dattutdut import model
+
+
+def make_lst(rows=20, cols=30, seed=42):
+    """Returns a synthetic land surface temperature image with some zeros."""
+    lst = np.random.RandomState(seed).uniform(
+        290.0, 320.0, (rows, cols)).astype(np.float32)
+    lst[0, :3] = 0.0
+    return lst
+
+
+def write_lst_file(in_file, lst, geo=(13.0, 0.001, 0, 52.0, 0, -0.001)):
+    """Writes a land surface temperature image to a GeoTIFF."""
+    from dattutdut import raster_io
+    in_raster = raster_io.gdal.GetDriverByName('GTiff').Create(
+        in_file, lst.shape[1], lst.shape[0], 1, raster_io.gdal.GDT_Float32)
+    in_raster.SetGeoTransform(geo)
+    in_raster.GetRasterBand(1).WriteArray(lst)
+    in_raster.FlushCache()
+    return in_file
+
+
+class DattutdutModelTest(unittest.TestCase):
+    """Test the DATTUTDUT engine works without QGIS."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.lst = model.mask_zeros(make_lst())
+        self.params = model.ModelParameters(utc='2017-08-07T06:00:00')
+
+    def test_mask_zeros(self):
+        """Test zeros are set to NaN."""
+        self.assertEqual(np.isnan(self.lst).sum(), 3)
+
+    def test_mask_nodata(self):
+        """Test the nodata value is masked and read-only data is kept."""
+        values = make_lst()
+        values[5, 5] = -9999.0
+        values.flags.writeable = False
+        lst = model.mask_zeros(values, 'float32', nodata=-9999.0)
+        self.assertEqual(np.isnan(lst).sum(), 4)
+        self.assertEqual(np.count_nonzero(values == 0.0), 3)
+        np.testing.assert_array_equal(model.get_valid_mask(lst),
+                                      ~np.isnan(lst))
+
+    def test_from_strings(self):
+        """Test empty dialog fields become None."""
+        params = model.ModelParameters.from_strings(
+            utc='2017-08-07T06:00:00', tmin='', surf_emis='0.98')
+        self.assertIsNone(params.tmin)
+        self.assertEqual(params.surf_emis, 0.98)
+        self.assertEqual(params.utc, '2017-08-07T06:00:00')
+
+    def test_resolve_parameters(self):
+        """Test tmin and tmax come from the percentiles of the image."""
+        resolved = model.resolve_parameters(self.lst, self.params, 13.0, 52.0)
+        valid = self.lst[~np.isnan(self.lst)]
+        self.assertAlmostEqual(resolved.tmin, np.percentile(valid, 0.5))
+        self.assertAlmostEqual(resolved.tmax, np.percentile(valid, 100))
+        self.assertEqual(resolved.air_temp, resolved.tmin)
+        self.assertIsNotNone(resolved.sol_elev_ang)
+        self.assertIsNone(self.params.tmin)
+
+    def test_energy_balance_closes(self):
+        """Test rn - g equals le + h."""
+        result = model.run_model(self.lst, self.params, 13.0, 52.0)
+        valid = ~np.isnan(self.lst)
+        np.testing.assert_allclose(
+            (result['rn'] - result['g'])[valid],
+            (result['le'] + result['h'])[valid], rtol=1e-5)
+
+    def test_clamp_evap_frac(self):
+        """Test ef is clamped to 0 to 1 for an image without NaN."""
+        lst = model.mask_zeros(make_lst()[1:])
+        result = model.run_model(lst, self.params, 13.0, 52.0)
+        self.assertTrue(np.all(result['ef'] >= 0.0))
+        self.assertTrue(np.all(result['ef'] <= 1.0))
+
+    def test_clamp_with_nodata(self):
+        """Test the valid pixels are clamped if the image has nodata."""
+        result = model.run_model(self.lst, self.params, 13.0, 52.0)
+        valid = result.valid
+        self.assertEqual(np.count_nonzero(~valid), 3)
+        self.assertTrue(np.all(result['ef'][valid] >= 0.0))
+        self.assertTrue(np.all(result['ef'][valid] <= 1.0))
+        for flux_name in model.output_bands:
+            self.assertTrue(np.all(np.isnan(result[flux_name][~valid])))
+        # clamp=False keeps the unclamped values
+        lst = self.lst.copy()
+        lst[1, 1] = 400.0
+        resolved = result.parameters.copy(tmin=300.0, tmax=310.0)
+        unclamped = model.compute_fluxes(lst, resolved, clamp=False)
+        clamped = model.compute_fluxes(lst, resolved)
+        self.assertGreater(unclamped['g'][1, 1] / unclamped['rn'][1, 1], 1.0)
+        self.assertAlmostEqual(clamped['g'][1, 1] / clamped['rn'][1, 1], 0.45,
+                               places=5)
+
+    def test_g_fraction(self):
+        """Test g is a fraction of rn and follows g_percentage."""
+        valid = ~np.isnan(self.lst)
+        means = []
+        for g_percentage in (10.0, 20.0, 30.0):
+            result = model.run_model(
+                self.lst, self.params.copy(g_percentage=g_percentage),
+                13.0, 52.0)
+            np.testing.assert_allclose(
+                result['g'][valid], result['rn'][valid] * g_percentage / 100,
+                rtol=1e-5)
+            means.append(np.nanmean(result['le']))
+        self.assertTrue(np.all(np.diff(means) < 0))
+        ratio = model.run_model(self.lst, self.params, 13.0, 52.0)
+        ratio = (ratio['g'] / ratio['rn'])[valid]
+        self.assertTrue(np.all((ratio >= 0.0) & (ratio <= 1.0)))
+
+    def test_fused_kernel(self):
+        """Test the fused kernel gives the values of the stepwise model."""
+        for changes in ({}, {'rn': 450.0}, {'g_percentage': 15.0}):
+            resolved = model.resolve_parameters(
+                self.lst, self.params.copy(**changes), 13.0, 52.0)
+            for lst in (self.lst, self.lst[1:]):
+                expected = model.compute_fluxes_stepwise(lst, resolved)
+                fluxes = model.compute_fluxes(lst, resolved)
+                # a manual rn is not rounded by rn*lst/lst
+                for name in expected:
+                    np.testing.assert_allclose(fluxes[name], expected[name],
+                                               rtol=1e-6 if changes else 0)
+
+    def test_output_buffers(self):
+        """Test the fluxes are written into the given buffers."""
+        resolved = model.resolve_parameters(self.lst, self.params, 13.0, 52.0)
+        buffers = model.allocate_buffers(self.lst.shape, self.lst.dtype,
+                                         model.output_bands)
+        fluxes = model.compute_fluxes(self.lst, resolved, out=buffers)
+        self.assertIs(fluxes['le'], buffers['le'])
+        self.assertNotIn('albedo', fluxes)
+        np.testing.assert_array_equal(
+            fluxes['water'], model.compute_fluxes(self.lst, resolved)['water'])
+
+    def test_selected_bands(self):
+        """Test only the requested bands are computed and returned."""
+        self.assertEqual(model.required_bands(['ef']), ('ef',))
+        self.assertEqual(model.required_bands('water'),
+                         ('rn', 'le', 'g', 'ef', 'water'))
+        self.assertEqual(model.required_bands(['g']), ('rn', 'g'))
+        with self.assertRaises(ValueError):
+            model.get_bands(['et'])
+        for changes in ({}, {'rn': 450.0}, {'g_percentage': 15.0}):
+            resolved = model.resolve_parameters(
+                self.lst, self.params.copy(**changes), 13.0, 52.0)
+            expected = model.compute_fluxes(self.lst, resolved)
+            for bands in (['ef'], ['water'], ['h'], ['le', 'g'], ['rn']):
+                fluxes = model.compute_fluxes(self.lst, resolved, bands=bands)
+                self.assertEqual(set(fluxes) - {'albedo'}, set(bands))
+                for name in fluxes:
+                    np.testing.assert_array_equal(fluxes[name], expected[name])
+
+    def test_manual_rn(self):
+        """Test a manual net radiation is used for every valid pixel."""
+        params = self.params.copy(rn=500.0, g_percentage=10.0)
+        result = model.run_model(self.lst, params, 13.0, 52.0)
+        valid = ~np.isnan(self.lst)
+        np.testing.assert_allclose(result['rn'][valid], 500.0)
+        self.assertTrue(np.all(np.isnan(result['rn'][~valid])))
+
+    def test_atm_trans_needs_utc(self):
+        """Test atm_trans can not be derived without utc."""
+        params = model.ModelParameters(atm_trans=None)
+        with self.assertRaises(ValueError):
+            model.run_model(self.lst, params, 13.0, 52.0)
+
+    def test_precision(self):
+        """Test the fluxes keep the dtype of the precision."""
+        lst = make_lst().astype(np.int16)
+        self.assertEqual(model.mask_zeros(lst.copy()).dtype, np.float64)
+        for precision in model.precisions:
+            result = model.run_model(model.mask_zeros(lst.copy(), precision),
+                                     self.params, 13.0, 52.0)
+            for flux_name in model.output_bands:
+                self.assertEqual(result[flux_name].dtype,
+                                 model.get_dtype(precision))
+        with self.assertRaises(ValueError):
+            model.mask_zeros(lst.copy(), 'float16')
+
+    def test_float32_tolerance(self):
+        """Test float32 results stay close to the float64 reference.
+
+        The difference of every pixel must be below 1e-5 of the largest
+        absolute value of its band, about 100 float32 rounding steps. A
+        relative tolerance per pixel does not work for h, which is the
+        difference of nearly equal values where ef is close to 1.
+        """
+        lst = make_lst(100, 100)
+        for params in (self.params, self.params.copy(g_percentage=10.0),
+                       model.ModelParameters(sw_irr=800.0)):
+            result32 = model.run_model(model.mask_zeros(lst.copy(), 'float32'),
+                                       params, 13.0, 52.0)
+            result64 = model.run_model(model.mask_zeros(lst.copy(), 'float64'),
+                                       params, 13.0, 52.0)
+            self.assertAlmostEqual(result32.parameters.tmin,
+                                   result64.parameters.tmin, places=4)
+            for flux_name in model.output_bands:
+                reference = result64[flux_name]
+                np.testing.assert_allclose(
+                    result32[flux_name], reference, rtol=0,
+                    atol=1e-5 * np.nanmax(np.abs(reference)), equal_nan=True)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutModelTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""Mosaic mode test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import cli, model, mosaic, streaming
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+GEO = (13.0, 0.001, 0, 52.0, 0, -0.001)
+# the second frame is 10 columns to the right and 5 rows down
+SHIFTED = (13.01, 0.001, 0, 51.995, 0, -0.001)
+
+
+class DattutdutMosaicTest(unittest.TestCase):
+    """Test overlapping frames are computed into one output grid."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lsts = [make_lst(seed=1), make_lst(seed=2)]
+        self.frames = [
+            write_lst_file(os.path.join(self.tmp_dir, '{}.tif'.format(index)),
+                           lst, geo)
+            for index, (lst, geo) in enumerate(zip(self.lsts,
+                                                   (GEO, SHIFTED)))]
+        self.params = model.ModelParameters(utc='2017-08-07T10:00:00')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def read_bands(self, out_file):
+        """Returns the bands of an output raster."""
+        from dattutdut import raster_io
+        out_raster = raster_io.open_raster(out_file)
+        return {flux_name: out_raster.GetRasterBand(band_number).ReadAsArray()
+                for band_number, flux_name in enumerate(model.output_bands, 1)}
+
+    def test_common_grid(self):
+        """Test the common grid covers all frames."""
+        geo, rows, cols = mosaic.get_common_grid([GEO, SHIFTED],
+                                                 [(20, 30), (20, 30)])
+        self.assertEqual((rows, cols), (25, 40))
+        self.assertEqual(geo, (13.0, 0.001, 0.0, 52.0, 0.0, -0.001))
+        geo, rows, cols = mosaic.get_common_grid(
+                [GEO, (13.0, 0.002, 0, 52.0, 0, -0.002)], [(20, 30), (5, 5)],
+                'lowest')
+        self.assertEqual((rows, cols), (10, 15))
+        rows, cols = mosaic.get_source_indices(SHIFTED, (20, 30), GEO,
+                                               (0, 0, 40, 25))
+        np.testing.assert_array_equal(cols[8:12], [-1, -1, 0, 1])
+        np.testing.assert_array_equal(rows[:6], [-1, -1, -1, -1, -1, 0])
+        with self.assertRaises(ValueError):
+            mosaic.check_north_up((13.0, 0.001, 0, 52.0, 0, 0.001))
+
+    def test_single_frame(self):
+        """Test a mosaic of one frame equals the streaming mode."""
+        mosaic_file = os.path.join(self.tmp_dir, 'mosaic.tif')
+        stream_file = os.path.join(self.tmp_dir, 'stream.tif')
+        mosaic.run_mosaic(self.frames[:1], mosaic_file, params=self.params,
+                          tile_size=8)
+        streaming.run_streaming(self.frames[0], stream_file, self.params)
+        expected = self.read_bands(stream_file)
+        for flux_name, band in self.read_bands(mosaic_file).items():
+            np.testing.assert_array_equal(band, expected[flux_name])
+
+    def test_cancel(self):
+        """Test a cancel from the callback deletes the unfinished mosaic."""
+        mosaic_file = os.path.join(self.tmp_dir, 'mosaic.tif')
+
+        def cancel(done, total):
+            """Cancels the run after the second window."""
+            if done == 2:
+                raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            mosaic.run_mosaic(self.frames, mosaic_file, params=self.params,
+                              tile_size=8, callback=cancel)
+        self.assertFalse(os.path.exists(mosaic_file))
+
+    def test_overlap_rules(self):
+        """Test the scene-wide tmin and tmax and the overlap rules."""
+        bands = {}
+        for rule in mosaic.overlap_rules:
+            out_file = os.path.join(self.tmp_dir, rule + '.tif')
+            resolved = mosaic.run_mosaic(self.frames, out_file,
+                                         params=self.params, rule=rule,
+                                         tile_size=16, precision='float64')
+            bands[rule] = self.read_bands(out_file)['le']
+        values = np.concatenate([lst[lst > 0] for lst in self.lsts])
+        self.assertAlmostEqual(resolved[0].tmin, np.percentile(values, 0.5),
+                               delta=0.01)
+        self.assertEqual(resolved[1].tmax, values.max())
+        first, last = bands['first'], bands['last']
+        self.assertEqual(first.shape, (25, 40))
+        # only the first frame, only the second frame and no frame
+        self.assertTrue(np.all(np.isnan(first[20:, :10])))
+        np.testing.assert_array_equal(first[1:5, 1:], last[1:5, 1:])
+        np.testing.assert_array_equal(first[21:, 11:], last[21:, 11:])
+        overlap = (slice(6, 20), slice(10, 30))
+        self.assertFalse(np.allclose(first[overlap], last[overlap]))
+        np.testing.assert_allclose(bands['mean'][overlap],
+                                   (first[overlap] + last[overlap]) / 2)
+        centre = bands['centre'][overlap]
+        self.assertTrue(np.all((centre == first[overlap]) |
+                               (centre == last[overlap])))
+
+    def test_mosaic_command(self):
+        """Test the mosaic subcommand."""
+        out_file = os.path.join(self.tmp_dir, 'out', 'mosaic.tif')
+        os.makedirs(os.path.dirname(out_file))
+        self.assertEqual(cli.main(
+                ['mosaic', self.tmp_dir, '--utc', '2017-08-07T10:00:00',
+                 '--out', out_file, '--overlap', 'mean', '--bands', 'le,ef',
+                 '--vrt-file', os.path.join(self.tmp_dir, 'out', 'lst.vrt')]),
+                0)
+        self.assertTrue(os.path.isfile(out_file))
+        with self.assertRaises(SystemExit):
+            cli.main(['mosaic', self.tmp_dir, '--utc', '2017-08-07T10:00:00',
+                      '--out', out_file, '--overlap', 'median'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutMosaicTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
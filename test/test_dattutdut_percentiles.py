@@ -0,0 +1,98 @@
+# coding=utf-8
+"""Percentile backend test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import unittest
+
+import numpy as np
+
+from dattutdut import model, percentiles
+
+from test.test_dattutdut_model import make_lst
+
+
+class DattutdutPercentilesTest(unittest.TestCase):
+    """Test the exact and the histogram percentiles."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.lst = model.mask_zeros(make_lst(200, 150))
+        self.valid = self.lst[~np.isnan(self.lst)]
+
+    def test_exact(self):
+        """Test the exact method equals np.percentile."""
+        tmin, tmax = percentiles.exact_percentiles(self.lst, [0.5, 99])
+        self.assertEqual(tmin, np.percentile(self.valid, 0.5))
+        self.assertEqual(tmax, np.percentile(self.valid, 99))
+        # the input is not changed
+        self.assertEqual(np.isnan(self.lst).sum(), 3)
+
+    def test_histogram(self):
+        """Test the histogram is within one bin of the exact values."""
+        values = percentiles.get_percentiles(
+            self.lst, [0, 0.5, 50, 100], 'histogram', resolution=0.01)
+        expected = np.percentile(self.valid, [0, 0.5, 50, 100])
+        np.testing.assert_allclose(values, expected, atol=0.01)
+        self.assertEqual(values[0], self.valid.min())
+        self.assertEqual(values[-1], self.valid.max())
+
+    def test_merge(self):
+        """Test merged block histograms equal the histogram of the image."""
+        lst = self.lst.copy()
+        lst[120:] += 40
+        whole = percentiles.HistogramPercentiles()
+        whole.update(lst)
+        merged = percentiles.HistogramPercentiles()
+        for block in (lst[:50], lst[50:120], lst[120:]):
+            histogram = percentiles.HistogramPercentiles()
+            histogram.update(block)
+            merged.merge(histogram)
+        self.assertEqual(merged.count, whole.count)
+        self.assertEqual(merged.nan_count, 3)
+        self.assertAlmostEqual(merged.percentiles([0.5])[0],
+                               whole.percentiles([0.5])[0], delta=0.01)
+
+    def test_widen(self):
+        """Test a range wider than max_bins widens the bins."""
+        lst = self.lst.copy()
+        lst[5, 5] = 1e9
+        histogram = percentiles.HistogramPercentiles(0.01)
+        histogram.update(lst)
+        self.assertGreater(histogram.resolution, 0.01)
+        self.assertLessEqual(histogram.counts.size, percentiles.max_bins)
+        self.assertEqual(histogram.percentiles([100])[0], 1e9)
+        # a histogram of the other blocks is widened when it is merged
+        merged = percentiles.HistogramPercentiles(0.01)
+        merged.update(lst[50:])
+        other = percentiles.HistogramPercentiles(0.01)
+        other.update(lst[:50])
+        merged.merge(other)
+        self.assertEqual(merged.resolution, histogram.resolution)
+        self.assertEqual(merged.count, histogram.count)
+        np.testing.assert_array_equal(merged.counts, histogram.counts)
+        with self.assertRaises(ValueError):
+            merged.merge(percentiles.HistogramPercentiles(0.03))
+
+    def test_get_tmin_tmax(self):
+        """Test tmin and tmax are only computed when not given."""
+        tmin, tmax = model.get_tmin_tmax(self.lst, None, 320.0, 0.5, 100)
+        self.assertEqual(tmin, np.percentile(self.valid, 0.5))
+        self.assertEqual(tmax, 320.0)
+        with self.assertRaises(ValueError):
+            model.get_tmin_tmax(self.lst, method='median')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutPercentilesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
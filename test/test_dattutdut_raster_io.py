@@ -0,0 +1,233 @@
+# coding=utf-8
+"""Raster output test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import model, raster_io
+
+from test.test_dattutdut_model import make_lst
+
+GEO = (13.0, 0.001, 0, 52.0, 0, -0.001)
+
+
+class DattutdutRasterIOTest(unittest.TestCase):
+    """Test the creation options of the output rasters."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.result = model.run_model(model.mask_zeros(make_lst(40, 50)),
+                                      model.ModelParameters(sw_irr=800.0),
+                                      13.0, 52.0)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_options(self):
+        """Test the default output is tiled and DEFLATE compressed."""
+        options = raster_io.OutputOptions().creation_options()
+        self.assertIn('TILED=YES', options)
+        self.assertIn('BLOCKXSIZE=256', options)
+        self.assertIn('COMPRESS=DEFLATE', options)
+        self.assertIn('PREDICTOR=3', options)
+        self.assertIn('BIGTIFF=IF_SAFER', options)
+
+    def test_compression_options(self):
+        """Test levels and LERC errors use the options of the driver."""
+        options = raster_io.OutputOptions(compress='zstd', level=9,
+                                          tiled=False).creation_options()
+        self.assertIn('ZSTD_LEVEL=9', options)
+        self.assertNotIn('TILED=YES', options)
+        options = raster_io.OutputOptions(compress='LERC_ZSTD',
+                                          max_z_error=0.001).creation_options()
+        self.assertIn('MAX_Z_ERROR=0.001', options)
+        self.assertFalse(any(option.startswith('PREDICTOR') for option in options))
+        options = raster_io.OutputOptions(cog=True, level=9,
+                                          overviews='auto').creation_options()
+        self.assertIn('BLOCKSIZE=256', options)
+        self.assertIn('LEVEL=9', options)
+        self.assertIn('PREDICTOR=YES', options)
+        self.assertIn('OVERVIEWS=AUTO', options)
+
+    def test_invalid_options(self):
+        """Test unknown compressions and odd block sizes are rejected."""
+        with self.assertRaises(ValueError):
+            raster_io.OutputOptions(compress='JPEG')
+        with self.assertRaises(ValueError):
+            raster_io.OutputOptions(block_size=100)
+        with self.assertRaises(ValueError):
+            raster_io.OutputOptions(bigtiff='MAYBE')
+
+    def test_overview_levels(self):
+        """Test automatic overviews halve the size until one tile."""
+        options = raster_io.OutputOptions(overviews='auto')
+        self.assertEqual(options.get_overview_levels(1000, 600), [2, 4])
+        self.assertEqual(options.get_overview_levels(200, 200), [])
+        self.assertEqual(raster_io.OutputOptions(
+            overviews=[2, 4, 8]).get_overview_levels(10, 10), [2, 4, 8])
+        self.assertEqual(raster_io.OutputOptions().get_overview_levels(
+            5000, 5000), [])
+
+    def test_write_tiled(self):
+        """Test a tiled output raster keeps the fluxes."""
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        raster_io.write_output_images(
+            out_file, self.result.fluxes, GEO, '',
+            options=raster_io.OutputOptions(block_size=16, overviews=[2]))
+        out_raster = raster_io.open_raster(out_file)
+        self.assertEqual(list(out_raster.GetRasterBand(1).GetBlockSize()),
+                         [16, 16])
+        for band_number, flux_name in enumerate(model.output_bands, 1):
+            np.testing.assert_array_equal(
+                out_raster.GetRasterBand(band_number).ReadAsArray(),
+                self.result[flux_name])
+
+    def test_write_selected_bands(self):
+        """Test only the requested bands are written, in the band order."""
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        raster_io.write_output_images(out_file, self.result.fluxes, GEO, '',
+                                      bands=['water', 'le'])
+        out_raster = raster_io.open_raster(out_file)
+        self.assertEqual(out_raster.RasterCount, 2)
+        self.assertEqual(out_raster.GetRasterBand(2).GetDescription(), 'water')
+        np.testing.assert_array_equal(
+            out_raster.GetRasterBand(2).ReadAsArray(), self.result['water'])
+
+    def test_write_band_files(self):
+        """Test every band gets its own file and the VRT stacks them."""
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        layer_file = raster_io.write_output_images(
+            out_file, self.result.fluxes, GEO, '', bands=['ef', 'h'],
+            options=raster_io.OutputOptions(vrt=True))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['out.vrt', 'out_ef.tif', 'out_h.tif'])
+        self.assertEqual(layer_file, os.path.join(self.tmp_dir, 'out.vrt'))
+        np.testing.assert_array_equal(raster_io.open_raster(os.path.join(
+            self.tmp_dir, 'out_ef.tif')).GetRasterBand(1).ReadAsArray(),
+            self.result['ef'])
+        vrt = raster_io.open_raster(layer_file)
+        np.testing.assert_array_equal(vrt.GetRasterBand(1).ReadAsArray(),
+                                      self.result['h'])
+
+    def test_write_progress(self):
+        """Test the callback sees every strip and can stop the writing."""
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        progress = []
+        raster_io.write_output_images(
+            out_file, self.result.fluxes, GEO, '',
+            options=raster_io.OutputOptions(block_size=16),
+            callback=lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress, [(16, 40), (32, 40), (40, 40)])
+        np.testing.assert_array_equal(raster_io.open_raster(
+            out_file).GetRasterBand(6).ReadAsArray(), self.result['water'])
+        os.remove(out_file)
+
+        def cancel(done, total):
+            raise KeyboardInterrupt()
+        with self.assertRaises(KeyboardInterrupt):
+            raster_io.write_output_images(
+                out_file, self.result.fluxes, GEO, '', callback=cancel,
+                options=raster_io.OutputOptions(block_size=16, vrt=True))
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_failed_finish(self):
+        """Test an error while the files are finished deletes them."""
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        finish_output_raster = raster_io.finish_output_raster
+
+        def fail(out_file, options=None):
+            """Fails like an overview or COG error."""
+            raise IOError('Could not build the overviews')
+
+        raster_io.finish_output_raster = fail
+        try:
+            with self.assertRaises(IOError):
+                raster_io.write_output_images(
+                    out_file, self.result.fluxes, GEO, '',
+                    options=raster_io.OutputOptions(band_files=True, vrt=True))
+        finally:
+            raster_io.finish_output_raster = finish_output_raster
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_read_cache(self):
+        """Test a raster is decoded once until it is written again."""
+        from test.test_dattutdut_model import write_lst_file
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'),
+                                 make_lst())
+        raster_io.lst_cache.clear()
+        lst, prj, geo = raster_io.read_lst_img(in_file)
+        self.assertFalse(lst.flags.writeable)
+        self.assertIs(raster_io.read_lst_img(in_file)[0], lst)
+        self.assertIsNot(raster_io.read_lst_img(in_file, 'float64')[0], lst)
+        self.assertIsNot(raster_io.read_lst_img(in_file, use_cache=False)[0],
+                         lst)
+        write_lst_file(in_file, make_lst(seed=1))
+        os.utime(in_file, ns=(0, 10**9))
+        new_lst = raster_io.read_lst_img(in_file)[0]
+        self.assertFalse(np.array_equal(new_lst, lst, equal_nan=True))
+        # the old versions of the file were dropped
+        self.assertEqual(len(raster_io.lst_cache), 1)
+
+    def test_nodata(self):
+        """Test the nodata value is read and written."""
+        from test.test_dattutdut_model import write_lst_file
+        values = make_lst()
+        values[1, 1] = -9999.0
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'),
+                                 values)
+        in_raster = raster_io.gdal.Open(in_file, raster_io.gdal.GA_Update)
+        in_raster.GetRasterBand(1).SetNoDataValue(-9999.0)
+        in_raster.FlushCache()
+        del in_raster
+        lst = raster_io.read_lst_img(in_file, use_cache=False)[0]
+        self.assertEqual(np.isnan(lst).sum(), 4)
+        for nodata in (float('nan'), -1.0):
+            out_file = os.path.join(self.tmp_dir, 'out{}.tif'.format(nodata))
+            raster_io.write_output_images(
+                out_file, self.result.fluxes, GEO, '', bands=['ef'],
+                options=raster_io.OutputOptions(nodata=nodata))
+            band = raster_io.open_raster(out_file).GetRasterBand(1)
+            written = band.ReadAsArray()
+            np.testing.assert_array_equal(band.GetNoDataValue(), nodata)
+            invalid = np.isnan(self.result['ef'])
+            np.testing.assert_array_equal(written[invalid], nodata)
+            np.testing.assert_array_equal(written[~invalid],
+                                          self.result['ef'][~invalid])
+
+    def test_write_cog(self):
+        """Test a COG is written without leaving the temporary file."""
+        try:
+            raster_io.get_cog_driver()
+        except IOError:
+            self.skipTest('GDAL has no COG driver')
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        raster_io.write_output_images(
+            out_file, self.result.fluxes, GEO, '',
+            options=raster_io.OutputOptions(cog=True, overviews='auto'))
+        self.assertEqual(os.listdir(self.tmp_dir), ['out.tif'])
+        out_raster = raster_io.open_raster(out_file)
+        np.testing.assert_array_equal(
+            out_raster.GetRasterBand(5).ReadAsArray(), self.result['ef'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutRasterIOTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Memory-mapped raw raster test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import model, raster_io, raw_io, streaming
+
+from test.test_dattutdut_model import make_lst
+
+GEO = (13.0, 0.5, 0.0, 52.0, 0.0, -0.5)
+
+
+class DattutdutRawIoTest(unittest.TestCase):
+    """Test ENVI rasters are memory-mapped and not changed."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lst = make_lst()
+
+    def tearDown(self):
+        """Runs after each test."""
+        raster_io.close_datasets()
+        raster_io.lst_cache.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, array, **kwargs):
+        return raw_io.write_envi(os.path.join(self.tmp_dir, name), array,
+                                 GEO, **kwargs)
+
+    def test_interleaves(self):
+        """Test every interleave and byte order gives the same bands."""
+        stack = np.stack([self.lst, self.lst + 1, self.lst + 2])
+        for interleave in raw_io.interleaves:
+            for byte_order in '<>':
+                in_file = self.write('lst_{}.bin'.format(interleave), stack,
+                                     interleave=interleave,
+                                     byte_order=byte_order)
+                self.assertTrue(raw_io.is_raw_raster(in_file))
+                raster = raw_io.RawRaster(in_file)
+                self.assertEqual(raster.GetGeoTransform(), GEO)
+                for band_number in (1, 2, 3):
+                    band = raster.GetRasterBand(band_number)
+                    np.testing.assert_array_equal(
+                            band.ReadAsArray(), stack[band_number - 1])
+                    np.testing.assert_array_equal(
+                            band.ReadAsArray(3, 2, 5, 4),
+                            stack[band_number - 1, 2:6, 3:8])
+                del raster, band
+
+    def test_read_lst_img(self):
+        """Test zeros are masked without changing the file."""
+        in_file = self.write('lst.bin', self.lst)
+        with open(in_file, 'rb') as input_file:
+            data = input_file.read()
+        self.assertIsInstance(raster_io.open_raster(in_file),
+                              raw_io.RawRaster)
+        lst, prj, geo = raster_io.read_lst_img(in_file, use_cache=False)
+        np.testing.assert_array_equal(
+                lst, model.mask_zeros(self.lst.copy(), 'float32'))
+        self.assertEqual(geo, GEO)
+        band = raster_io.open_raster(in_file).GetRasterBand(1)
+        self.assertFalse(band.ReadAsArray().flags.writeable)
+        self.assertEqual(np.count_nonzero(band.ReadAsArray() == 0), 3)
+        with open(in_file, 'rb') as input_file:
+            self.assertEqual(input_file.read(), data)
+
+    def test_integer_raster(self):
+        """Test integer rasters are converted to the precision."""
+        values = np.array([[0, 300], [310, 0]], dtype=np.int16)
+        in_file = self.write('lst.bin', values, byte_order='>')
+        lst = raster_io.read_lst_img(in_file, 'float64', use_cache=False)[0]
+        self.assertEqual(lst.dtype, np.float64)
+        np.testing.assert_array_equal(lst, [[np.nan, 300], [310, np.nan]])
+
+    def test_not_raw(self):
+        """Test compressed and missing headers are left to GDAL."""
+        in_file = self.write('lst.bin', self.lst)
+        self.assertFalse(raw_io.is_raw_raster(
+                os.path.join(self.tmp_dir, 'other.bin')))
+        with open(os.path.join(self.tmp_dir, 'lst.hdr'), 'a') as header:
+            header.write('file compression = 1\n')
+        self.assertFalse(raw_io.is_raw_raster(in_file))
+
+    def test_streaming(self):
+        """Test the streaming mode reads windows of the memory map."""
+        in_file = self.write('lst.bin', self.lst)
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        resolved = streaming.run_streaming(
+                in_file, out_file, model.ModelParameters(utc='2017-08-07T06:00:00'))
+        self.assertEqual((resolved.longitude, resolved.latitude), (13.0, 52.0))
+        self.assertTrue(os.path.exists(out_file))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutRawIoTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Solar geometry test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import datetime
+import unittest
+
+import numpy as np
+
+from dattutdut import model, solar
+
+from test.test_dattutdut_model import make_lst
+
+GEO = (13.0, 0.01, 0, 52.0, 0, -0.01)
+
+
+class DattutdutSolarTest(unittest.TestCase):
+    """Test the vectorized solar elevation angle."""
+
+    def setUp(self):
+        """Runs before each test."""
+        solar.clear_cache()
+
+    def test_scalar(self):
+        """Test the angle of a morning in Berlin."""
+        angle = solar.sol_elev_ang('2017-08-07T06:00:00', 13.4, 52.5)
+        self.assertIsInstance(angle, float)
+        self.assertAlmostEqual(angle, 20.1, delta=0.5)
+        self.assertAlmostEqual(
+            solar.sol_elev_ang(datetime.datetime(2017, 8, 7, 6), 13.4, 52.5),
+            angle)
+
+    def test_broadcast(self):
+        """Test times and locations broadcast like NumPy arrays."""
+        utcs = np.array(['2017-08-07T06:00:00', '2017-08-07T12:30:00',
+                         '2017-12-24T23:59:00'], dtype='datetime64[s]')
+        lons = np.array([-120.0, 0.0, 13.4, 170.0])
+        angles = solar.sol_elev_ang(utcs[:, np.newaxis], lons, 52.5)
+        self.assertEqual(angles.shape, (3, 4))
+        for i, utc in enumerate(utcs):
+            for j, lon in enumerate(lons):
+                self.assertAlmostEqual(angles[i, j],
+                                       solar.sol_elev_ang(utc, lon, 52.5),
+                                       places=10)
+
+    def test_grid(self):
+        """Test the coarse grid is close to the per-pixel grid."""
+        full = solar.sol_elev_ang_grid('2017-08-07T06:00:00', GEO, 60, 90)
+        coarse = solar.sol_elev_ang_grid('2017-08-07T06:00:00', GEO, 60, 90,
+                                         step=16)
+        self.assertEqual(full.shape, (60, 90))
+        np.testing.assert_allclose(coarse, full, atol=1e-3)
+        self.assertAlmostEqual(full[10, 20], solar.sol_elev_ang(
+            '2017-08-07T06:00:00', 13.0 + 20.5 * 0.01, 52.0 - 10.5 * 0.01),
+            places=10)
+        frames = solar.sol_elev_ang_grid(
+            ['2017-08-07T06:00:00', '2017-08-07T07:00:00'], GEO, 60, 90, step=8)
+        self.assertEqual(frames.shape, (2, 60, 90))
+        np.testing.assert_allclose(frames[0], full, atol=1e-3)
+
+    def test_cache(self):
+        """Test primed values are used for single times."""
+        utcs = [datetime.datetime(2017, 8, 7, hour) for hour in range(5, 9)]
+        solar.prime_cache(utcs, 13.4, 52.5)
+        self.assertEqual(len(solar._cache), 4)
+        self.assertEqual(model.get_sol_elev_ang('2017-08-07T07:00:00', 13.4, 52.5),
+                         solar.sol_elev_ang(utcs[2], 13.4, 52.5))
+        self.assertEqual(len(solar._cache), 4)
+
+    def test_per_pixel_model(self):
+        """Test per-pixel angles give per-pixel irradiance."""
+        lst = model.mask_zeros(make_lst())
+        params = model.ModelParameters(utc='2017-08-07T06:00:00',
+                                       atm_trans=None, atm_emis=None)
+        grid = solar.sol_elev_ang_grid(params.utc, GEO, *lst.shape)
+        result = model.run_model(lst, params, 13.0, 52.0, sol_elev_ang=grid)
+        self.assertEqual(np.shape(result.parameters.sw_irr), lst.shape)
+        # a grid with the angle of the corner everywhere gives the scalar run
+        corner = np.full(lst.shape, model.get_sol_elev_ang(params.utc, 13.0, 52.0))
+        per_pixel = model.run_model(lst, params, 13.0, 52.0,
+                                    sol_elev_ang=corner)
+        scalar = model.run_model(lst, params, 13.0, 52.0)
+        # per-pixel parameters are float64, so the rounding differs a little,
+        # the clamped g at the scale of rn
+        for flux_name in model.output_bands:
+            scale = scalar['rn' if flux_name == 'g' else flux_name]
+            np.testing.assert_allclose(
+                per_pixel[flux_name], scalar[flux_name], rtol=0,
+                atol=1e-5 * np.nanmax(np.abs(scale)))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutSolarTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,142 @@
+# coding=utf-8
+"""Statistics test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import model, stats
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+
+class DattutdutStatsTest(unittest.TestCase):
+    """Test the single pass statistics."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.lst = model.mask_zeros(make_lst(60, 40))
+        self.result = model.run_model(
+            self.lst, model.ModelParameters(utc='2017-08-07T06:00:00'),
+            13.0, 52.0)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def assert_matches_numpy(self, band_stats, values):
+        """Checks BandStatistics against the NumPy functions."""
+        valid = values[~np.isnan(values)].astype(np.float64)
+        self.assertEqual(band_stats.count, valid.size)
+        self.assertEqual(band_stats.nan_count, values.size - valid.size)
+        self.assertAlmostEqual(band_stats.mean, valid.mean(), places=6)
+        self.assertAlmostEqual(band_stats.std, valid.std(), places=6)
+        self.assertEqual(band_stats.min, valid.min())
+        self.assertEqual(band_stats.max, valid.max())
+
+    def test_band_statistics(self):
+        """Test all bands match NumPy after one pass."""
+        statistics = stats.get_statistics(self.result)
+        self.assert_matches_numpy(statistics['lst'], self.lst)
+        for flux_name in model.output_bands + ('albedo',):
+            self.assert_matches_numpy(statistics[flux_name],
+                                      self.result[flux_name])
+        values = statistics.as_dict()['le']
+        valid = self.result['le'][~np.isnan(self.result['le'])]
+        self.assertAlmostEqual(values['p50'], np.percentile(valid, 50),
+                               delta=0.02)
+
+    def test_merge_blocks(self):
+        """Test statistics of blocks merge to those of the whole image."""
+        statistics = stats.FluxStatistics()
+        for rows in (slice(0, 7), slice(7, 31), slice(31, 60)):
+            block = stats.FluxStatistics()
+            block.update({name: array[rows] for name, array in
+                          list(self.result.fluxes.items()) + [('lst', self.lst)]})
+            statistics.merge(block)
+        whole = stats.get_statistics(self.result)
+        for name in stats.stats_bands:
+            merged = statistics.as_dict()[name]
+            for key, value in whole.as_dict()[name].items():
+                self.assertAlmostEqual(merged[key], value, places=5)
+
+    def test_write_formats(self):
+        """Test the CSV and JSON files can be read back."""
+        statistics = stats.get_statistics(self.result)
+        csv_file = os.path.join(self.tmp_dir, 'stats.csv')
+        stats.write_stats_file(csv_file, 'lst.tif', self.result, statistics,
+                               'csv')
+        with open(csv_file, newline='') as in_file:
+            rows = {row['band']: row for row in csv.DictReader(in_file)}
+        self.assertEqual(set(rows), set(stats.stats_bands))
+        self.assertAlmostEqual(float(rows['ef']['mean']),
+                               statistics['ef'].mean)
+        json_file = os.path.join(self.tmp_dir, 'stats.json')
+        stats.write_stats_file(json_file, 'lst.tif', self.result, statistics,
+                               'json')
+        with open(json_file) as in_file:
+            document = json.load(in_file)
+        self.assertEqual(document['parameters']['utc'], '2017-08-07T06:00:00')
+        self.assertEqual(document['bands']['water']['count'],
+                         statistics['water'].count)
+        text_file = os.path.join(self.tmp_dir, 'stats.txt')
+        stats.write_stats_file(text_file, 'lst.tif', self.result)
+        with open(text_file) as in_file:
+            self.assertIn('evaporative fraction [-] ', in_file.read())
+
+    def test_wide_range(self):
+        """Test a sentinel pixel widens the histogram instead of failing."""
+        lst = self.lst.copy()
+        lst[10, 10] = 1e6
+        result = model.run_model(
+            lst, model.ModelParameters(utc='2017-08-07T06:00:00',
+                                       tmin=295.0, tmax=318.0), 13.0, 52.0)
+        csv_file = os.path.join(self.tmp_dir, 'stats.csv')
+        stats.write_stats_file(csv_file, 'lst.tif', result, stats_format='csv')
+        with open(csv_file, newline='') as in_file:
+            rows = {row['band']: row for row in csv.DictReader(in_file)}
+        self.assertAlmostEqual(float(rows['lst']['max']), 1e6)
+
+    def test_streaming_statistics(self):
+        """Test the streaming mode collects the statistics per window."""
+        from dattutdut import streaming
+        lst = make_lst(60, 40)
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'), lst)
+        stats_file = os.path.join(self.tmp_dir, 'stats.json')
+        params = model.ModelParameters(utc='2017-08-07T06:00:00', tmin=295.0,
+                                       tmax=318.0)
+        streaming.run_streaming(in_file, os.path.join(self.tmp_dir, 'out.tif'),
+                                params, tile_size=16, stats_file=stats_file,
+                                stats_format='json')
+        with open(stats_file) as in_file:
+            document = json.load(in_file)
+        result = model.run_model(model.mask_zeros(lst), params, 13.0, 52.0)
+        whole = stats.get_statistics(result).as_dict()
+        for name in stats.stats_bands:
+            self.assertAlmostEqual(document['bands'][name]['mean'],
+                                   whole[name]['mean'], places=4)
+            self.assertEqual(document['bands'][name]['count'],
+                             whole[name]['count'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutStatsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
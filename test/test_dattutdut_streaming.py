@@ -0,0 +1,160 @@
+# coding=utf-8
+"""Streaming mode test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import model, streaming
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+
+class DattutdutStreamingTest(unittest.TestCase):
+    """Test the window by window processing."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.lst = model.mask_zeros(make_lst(101, 77))
+        self.params = model.ModelParameters(utc='2017-08-07T06:00:00')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_windows_cover_raster(self):
+        """Test every pixel is covered by exactly one window."""
+        covered = np.zeros((101, 77), dtype=int)
+        for xoff, yoff, xsize, ysize in streaming.iter_windows(101, 77, 16, 16):
+            covered[yoff:yoff + ysize, xoff:xoff + xsize] += 1
+        self.assertTrue(np.all(covered == 1))
+
+    def test_striped_blocks_are_stacked(self):
+        """Test one-row blocks are combined into larger windows."""
+        windows = list(streaming.iter_windows(1000, 500, 1, 500,
+                                              min_pixels=50000))
+        self.assertEqual(len(windows), 10)
+        self.assertEqual(windows[0], (0, 0, 500, 100))
+
+    def test_windows_match_full_image(self):
+        """Test fluxes computed per window equal the full image."""
+        resolved = model.resolve_parameters(self.lst, self.params, 13.0, 52.0)
+        full = model.compute_fluxes(self.lst, resolved)
+        for xoff, yoff, xsize, ysize in streaming.iter_windows(101, 77, 32, 32):
+            window = (slice(yoff, yoff + ysize), slice(xoff, xoff + xsize))
+            # the valid pixels of every window are clamped as in the image
+            fluxes = model.compute_fluxes(self.lst[window].copy(), resolved)
+            for flux_name in model.output_bands:
+                np.testing.assert_allclose(
+                    fluxes[flux_name], full[flux_name][window], rtol=1e-6)
+
+    def assert_output_equal(self, out_file, result):
+        """Checks the bands of out_file against a ModelResult."""
+        from dattutdut import raster_io
+        out_raster = raster_io.open_raster(out_file)
+        for band_number, flux_name in enumerate(model.output_bands, 1):
+            np.testing.assert_allclose(
+                out_raster.GetRasterBand(band_number).ReadAsArray(),
+                result[flux_name], rtol=1e-5)
+
+    def test_run_streaming(self):
+        """Test the streaming mode writes the same raster as run_model."""
+        lst = make_lst(101, 77)
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'), lst)
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        params = self.params.copy(tmin=295.0, tmax=318.0)
+        streaming.run_streaming(in_file, out_file, params, tile_size=32)
+        result = model.run_model(model.mask_zeros(lst), params, 13.0, 52.0)
+        self.assert_output_equal(out_file, result)
+
+    def test_run_streaming_bands(self):
+        """Test the streaming mode writes only the requested bands."""
+        from dattutdut import raster_io
+        lst = make_lst(101, 77)
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'), lst)
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        params = self.params.copy(tmin=295.0, tmax=318.0)
+        streaming.run_streaming(in_file, out_file, params, tile_size=32,
+                                bands=['water'])
+        result = model.run_model(model.mask_zeros(lst), params, 13.0, 52.0)
+        out_raster = raster_io.open_raster(out_file)
+        self.assertEqual(out_raster.RasterCount, 1)
+        np.testing.assert_allclose(out_raster.GetRasterBand(1).ReadAsArray(),
+                                   result['water'], rtol=1e-5)
+
+    def test_scene_percentiles(self):
+        """Test the pre-pass finds tmin and tmax of the whole raster."""
+        lst = make_lst(101, 77)
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'), lst)
+        windows = list(streaming.iter_windows(101, 77, 16, 16))
+        for workers in (1, 3):
+            tmin, tmax, has_nan = streaming.scan_scene(
+                in_file, windows, self.params, workers=workers)
+            valid = lst[lst != 0.0]
+            self.assertAlmostEqual(tmin, np.percentile(valid, 0.5), delta=0.01)
+            self.assertAlmostEqual(tmax, valid.max(), places=4)
+            self.assertTrue(has_nan)
+
+    def test_run_streaming_parallel(self):
+        """Test thread and process workers write the same raster."""
+        lst = make_lst(101, 77)
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'), lst)
+        result = model.run_model(model.mask_zeros(lst), self.params.copy(
+            tmin=295.0, tmax=318.0), 13.0, 52.0)
+        for executor in ('thread', 'process'):
+            out_file = os.path.join(self.tmp_dir, executor + '.tif')
+            streaming.run_streaming(
+                in_file, out_file, self.params.copy(tmin=295.0, tmax=318.0),
+                tile_size=16, workers=3, executor=executor)
+            self.assert_output_equal(out_file, result)
+
+    def test_failed_window(self):
+        """Test a failing window deletes the unfinished output raster."""
+        lst = make_lst(101, 77)
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'), lst)
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        compute_window = streaming.compute_window
+        calls = []
+
+        def fail_third(*args):
+            """Fails like a cancelled run in the third window."""
+            calls.append(args[1])
+            if len(calls) == 3:
+                raise RuntimeError('cancelled')
+            return compute_window(*args)
+
+        streaming.compute_window = fail_third
+        try:
+            with self.assertRaises(RuntimeError):
+                streaming.run_streaming(
+                    in_file, out_file, self.params.copy(tmin=295.0, tmax=318.0),
+                    tile_size=32)
+        finally:
+            streaming.compute_window = compute_window
+        self.assertFalse(os.path.exists(out_file))
+
+    def test_unknown_executor(self):
+        """Test an unknown executor is rejected."""
+        with self.assertRaises(ValueError):
+            streaming.run_streaming('lst.tif', 'out.tif', executor='gpu')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutStreamingTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
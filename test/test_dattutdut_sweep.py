@@ -0,0 +1,122 @@
+# coding=utf-8
+"""Parameter sweep test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import model, stats, sweep
+
+from test.test_dattutdut_model import make_lst
+
+
+class DattutdutSweepTest(unittest.TestCase):
+    """Test the batched scenarios against single model runs."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.lst = model.mask_zeros(make_lst(), 'float64')
+        self.params = model.ModelParameters(utc='2017-08-07T06:00:00')
+
+    def test_grid(self):
+        """Test every combination of the grid is one scenario."""
+        scenarios = sweep.parameter_grid(surf_emis=[0.95, 1.0],
+                                         tmax_thres=[99, 100], air_temp=[300])
+        self.assertEqual(len(scenarios), 4)
+        self.assertEqual(scenarios[1], {'surf_emis': 0.95, 'tmax_thres': 100,
+                                        'air_temp': 300})
+        samples = sweep.monte_carlo_samples(
+            5, seed=1, surf_emis=(0.95, 1.0),
+            g_percentage=lambda rng, n: rng.normal(10, 1, n))
+        self.assertEqual(samples, sweep.monte_carlo_samples(
+            5, seed=1, surf_emis=(0.95, 1.0),
+            g_percentage=lambda rng, n: rng.normal(10, 1, n)))
+        self.assertTrue(all(0.95 <= sample['surf_emis'] <= 1.0
+                            for sample in samples))
+
+    def test_same_as_run_model(self):
+        """Test the fluxes and statistics of every scenario."""
+        scenarios = sweep.parameter_grid(surf_emis=[0.95, 1.0],
+                                         tmin_thres=[0.5, 2], time_period=[60])
+        # small blocks to test the blocking
+        result = sweep.run_sweep(self.lst, scenarios, self.params, 13.0, 52.0,
+                                 keep_fluxes=True, max_elements=256)
+        self.assertEqual(len(result), 4)
+        for index, scenario in enumerate(scenarios):
+            expected = model.run_model(self.lst, self.params.copy(**scenario),
+                                       13.0, 52.0)
+            whole = stats.get_statistics(expected)
+            for name in model.output_bands + ('albedo',):
+                np.testing.assert_array_equal(result.fluxes[name][index],
+                                              expected[name])
+                band_stats = result.statistics[index][name]
+                self.assertEqual(band_stats.count, whole[name].count)
+                self.assertEqual(band_stats.nan_count, whole[name].nan_count)
+                self.assertAlmostEqual(band_stats.mean, whole[name].mean)
+        # a higher tmin gives a higher evaporative fraction
+        self.assertGreater(result.get_sensitivity('tmin_thres', 'ef'), 0)
+
+    def test_float32(self):
+        """Test float32 sweeps are close to float32 model runs."""
+        lst = model.mask_zeros(make_lst())
+        scenarios = sweep.parameter_grid(g_percentage=[5, 10, 20])
+        result = sweep.run_sweep(lst, scenarios, self.params, 13.0, 52.0,
+                                 bands=['le'], keep_fluxes=True)
+        self.assertEqual(sorted(result.fluxes), ['albedo', 'le'])
+        self.assertEqual(result.fluxes['le'].dtype, np.float32)
+        for index, scenario in enumerate(scenarios):
+            expected = model.run_model(lst, self.params.copy(**scenario),
+                                       13.0, 52.0, bands=['le'])
+            np.testing.assert_allclose(
+                result.fluxes['le'][index], expected['le'], rtol=0,
+                atol=1e-5 * np.nanmax(np.abs(expected['le'])))
+        means = result.get_summary('le')
+        self.assertTrue(np.all(np.diff(means) < 0))
+
+    def test_invalid_scenarios(self):
+        """Test mixed equations and unknown parameters are rejected."""
+        with self.assertRaises(ValueError):
+            sweep.run_sweep(self.lst, [{'g_percentage': 10}, {}], self.params,
+                            13.0, 52.0)
+        with self.assertRaises(ValueError):
+            sweep.run_sweep(self.lst, [{'emissivity': 1.0}], self.params,
+                            13.0, 52.0)
+
+    def test_write_csv(self):
+        """Test one row is written per scenario."""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            result = sweep.run_sweep(
+                self.lst, sweep.parameter_grid(surf_emis=[0.97, 0.99]),
+                self.params, 13.0, 52.0, percentiles=())
+            out_file = os.path.join(tmp_dir, 'sweep.csv')
+            sweep.write_sweep_csv(out_file, result)
+            with open(out_file, newline='') as in_file:
+                rows = list(csv.DictReader(in_file))
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[1]['surf_emis'], '0.99')
+            self.assertAlmostEqual(float(rows[1]['le_mean']),
+                                   result.statistics[1]['le'].mean)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutSweepTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""Temporal upscaling test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import cli, model, temporal
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+UTCS = ['2017-08-07T08:00:00', '2017-08-07T09:00:00', '2017-08-07T11:00:00']
+
+
+class DattutdutTemporalTest(unittest.TestCase):
+    """Test frames are integrated to the evapotranspiration of a period."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lst = model.mask_zeros(make_lst(), 'float64')
+        # a manual rn and air_temp give the same le at every utc
+        self.params = model.ModelParameters(rn=500.0, air_temp=295.0)
+        self.result = model.run_model(self.lst, self.params, 13.0, 52.0)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_regrid(self):
+        """Test a shifted frame is put onto the reference grid."""
+        geo = (13.0, 0.001, 0, 52.0, 0, -0.001)
+        shifted = (13.002, 0.001, 0, 51.999, 0, -0.001)
+        lst = make_lst()
+        self.assertIs(temporal.regrid(lst, geo, geo, lst.shape), lst)
+        regridded = temporal.regrid(lst, shifted, geo, lst.shape)
+        np.testing.assert_array_equal(regridded[1:, 2:], lst[:-1, :-2])
+        self.assertTrue(np.all(np.isnan(regridded[0])))
+        self.assertTrue(np.all(np.isnan(regridded[:, :2])))
+        with self.assertRaises(ValueError):
+            temporal.regrid(lst, (13.0, 0.001, 0.1, 52.0, 0, -0.001), geo,
+                            lst.shape)
+
+    def test_trapezoid(self):
+        """Test a constant le gives le times the covered time."""
+        accumulator = temporal.TemporalAccumulator(
+                self.lst.shape, start='2017-08-07T06:00:00',
+                end='2017-08-07T14:00:00')
+        for utc in UTCS:
+            accumulator.add(utc, self.result)
+        result = accumulator.finish()
+        valid = self.result.valid
+        # 2 h rising from 0, 3 h between the frames, 3 h falling to 0
+        expected = model.get_water(self.result['le'], 5.5 * 3600, 295.0)
+        np.testing.assert_allclose(result['et'][valid], expected[valid])
+        np.testing.assert_allclose(result['hours'][valid], 8.0)
+        np.testing.assert_allclose(result['ef'][valid],
+                                   self.result['ef'][valid])
+        np.testing.assert_array_equal(result['frames'][valid], 3)
+        self.assertTrue(np.all(np.isnan(result['et'][~valid])))
+        self.assertEqual(model.format_utc(result.start), '2017-08-07T06:00:00')
+        with self.assertRaises(ValueError):
+            accumulator = temporal.TemporalAccumulator(self.lst.shape)
+            accumulator.add(UTCS[1], self.result)
+            accumulator.add(UTCS[0], self.result)
+
+    def test_ef_method(self):
+        """Test the mean ef is multiplied with the available energy."""
+        accumulator = temporal.TemporalAccumulator(
+                self.lst.shape, 'ef', available_energy=12.0)
+        for utc in UTCS:
+            accumulator.add(utc, self.result)
+        result = accumulator.finish()
+        valid = self.result.valid
+        np.testing.assert_allclose(
+                result['et'][valid], self.result['ef'][valid] * 12.0 /
+                temporal.get_latent_heat(295.0))
+        # integrated from rn - g, le over the frames equals ef * (rn - g)
+        trapezoid = temporal.TemporalAccumulator(self.lst.shape)
+        integrated = temporal.TemporalAccumulator(self.lst.shape, 'ef')
+        for utc in UTCS:
+            trapezoid.add(utc, self.result)
+            integrated.add(utc, self.result)
+        np.testing.assert_allclose(integrated.finish()['et'][valid],
+                                   trapezoid.finish()['et'][valid])
+
+    def test_run_temporal(self):
+        """Test the frames of the files are integrated and written."""
+        geos = [(13.0, 0.001, 0, 52.0, 0, -0.001),
+                (13.001, 0.001, 0, 52.0, 0, -0.001),
+                (13.0, 0.001, 0, 52.0, 0, -0.001)]
+        frames = [write_lst_file(os.path.join(self.tmp_dir,
+                                              '{}.tif'.format(index)),
+                                 make_lst(seed=index), geo)
+                  for index, geo in enumerate(geos)]
+        out_file = os.path.join(self.tmp_dir, 'et.tif')
+        result = temporal.run_temporal(frames, UTCS, self.params, out_file,
+                                       precision='float64')
+        from dattutdut import raster_io
+        out_raster = raster_io.open_raster(out_file)
+        self.assertEqual(out_raster.RasterCount, len(temporal.temporal_bands))
+        np.testing.assert_allclose(
+                out_raster.GetRasterBand(1).ReadAsArray(), result['et'])
+        # the first column of the shifted frame is outside of it
+        self.assertTrue(np.all(result['frames'][1:, 0] == 2))
+        self.assertTrue(np.all(result['hours'][1:, 0] == 0))
+        self.assertTrue(np.all(result['hours'][1:, 1:] == 3))
+
+    def test_temporal_command(self):
+        """Test the temporal subcommand."""
+        frames = [write_lst_file(os.path.join(self.tmp_dir,
+                                              '{}.tif'.format(index)),
+                                 make_lst(seed=index))
+                  for index in range(3)]
+        out_file = os.path.join(self.tmp_dir, 'et.tif')
+        self.assertEqual(cli.main(
+                ['temporal', self.tmp_dir, '--start', '2017-08-07T08:00:00',
+                 '--interval', '3600', '--out', out_file, '--method', 'ef']),
+                0)
+        self.assertTrue(os.path.isfile(out_file))
+        self.assertEqual(cli.main(['temporal', frames[0], '--utc', UTCS[0],
+                                   '--out', out_file, '--method', 'ef',
+                                   '--period-start', '2017-08-07T09:00:00']),
+                         1)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutTemporalTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
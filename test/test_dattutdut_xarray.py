@@ -0,0 +1,128 @@
+# coding=utf-8
+"""DATTUTDUT xarray backend test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dattutdut import model, xarray_backend
+
+from test.test_dattutdut_model import make_lst
+
+try:
+    xarray = xarray_backend.import_xarray()
+except ImportError:
+    xarray = None
+
+
+def make_dataarray(lst, chunks=None):
+    """Returns lst as DataArray with the pixel centres as coordinates."""
+    rows, cols = lst.shape
+    lst = xarray.DataArray(
+        lst, dims=('y', 'x'),
+        coords={'y': 52.0 - 0.001 * (np.arange(rows) + 0.5),
+                'x': 13.0 + 0.001 * (np.arange(cols) + 0.5)})
+    if chunks is not None:
+        lst = lst.chunk(chunks)
+    return lst
+
+
+@unittest.skipIf(xarray is None, 'xarray and dask are not installed')
+class DattutdutXarrayTest(unittest.TestCase):
+    """Test the lazy xarray backend gives the fluxes of the model."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lst = make_lst(40, 50)
+        self.params = model.ModelParameters(utc='2017-08-07T06:00:00')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_geo_transform(self):
+        """Test the geotransform comes from the coordinates or attrs."""
+        lst = make_dataarray(self.lst)
+        np.testing.assert_allclose(xarray_backend.get_geo_transform(lst),
+                                   (13.0, 0.001, 0, 52.0, 0, -0.001))
+        lst.attrs['transform'] = (10.0, 0.0, 7.0, 0.0, -10.0, 50.0)
+        self.assertEqual(xarray_backend.get_geo_transform(lst),
+                         (7.0, 10.0, 0.0, 50.0, 0.0, -10.0))
+        with self.assertRaises(ValueError):
+            xarray_backend.get_spatial_dims(lst.expand_dims('time'))
+
+    def test_lazy_fluxes(self):
+        """Test the chunked fluxes are lazy and equal the model."""
+        lst = make_dataarray(self.lst, {'y': 16, 'x': 20})
+        dataset = xarray_backend.run_model_dataset(lst, self.params)
+        self.assertEqual(set(dataset.data_vars), set(model.output_bands))
+        self.assertEqual(dataset['le'].chunks, lst.chunks)
+        self.assertTrue(hasattr(dataset['le'].data, 'dask'))
+        # the percentiles of the histogram pre-pass
+        expected = model.run_model(model.mask_zeros(self.lst.copy()),
+                                   self.params, 13.0, 52.0,
+                                   percentile_method='histogram')
+        self.assertAlmostEqual(dataset.attrs['dattutdut_tmin'],
+                               expected.parameters.tmin, places=4)
+        for flux_name in model.output_bands:
+            np.testing.assert_allclose(dataset[flux_name].values,
+                                       expected[flux_name], rtol=1e-5,
+                                       atol=1e-5, equal_nan=True)
+
+    def test_input_unchanged(self):
+        """Test the zeros of an in-memory DataArray are not set to NaN."""
+        lst = make_dataarray(self.lst.copy())
+        dataset = xarray_backend.run_model_dataset(lst, self.params)
+        dataset['le'].values
+        np.testing.assert_array_equal(lst.values, self.lst)
+        self.assertEqual(np.count_nonzero(lst.values == 0.0), 3)
+
+    def test_nodata_and_bands(self):
+        """Test the nodata value is masked and only the bands are built."""
+        values = self.lst.copy()
+        values[5, 5] = -9999.0
+        lst = make_dataarray(values, 10)
+        lst.attrs['nodata'] = -9999.0
+        params = self.params.copy(tmin=295.0, tmax=318.0)
+        dataset = xarray_backend.run_model_dataset(lst, params, bands=['ef'])
+        self.assertEqual(list(dataset.data_vars), ['ef'])
+        ef = dataset['ef'].values
+        self.assertEqual(np.count_nonzero(np.isnan(ef)), 4)
+        self.assertTrue(np.isnan(ef[5, 5]))
+
+    def test_write_dataset(self):
+        """Test the fluxes are written chunk by chunk to a zarr store."""
+        try:
+            import zarr  # noqa: F401
+        except ImportError:
+            self.skipTest('zarr is not installed')
+        lst = make_dataarray(self.lst, 16)
+        dataset = xarray_backend.run_model_dataset(lst, self.params)
+        out_file = os.path.join(self.tmp_dir, 'fluxes.zarr')
+        xarray_backend.write_dataset(dataset, out_file, scheduler='threads')
+        written = xarray_backend.open_lst(out_file, 'water')
+        np.testing.assert_allclose(written.values, dataset['water'].values,
+                                   equal_nan=True)
+        with self.assertRaises(ValueError):
+            xarray_backend.get_dataset_format('fluxes.tif')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DattutdutXarrayTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Processing algorithm test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'el-flori@gmx.de'
+__date__ = '2020-01-11'
+__copyright__ = 'Copyright 2020, Florian Ellsäßer'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from qgis.core import QgsProcessingContext, QgsProcessingFeedback
+
+from qwatermodel_algorithm import QWaterModelAlgorithm, number_parameters
+from qwatermodel_provider import QWaterModelProvider
+
+from utilities import get_qgis_app
+QGIS_APP = get_qgis_app()
+
+from test.test_dattutdut_model import make_lst, write_lst_file
+
+
+class QWaterModelAlgorithmTest(unittest.TestCase):
+    """Test the Processing algorithm works."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.algorithm = QWaterModelAlgorithm().create()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_provider(self):
+        """Test the provider lists the algorithm."""
+        provider = QWaterModelProvider()
+        provider.loadAlgorithms()
+        self.assertEqual([algorithm.name() for algorithm in provider.algorithms()],
+                         ['dattutdut'])
+
+    def test_parameters(self):
+        """Test every field of the dialog is a parameter."""
+        names = [parameter.name() for parameter in
+                 self.algorithm.parameterDefinitions()]
+        for name, label, default, field in number_parameters:
+            self.assertIn(name, names)
+        self.assertIn('UTC', names)
+
+    def test_run(self):
+        """Test the output raster and the stats file are written."""
+        in_file = write_lst_file(os.path.join(self.tmp_dir, 'lst.tif'),
+                                 make_lst())
+        out_file = os.path.join(self.tmp_dir, 'out.tif')
+        stats_file = os.path.join(self.tmp_dir, 'stats.csv')
+        results, ok = self.algorithm.run(
+            {'INPUT': in_file, 'UTC': '2017-08-07T06:00:00',
+             'OUTPUT': out_file, 'OUTPUT_STATS': stats_file},
+            QgsProcessingContext(), QgsProcessingFeedback())
+        self.assertTrue(ok)
+        self.assertEqual(results['OUTPUT'], out_file)
+        self.assertTrue(os.path.exists(out_file))
+        self.assertTrue(os.path.exists(stats_file))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(QWaterModelAlgorithmTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)